@@ -1,26 +1,149 @@
 import pandas
 from grammar import aminoacid_grammar
-from models import SyntaxRule
-from refinement_functions import split_multiple_aa, join_multiple_aa
+from models import parse_grammar
+from refinement_functions import split_multiple_aa, split_multiple_aa_groups, join_multiple_aa, read_parsed_parts, get_parsed_capture_groups
 import pickle
 import json
 import re
-from common_autofix_functions import apply_multi_shift_fix, apply_old_coords_fix, apply_histone_fix, get_preferred_fix, apply_name_fix
+from common_autofix_functions import apply_fixes_by_gene, apply_name_fix
 import argparse
+from results_io import output_formats, check_output_formats, read_results, write_results
+
+
+def first_number(mutation: str) -> int:
+    """Sorting key of mutations, the first number in them (there might be two numbers in the deletions)"""
+    return int(re.search(r'\d+', mutation).group()) if mutation != '?' else 0
+
+
+def groupby_sort_key(key: tuple) -> tuple:
+    """Sort keys like pandas groupby does, with the numbers before the strings (solution_index can be '' or a number)"""
+    return tuple((0, v) if isinstance(v, int) else (1, v) for v in key)
+
+
+def get_allele_mutations(data_subset: pandas.DataFrame, capture_groups: list[list], multiple_aa_regex: str) -> list[tuple]:
+    """
+    Explode the alleles by reference, allele part and single mutation (the multiple_aa are split into single aminoacid
+    mutations), returning a list of tuples (systematic_id, allele_description, allele_name, reference, rule_applied, sequence_error,
+    allele_part, mutation), sorted by the first number in the mutation and without duplicates. The allele_description is the
+    corrected one if the syntax was wrong.
+    """
+    allele_mutations = list()
+    for systematic_id, allele_description, allele_name, references, change_description_to, rules_applied, sequence_error, groups in zip(
+            data_subset['systematic_id'], data_subset['allele_description'], data_subset['allele_name'], data_subset['reference'],
+            data_subset['change_description_to'], data_subset['rules_applied'], data_subset['sequence_error'], capture_groups):
+
+        # Keep correct description only
+        if change_description_to != '':
+            allele_description = change_description_to
+
+        allele_parts = allele_description.split(',')
+        rules_applied = rules_applied.split('|')
+        sequence_errors = ['' for _ in rules_applied] if sequence_error == '' else sequence_error.split('|')
+        if not len(allele_parts) == len(rules_applied) == len(sequence_errors) == len(groups):
+            raise ValueError(f'allele parts, rules applied and sequence errors must have matching element counts: {allele_description}')
+
+        exploded_parts = list()
+        for allele_part, rule_applied, part_sequence_error, part_groups in zip(allele_parts, rules_applied, sequence_errors, groups):
+            if rule_applied != 'amino_acid_mutation:multiple_aa':
+                mutations = [allele_part]
+            elif part_groups is None:
+                mutations = split_multiple_aa(allele_part, multiple_aa_regex)
+            else:
+                mutations = split_multiple_aa_groups(part_groups)
+            exploded_parts.extend((rule_applied, part_sequence_error, allele_part, mutation) for mutation in mutations)
+
+        for reference in references.split(','):
+            allele_mutations.extend((systematic_id, allele_description, allele_name, reference) + p for p in exploded_parts)
+
+    # Sort the mutations by the first number in them, and drop duplicates that may have arised when splitting
+    return list(dict.fromkeys(sorted(allele_mutations, key=lambda x: first_number(x[7]))))
+
+
+def aggregate_mutations_by_reference(allele_mutations: list[tuple]) -> dict[tuple[str, str], str]:
+    """
+    Aggregate the mutations of all alleles of a gene in a publication, as a comma-separated string, for the
+    (systematic_id, reference) pairs in which there are sequence errors.
+    """
+    mutations_by_reference = dict()
+    has_errors = dict()
+    # Only the columns systematic_id, allele_name, reference, sequence_error, mutation, without duplicates
+    for systematic_id, allele_name, reference, sequence_error, mutation in dict.fromkeys((m[0], m[2], m[3], m[5], m[7]) for m in allele_mutations):
+        key = (systematic_id, reference)
+        mutations_by_reference.setdefault(key, list()).append(mutation)
+        has_errors[key] = has_errors.get(key, False) or sequence_error != ''
+
+    return {key: ','.join(mutations_by_reference[key]) for key in sorted(mutations_by_reference) if has_errors[key]}
+
+
+def get_mutation_fixes(references_with_errors: dict[tuple[str, str], str], genome, coordinate_changes_dict, processes: int = None) -> dict[tuple[str, str, str], list[tuple]]:
+    """
+    Apply the fixes (see apply_fixes_by_gene) to the mutations aggregated by reference, and return a dictionary
+    (systematic_id, reference, mutation) -> list of (auto_fix_to, auto_fix_comment, solution_index), one per solution.
+    """
+    aggregated_data = pandas.DataFrame([(systematic_id, reference, mutations) for (systematic_id, reference), mutations in references_with_errors.items()], columns=['systematic_id', 'reference', 'mutations'])
+    fixes = apply_fixes_by_gene(aggregated_data, genome, coordinate_changes_dict, 'mutations', processes)
+
+    mutation_fixes = dict()
+    for systematic_id, reference, mutations, auto_fix_to, auto_fix_comment in zip(aggregated_data['systematic_id'], aggregated_data['reference'], aggregated_data['mutations'], fixes['auto_fix_to'], fixes['auto_fix_comment']):
+        if auto_fix_to == '':
+            continue
+
+        # There could be multiple solutions, in which case we add the index of the solution
+        solutions = auto_fix_to.split('|')
+        mutation_list = mutations.split(',')
+        for solution_index, solution in enumerate(solutions):
+            solution = solution.split(',')
+            if len(mutation_list) != len(solution):
+                print(mutation_list, solution)
+                raise ValueError('mutations and auto_fix_to must have matching element counts')
+            for mutation, fixed_mutation in zip(mutation_list, solution):
+                mutation_fixes.setdefault((systematic_id, reference, mutation), list()).append((fixed_mutation, auto_fix_comment, solution_index if len(solutions) > 1 else ''))
+
+    return mutation_fixes
+
+
+def get_allele_fixes(allele_mutations: list[tuple], mutation_fixes: dict[tuple[str, str, str], list[tuple]]) -> pandas.DataFrame:
+    """
+    Apply the fixes of the mutations to the alleles that have sequence errors, returning a dataframe with the columns
+    systematic_id, allele_description, allele_name, auto_fix_comment, solution_index, auto_fix_to and reference (the
+    publications where the fix was found, comma-separated).
+    """
+    fixed_mutations = list()
+    multiple_aa_fixes = dict()
+    for systematic_id, allele_description, allele_name, reference, rule_applied, sequence_error, allele_part, mutation in allele_mutations:
+        if sequence_error == '':
+            continue
+        for auto_fix_to, auto_fix_comment, solution_index in mutation_fixes.get((systematic_id, reference, mutation), []):
+            # The multiple_aa are aggregated again
+            if rule_applied == 'amino_acid_mutation:multiple_aa':
+                key = (systematic_id, allele_description, allele_name, reference, rule_applied, sequence_error, allele_part, auto_fix_comment, solution_index)
+                multiple_aa_fixes.setdefault(key, list()).append(auto_fix_to)
+            else:
+                fixed_mutations.append((systematic_id, allele_description, allele_name, reference, auto_fix_comment, solution_index, auto_fix_to))
+
+    for key in sorted(multiple_aa_fixes, key=groupby_sort_key):
+        fixed_mutations.append(key[:4] + key[7:] + (join_multiple_aa(multiple_aa_fixes[key]),))
+
+    # Apply the fix by joining the fixed mutations of each allele, sorted by the first number in them
+    allele_fixes = dict()
+    for fixed_mutation in sorted(dict.fromkeys(fixed_mutations), key=lambda x: first_number(x[6])):
+        allele_fixes.setdefault(fixed_mutation[:6], list()).append(fixed_mutation[6])
 
+    # Merge solutions from different PMIDs that are the same
+    allele_fixes_references = dict()
+    for key in sorted(allele_fixes, key=groupby_sort_key):
+        systematic_id, allele_description, allele_name, reference, auto_fix_comment, solution_index = key
+        allele_fixes_references.setdefault((systematic_id, allele_description, allele_name, auto_fix_comment, solution_index, ','.join(allele_fixes[key])), list()).append(reference)
 
-def main(genome_file, coordinate_changes_file, allele_results_file, output_dir):
-    with open(genome_file, 'rb') as ins:
-        genome = pickle.load(ins)
-
-    with open(coordinate_changes_file) as ins:
-        coordinate_changes_dict = json.load(ins)
-
-    syntax_rules = [SyntaxRule.parse_obj(r) for r in aminoacid_grammar]
-    syntax_rules_dict = {f'{r.type}:{r.rule_name}': r for r in syntax_rules}
+    columns = ['systematic_id', 'allele_description', 'allele_name', 'auto_fix_comment', 'solution_index', 'auto_fix_to', 'reference']
+    return pandas.DataFrame([key + (','.join(allele_fixes_references[key]),) for key in sorted(allele_fixes_references, key=groupby_sort_key)], columns=columns)
 
-    data = pandas.read_csv(allele_results_file, sep='\t', na_filter=False)
 
+def get_aminoacid_alleles(data: pandas.DataFrame) -> pandas.Series:
+    """
+    Boolean mask of the rows of the allele_qc.py output that can be fixed (aminoacid alleles, excluding CTDs and the
+    multiple_aa of some types, see below).
+    """
     # We only want aminoacid alleles. We don't remove the ones without errors yet, because if there are errors in a session
     # for a given allele, other positions may be silent errors (residue matches by chance). We therefore aggregate both with and without errors
     # We exclude CTDs from the fixing, because they would be too complicated to include (they may contain commas, for instance)
@@ -36,123 +159,45 @@ def main(genome_file, coordinate_changes_file, allele_results_file, output_dir):
             print('\n'.join(data.loc[exclude_rows, 'allele_description']))
         aminoacid_alleles = aminoacid_alleles & ~exclude_rows
     aminoacid_alleles = aminoacid_alleles & ~data['rules_applied'].str.contains('multi_aa')
+    return aminoacid_alleles
 
-    data_subset = data.loc[aminoacid_alleles, ['systematic_id', 'allele_description', 'allele_name', 'reference', 'change_description_to', 'rules_applied', 'sequence_error']]
-
-    # Explode the references
-    data_subset.loc[:, 'reference'] = data_subset['reference'].apply(str.split, args=[','])
-    data_subset = data_subset.explode('reference')
-
-    # Keep correct description only
-    data_subset.loc[data_subset['change_description_to'] != '', 'allele_description'] = data_subset.loc[data_subset['change_description_to'] != '', 'change_description_to']
-    data_subset.drop(columns='change_description_to', inplace=True)
 
-    # Copy allele_description to explode it
-    data_subset['allele_description_exploded'] = data_subset['allele_description'].copy()
+def main(genome_file, coordinate_changes_file, allele_results_file, output_dir, parsed_parts_file=None, formats=('tsv',), processes=None):
+    with open(genome_file, 'rb') as ins:
+        genome = pickle.load(ins)
 
-    # Explode
-    data_subset.loc[:, 'allele_description_exploded'] = data_subset['allele_description_exploded'].apply(str.split, args=[','])
-    data_subset.loc[:, 'rules_applied'] = data_subset['rules_applied'].apply(str.split, args=['|'])
+    with open(coordinate_changes_file) as ins:
+        coordinate_changes_dict = json.load(ins)
 
-    # Hack to be able to explode sequence error when it's empty
-    data_subset.loc[:, 'sequence_error'] = data_subset.apply(lambda x: ['' for i in x['rules_applied']] if x['sequence_error'] == '' else x['sequence_error'].split('|'), axis=1)
-    data_subset = data_subset.explode(['allele_description_exploded', 'rules_applied', 'sequence_error'])
+    syntax_rules = parse_grammar(aminoacid_grammar)
+    syntax_rules_dict = {f'{r.type}:{r.rule_name}': r for r in syntax_rules}
 
-    # Explode again the multiple_aa
-    multi_aa = data_subset['rules_applied'] == 'amino_acid_mutation:multiple_aa'
-    data_subset['allele_description_exploded2'] = data_subset['allele_description_exploded'].copy()
-    data_subset.loc[multi_aa, 'allele_description_exploded2'] = data_subset.loc[multi_aa, 'allele_description_exploded2'].apply(split_multiple_aa, args=[syntax_rules_dict['amino_acid_mutation:multiple_aa'].regex])
-    data_subset = data_subset.explode('allele_description_exploded2')
+    data = read_results(allele_results_file)
 
-    # Sort the mutations by the first number in them (there might be two numbers in the deletions)
-    data_subset.loc[:, 'sorting_col'] = data_subset['allele_description_exploded2'].apply(lambda x: int(re.search(r'\d+', x).group()))
-    data_subset.sort_values('sorting_col', inplace=True)
-    data_subset.drop(columns='sorting_col', inplace=True)
+    aminoacid_alleles = get_aminoacid_alleles(data)
 
-    data_subset.drop_duplicates(inplace=True)
+    data_subset = data.loc[aminoacid_alleles, ['systematic_id', 'allele_description', 'allele_name', 'reference', 'change_description_to', 'rules_applied', 'sequence_error']]
 
-    # Make a copy for matching the proposed fixes later
-    data_for_fixing = data_subset.copy()
+    # Capture groups of each allele part, from the parsed parts of allele_qc.py (None if not available)
+    if parsed_parts_file is not None:
+        parsed_parts = read_parsed_parts(parsed_parts_file)
+        capture_groups = [get_parsed_capture_groups(row, parsed_parts) for row in data.loc[aminoacid_alleles].to_dict('records')]
+    else:
+        capture_groups = [[None] * len(x.split('|')) for x in data_subset['rules_applied']]
 
-    # Drop duplicates that may have arised when splitting allele description at either step
-    data_subset.drop(columns=['rules_applied', 'allele_description', 'allele_description_exploded'], inplace=True)
-    data_subset.drop_duplicates(inplace=True)
+    # Single mutations of each allele in each reference
+    allele_mutations = get_allele_mutations(data_subset, capture_groups, syntax_rules_dict['amino_acid_mutation:multiple_aa'].regex)
 
-    # Aggregate by publication and systematic id
-    aggregated_data = data_subset.groupby(['systematic_id', 'reference'], as_index=False).agg({'allele_description_exploded2': ','.join, 'sequence_error': any})
+    # Aggregate by publication and systematic id, and keep those that have sequence errors
+    references_with_errors = aggregate_mutations_by_reference(allele_mutations)
 
-    # Here is where we filter for those that have sequence errors
-    aggregated_data = aggregated_data.loc[aggregated_data['sequence_error'], :]
     print('applying fixes...')
-    extra_cols = aggregated_data.apply(apply_old_coords_fix, axis=1, result_type='expand', args=[coordinate_changes_dict, 'allele_description_exploded2'])
-    aggregated_data.loc[:, 'old_coords_fix'] = extra_cols.iloc[:, 0]
-    aggregated_data.loc[:, 'old_coords_revision'] = extra_cols.iloc[:, 1]
-    aggregated_data.loc[:, 'old_coords_location'] = extra_cols.iloc[:, 2]
-    aggregated_data['multi_shift_fix'] = aggregated_data.apply(apply_multi_shift_fix, axis=1, args=[genome, 'allele_description_exploded2'])
-    aggregated_data['histone_fix'] = aggregated_data.apply(apply_histone_fix, axis=1, args=[genome, 'allele_description_exploded2'])
-    extra_cols = aggregated_data.apply(get_preferred_fix, axis=1, result_type='expand')
-    aggregated_data.loc[:, 'auto_fix_to'] = extra_cols.iloc[:, 0]
-    aggregated_data.loc[:, 'auto_fix_comment'] = extra_cols.iloc[:, 1]
-    # Old intermediary file for checks
-    # aggregated_data.to_csv(f'{output_dir}/allele_auto_fix_info.tsv', sep='\t', index=False)
-
-    # Re-explode the columns that have multiple solutions (now they are aggregated as '|'-separated strings)
-    aggregated_data_with_fixes = aggregated_data.loc[aggregated_data['auto_fix_to'] != '', :].copy()
-
-    # Deaggregate multiple solutions
-    aggregated_data_with_fixes.loc[:, 'auto_fix_to'] = aggregated_data_with_fixes['auto_fix_to'].apply(str.split, args=['|'])
-
-    # We add an extra column with the index of the solution if there is more than one
-    # We convert to strings because the missing values may give unexpected behaviour in .groupby or .agg
-    aggregated_data_with_fixes.loc[:, 'solution_index'] = aggregated_data_with_fixes['auto_fix_to'].apply(lambda x: list(range(len(x))) if len(x) > 1 else [''])
-    aggregated_data_with_fixes.loc[:, 'solution_index'] = aggregated_data_with_fixes.loc[:, 'solution_index']
-    aggregated_data_with_fixes = aggregated_data_with_fixes.explode(['auto_fix_to', 'solution_index'])
-
-    # Deaggregate the parts of each solution
-    aggregated_data_with_fixes.loc[:, 'allele_description_exploded2'] = aggregated_data_with_fixes['allele_description_exploded2'].apply(str.split, args=[','])
-    aggregated_data_with_fixes.loc[:, 'auto_fix_to'] = aggregated_data_with_fixes['auto_fix_to'].apply(str.split, args=[','])
-
-    for i, row in aggregated_data_with_fixes.iterrows():
-        if len(row['allele_description_exploded2']) != len(row['auto_fix_to']):
-            print(row['allele_description_exploded2'], row['auto_fix_to'])
-
-    data2merge = aggregated_data_with_fixes.explode(['allele_description_exploded2', 'auto_fix_to'])
-    data_for_fixing = data_for_fixing.merge(data2merge[['systematic_id', 'reference', 'allele_description_exploded2', 'auto_fix_to', 'auto_fix_comment', 'solution_index']], on=['systematic_id', 'reference', 'allele_description_exploded2'])
-
-    # Here we filter again for those that have sequence errors
-    data_for_fixing = data_for_fixing.loc[data_for_fixing['sequence_error'] != '', :]
-
-    # Aggregate the multiple_aa, they only differ on the columns allele_description_exploded2 and auto_fix_to, so we aggregate on everything else
-    # We also drop allele_description_exploded and allele_description_exploded2 and rules_applied after the aggregation, no longer needed
-    multi_aa = data_for_fixing['rules_applied'] == 'amino_acid_mutation:multiple_aa'
-    groupby_columns = list(data_for_fixing.columns)
-    groupby_columns.remove('allele_description_exploded2')
-    groupby_columns.remove('auto_fix_to')
-    new_rows = data_for_fixing[multi_aa].groupby(groupby_columns, as_index=False).agg({'auto_fix_to': lambda x: join_multiple_aa(x.values)})
-    data_for_fixing = data_for_fixing[~multi_aa]
-    data_for_fixing = pandas.concat([data_for_fixing, new_rows])
-    data_for_fixing.drop(columns=['allele_description_exploded', 'allele_description_exploded2', 'sequence_error', 'rules_applied'], inplace=True)
-    data_for_fixing.drop_duplicates(inplace=True)
-
-    # Sort again by first number in the string (concat step may mess up the order,
-    # which is important for the next aggregation)
-    data_for_fixing.loc[:, 'sorting_col'] = data_for_fixing['auto_fix_to'].apply(lambda x: int(re.search(r'\d+', x).group()) if x != '?' else 0)
-    data_for_fixing.sort_values('sorting_col', inplace=True)
-    data_for_fixing.drop(columns='sorting_col', inplace=True)
-
-    # Apply the fix by merging the auto_fix_to individual columns
-    groupby_columns = list(data_for_fixing.columns)
-    groupby_columns.remove('auto_fix_to')
-
-    data_for_fixing = data_for_fixing.groupby(groupby_columns, as_index=False).agg({'auto_fix_to': ','.join})
+    mutation_fixes = get_mutation_fixes(references_with_errors, genome, coordinate_changes_dict, processes)
 
-    # Merge solutions from different PMIDs that are the same
-    groupby_columns = list(data_for_fixing.columns)
-    groupby_columns.remove('reference')
-    data_for_fixing = data_for_fixing.groupby(groupby_columns, as_index=False).agg({'reference': ','.join})
+    data_for_fixing = get_allele_fixes(allele_mutations, mutation_fixes)
 
     # Here we check if multiple solutions were found from different references, if so give a warning
-    groupby_columns.remove('auto_fix_to')
+    groupby_columns = ['systematic_id', 'allele_description', 'allele_name', 'auto_fix_comment', 'solution_index']
     different_solutions = data_for_fixing[data_for_fixing[groupby_columns].duplicated(keep=False)]
     if not different_solutions.empty:
         print('Different solutions have been found in different papers')
@@ -184,7 +229,7 @@ def main(genome_file, coordinate_changes_file, allele_results_file, output_dir):
     autofixed_data = autofixed_data[['systematic_id', 'allele_id', 'allele_name', 'allele_description', 'allele_type', 'change_description_to', 'change_name_to', 'change_type_to', 'auto_fix_comment', 'sequence_error', 'solution_index', 'allele_parts', 'rules_applied', 'reference']].copy()
     autofixed_data.sort_values(['systematic_id', 'allele_name'], inplace=True)
 
-    autofixed_data.to_csv(f'{output_dir}/allele_auto_fix.tsv', sep='\t', index=False)
+    write_results(autofixed_data, f'{output_dir}/allele_auto_fix.tsv', formats)
 
     errors_cannot_fix = data[~columns_auto_fixed].drop(columns=['auto_fix_comment', 'solution_index'])
 
@@ -199,9 +244,9 @@ def main(genome_file, coordinate_changes_file, allele_results_file, output_dir):
     errors_cannot_fix.sort_values(['systematic_id', 'allele_name'], inplace=True)
 
     sequence_errors = errors_cannot_fix[errors_cannot_fix.error_type == 'sequence_error'].drop(columns=['error_type']).rename(columns={'error_info': 'sequence_error'})
-    sequence_errors.to_csv(f'{output_dir}/allele_cannot_fix_sequence_errors.tsv', sep='\t', index=False)
+    write_results(sequence_errors, f'{output_dir}/allele_cannot_fix_sequence_errors.tsv', formats)
 
-    errors_cannot_fix[errors_cannot_fix.error_type != 'sequence_error'].to_csv(f'{output_dir}/allele_cannot_fix_other_errors.tsv', sep='\t', index=False)
+    write_results(errors_cannot_fix[errors_cannot_fix.error_type != 'sequence_error'], f'{output_dir}/allele_cannot_fix_other_errors.tsv', formats)
 
 
 if __name__ == '__main__':
@@ -212,8 +257,12 @@ if __name__ == '__main__':
     parser.add_argument('--genome', default='data/genome.pickle', help='input: genome dictionary built from contig files (see load_genome.py).')
     parser.add_argument('--coordinate_changes_dict', default='data/coordinate_changes_dict.json', help='input: protein modification dictionary (see build_alignment_dict_from_genome.py -PomBase- or build_alignment_dict_from_peptides.py -SGD- )')
     parser.add_argument('--allele_results', default='results/allele_results.tsv', help='input: file output by allele_qc.py')
+    parser.add_argument('--parsed_parts', default=None, help='input (optional): parsed allele parts output by allele_qc.py, to skip applying the regular expressions again')
     parser.add_argument('--output_dir', default='results/', help='output directory, will create files allele_auto_fix.tsv, allele_cannot_fix_sequence_errors.tsv, allele_cannot_fix_other_errors.tsv')
+    parser.add_argument('--output_format', nargs='+', choices=output_formats, default=['tsv'], help='format(s) of the output files, the columnar formats (see results_io.py) are written next to them with a different extension')
+    parser.add_argument('--processes', type=int, default=None, help='number of processes used to apply the fixes (by default, the number of CPUs)')
 
     args = parser.parse_args()
+    check_output_formats(args.output_format)
 
-    main(args.genome, args.coordinate_changes_dict, args.allele_results, args.output_dir)
+    main(args.genome, args.coordinate_changes_dict, args.allele_results, args.output_dir, args.parsed_parts, args.output_format, args.processes)
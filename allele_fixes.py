@@ -1,7 +1,7 @@
 import re
 from genome_functions import get_other_index_from_alignment
 from Bio.Seq import Seq
-import regex
+import numpy
 
 
 def shift_coordinates_by_x(input_str, shift_value):
@@ -147,66 +147,92 @@ def multi_shift_fix(seq, targets):
     return out_list
 
 
+def primer_mismatches(seq: numpy.ndarray, primers: list[numpy.ndarray]) -> list[numpy.ndarray]:
+    """
+    Number of mismatches (Hamming distance) of each primer placed at each position of seq (index i means that the primer
+    starts at position i), for primers of the same length, computed in a single pass over the primer positions.
+    seq and primers are arrays of the ASCII codes of the sequences.
+    """
+    nb_positions = len(seq) - len(primers[0]) + 1
+    distances = [numpy.zeros(max(nb_positions, 0), dtype=numpy.int32) for _ in primers]
+    if nb_positions <= 0:
+        return distances
+    for i in range(len(primers[0])):
+        window = seq[i:i + nb_positions]
+        for primer, primer_distances in zip(primers, distances):
+            primer_distances += window != primer[i]
+    return distances
+
+
+def best_primer_placements(main_seq: str, primer_seq: str, allowed_mismatches: int) -> list[tuple[bool, int, int]]:
+    """
+    Best placement of the reverse complement of the primer and of the primer in main_seq, as a list of tuples
+    (reverse_the_primer, start, mismatches), only if the number of mismatches is lower or equal than allowed_mismatches.
+    If several positions have the minimum number of mismatches, the last one is returned.
+    """
+    primers = [str(Seq(primer_seq).reverse_complement()), primer_seq]
+    seq = numpy.frombuffer(main_seq.encode(), dtype=numpy.uint8)
+    distances = primer_mismatches(seq, [numpy.frombuffer(p.encode(), dtype=numpy.uint8) for p in primers])
+    out_list = list()
+    for reverse_the_primer, primer_distances in zip([True, False], distances):
+        if len(primer_distances) == 0 or primer_distances.min() > allowed_mismatches:
+            continue
+        start = len(primer_distances) - 1 - int(numpy.argmin(primer_distances[::-1]))
+        out_list.append((reverse_the_primer, start, int(primer_distances[start])))
+    return out_list
+
+
+def compare_sequences(original_seq: str, mutated_seq: str) -> tuple[str, str]:
+    """
+    Return the mutations (e.g. `A12T,C15G,`) and a string with `|` under the positions that differ between two sequences
+    """
+    mutations = list()
+    matches_rvs = list()
+    for i, (original, mutated) in enumerate(zip(original_seq, mutated_seq)):
+        matches_rvs.append(' ' if original == mutated else '|')
+        if original != mutated:
+            mutations.append(f'{original}{i+1}{mutated},')
+    return ''.join(mutations), ''.join(matches_rvs)
+
+
 def primer_mutagenesis(main_seq, primer_seq, allowed_mismatches, has_peptide):
+    """
+    Find where the primer (or its reverse complement) aligns in main_seq with at most allowed_mismatches substitutions,
+    and report the mutations that the primer introduces at the DNA level (and the peptide level if has_peptide).
+    """
     main_seq = str(main_seq)
-    primer_seq = Seq(primer_seq)
-    out_str = ''
-
-    for reverse_the_primer in [True, False]:
-        for i in range(1, allowed_mismatches + 1):
-            primer = str(primer_seq) if not reverse_the_primer else str(primer_seq.reverse_complement())
-            pattern = f'({primer})' + '{s<=' + str(i) + '}'
-            matches = list(regex.finditer(pattern, main_seq))
-
-            for match in matches:
-                match: regex.Match
-                start = match.start()
-                end = start + len(primer)
-                primer_DNA = main_seq[:start] + primer + main_seq[end:]
-                encountered_mismatches = i
-            if len(matches) > 0:
-                break
-        else:
-            continue
+    primer_seq = str(primer_seq)
+    out_list = list()
 
-        matches_rvs = ''
-        mutations = ''
-        for i in range(len(main_seq)):
-            matches_rvs = matches_rvs + (' ' if primer_DNA[i] == main_seq[i] else '|')
-            if primer_DNA[i] != main_seq[i]:
-                mutations += f'{main_seq[i]}{i+1}{primer_DNA[i]},'
+    for reverse_the_primer, start, encountered_mismatches in best_primer_placements(main_seq, primer_seq, allowed_mismatches):
+        primer = primer_seq if not reverse_the_primer else str(Seq(primer_seq).reverse_complement())
+        primer_DNA = main_seq[:start] + primer + main_seq[start + len(primer):]
+        mutations, matches_rvs = compare_sequences(main_seq, primer_DNA)
 
         if reverse_the_primer:
-            out_str = out_str + f'> with the reverse primer and {encountered_mismatches} mistmatches\n'
+            out_list.append(f'> with the reverse primer and {encountered_mismatches} mistmatches\n')
         else:
-            out_str = out_str + f'> with the forward primer and {encountered_mismatches} mistmatches\n'
+            out_list.append(f'> with the forward primer and {encountered_mismatches} mistmatches\n')
 
-        out_str = out_str + f'mutations observed at DNA level: {mutations}\n'
-        out_str = out_str + f'original_sequence:  {main_seq}\n'
-        out_str = out_str + f'                    {matches_rvs}\n'
-        out_str = out_str + f'mutated_sequence:   {primer_DNA}\n'
+        out_list.append(f'mutations observed at DNA level: {mutations}\n')
+        out_list.append(f'original_sequence:  {main_seq}\n')
+        out_list.append(f'                    {matches_rvs}\n')
+        out_list.append(f'mutated_sequence:   {primer_DNA}\n')
 
         if not has_peptide:
             continue
 
-        peptide_seq = Seq(main_seq).translate()
-        peptide_rvs = Seq(primer_DNA).translate()
-
-        matches_rvs = ''
-        mutations = ''
-        for i in range(len(peptide_seq)):
-            matches_rvs = matches_rvs + \
-                (' ' if peptide_rvs[i] == peptide_seq[i] else '|')
-            if peptide_rvs[i] != peptide_seq[i]:
-                mutations += f'{peptide_seq[i]}{i+1}{peptide_rvs[i]},'
+        peptide_seq = str(Seq(main_seq).translate())
+        peptide_rvs = str(Seq(primer_DNA).translate())
+        mutations, matches_rvs = compare_sequences(peptide_seq, peptide_rvs)
 
-        out_str = out_str + '\n'
-        out_str = out_str + f'mutations observed at peptide level:{mutations}\n'
-        out_str = out_str + f'original_sequence: {peptide_seq}\n'
-        out_str = out_str + f'                   {matches_rvs}\n'
-        out_str = out_str + f'mutated_sequence:  {peptide_rvs}\n'
+        out_list.append('\n')
+        out_list.append(f'mutations observed at peptide level:{mutations}\n')
+        out_list.append(f'original_sequence: {peptide_seq}\n')
+        out_list.append(f'                   {matches_rvs}\n')
+        out_list.append(f'mutated_sequence:  {peptide_rvs}\n')
 
-    if not out_str:
+    if not out_list:
         return 'Nothing found :_(. This works with cDNA, perhaps primer aligns at exon border?'
 
-    return out_str
+    return ''.join(out_list)
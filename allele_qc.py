@@ -9,16 +9,23 @@ Only the subset of alleles that needs fixing, only the columns 'allele_descripti
 results/allele_results_errors_summarised.tsv
 
 The extra columns created are described in the readme.md.
+
+Optionally (--parsed_parts), the parsed allele parts (capture groups, syntax rule, span and formatted version
+of each part, see check_and_parse_allele_description) are written as JSON Lines, so that allele_transvar.py and
+allele_auto_fix.py don't have to apply the regular expressions again.
 """
 
-from models import SyntaxRule, AllowedTypes
-from refinement_functions import check_allele_description
+from models import parse_grammar, AllowedTypes
+from refinement_functions import check_and_parse_allele_description, parsed_parts_key, write_parsed_parts, read_parsed_parts
 from grammar import allowed_types_dict, composed_types_dict, aminoacid_grammar, nucleotide_grammar, disruption_grammar
 import pickle
 import pandas
 import argparse
+import os
 from common_autofix_functions import print_warnings
 from genome_functions import handle_systematic_id_for_allele_qc
+from genome_diff import read_affected_systematic_ids, split_by_previous_results
+from results_io import output_formats, check_output_formats, read_results, write_results
 
 
 def empty_dict():
@@ -38,34 +45,41 @@ def empty_dict():
 
 
 def check_fun(row, genome, syntax_rules_aminoacids, syntax_rules_nucleotides, syntax_rules_disruption, allowed_types):
+    return check_and_parse_fun(row, genome, syntax_rules_aminoacids, syntax_rules_nucleotides, syntax_rules_disruption, allowed_types)[0]
+
+
+def check_and_parse_fun(row, genome, syntax_rules_aminoacids, syntax_rules_nucleotides, syntax_rules_disruption, allowed_types) -> tuple[dict, list[dict]]:
+    """
+    Same as check_fun, but also returns the parsed allele parts (see check_and_parse_allele_description)
+    """
 
     systematic_id = handle_systematic_id_for_allele_qc(row['systematic_id'], row['allele_name'], genome)
     if systematic_id is None:
-        return empty_dict() | {'needs_fixing': True, 'invalid_error': 'systematic_id not in genome'}
+        return empty_dict() | {'needs_fixing': True, 'invalid_error': 'systematic_id not in genome'}, []
 
     gene = genome[systematic_id]
 
     if 'amino_acid' in row['allele_type'] or 'nonsense_mutation' == row['allele_type']:
         if 'peptide' not in gene:
-            return empty_dict() | {'needs_fixing': True, 'invalid_error': 'peptide sequence missing'}
+            return empty_dict() | {'needs_fixing': True, 'invalid_error': 'peptide sequence missing'}, []
         else:
-            return check_allele_description(row.allele_description, syntax_rules_aminoacids, row.allele_type, allowed_types, gene)
+            return check_and_parse_allele_description(row.allele_description, syntax_rules_aminoacids, row.allele_type, allowed_types, gene)
     elif 'nucleotide' in row['allele_type']:
-        return check_allele_description(row.allele_description, syntax_rules_nucleotides, row.allele_type, allowed_types, gene)
+        return check_and_parse_allele_description(row.allele_description, syntax_rules_nucleotides, row.allele_type, allowed_types, gene)
     elif 'disruption' == row['allele_type']:
         # TODO: handle this better and refactor
         if row['allele_description'] != '':
-            return check_allele_description(row.allele_description, syntax_rules_disruption, row.allele_type, allowed_types, gene)
+            return check_and_parse_allele_description(row.allele_description, syntax_rules_disruption, row.allele_type, allowed_types, gene)
         # Special case where the description  is empty
         else:
-            out_dict = check_allele_description(row.allele_name, syntax_rules_disruption, row.allele_type, allowed_types, gene)
+            out_dict, parsed_parts = check_and_parse_allele_description(row.allele_name, syntax_rules_disruption, row.allele_type, allowed_types, gene)
             # The name matches the pattern
             if out_dict['change_description_to'] != '':
-                return out_dict
+                return out_dict, parsed_parts
             else:
-                return empty_dict()
+                return empty_dict(), []
     else:
-        return empty_dict()
+        return empty_dict(), []
 
 
 if __name__ == '__main__':
@@ -76,24 +90,60 @@ if __name__ == '__main__':
     parser.add_argument('--genome', default='data/genome.pickle', help='input: genome dictionary built from contig files.')
     parser.add_argument('--alleles', default='data/alleles.tsv', help='input allele dataset')
     parser.add_argument('--output', default='results/allele_results.tsv', help='output file, also creates two extra files with the extension _errors.tsv and _errors_summarised.tsv')
+    parser.add_argument('--genome_diff', default=None, help='input (optional): changes between genome builds (see genome_diff.py), only the alleles of affected genes or not in the existing --output file are checked again')
+    parser.add_argument('--parsed_parts', default=None, help='output (optional): JSON Lines file with the parsed allele parts, can be passed to allele_transvar.py and allele_auto_fix.py')
+    parser.add_argument('--output_format', nargs='+', choices=output_formats, default=['tsv'], help='format(s) of the output file, the columnar formats (see results_io.py) are written next to it with a different extension')
     args = parser.parse_args()
+    check_output_formats(args.output_format)
 
     with open(args.genome, 'rb') as ins:
         genome = pickle.load(ins)
 
     allele_data = pandas.read_csv(args.alleles, delimiter='\t', na_filter=False)
-    syntax_rules_aminoacids = [SyntaxRule.parse_obj(r) for r in aminoacid_grammar]
-    syntax_rules_nucleotides = [SyntaxRule.parse_obj(r) for r in nucleotide_grammar]
-    syntax_rules_disruption = [SyntaxRule.parse_obj(r) for r in disruption_grammar]
+    syntax_rules_aminoacids = parse_grammar(aminoacid_grammar)
+    syntax_rules_nucleotides = parse_grammar(nucleotide_grammar)
+    syntax_rules_disruption = parse_grammar(disruption_grammar)
     allowed_types = AllowedTypes(allowed_types=allowed_types_dict, composed_types=composed_types_dict)
 
-    extra_cols = allele_data.apply(lambda row: check_fun(row, genome, syntax_rules_aminoacids, syntax_rules_nucleotides, syntax_rules_disruption, allowed_types), axis=1, result_type='expand')
-    output_data = pandas.concat([allele_data, extra_cols], axis=1)
     column_order = ['systematic_id', 'gene_name', 'allele_id', 'allele_name', 'allele_description', 'allele_type', 'reference', 'allele_parts', 'needs_fixing', 'change_description_to', 'rules_applied', 'pattern_error', 'invalid_error', 'sequence_error', 'change_type_to']
+    extra_column_names = [c for c in column_order if c not in allele_data.columns]
+
+    data_to_check = allele_data
+    previous_extra_cols = pandas.DataFrame(columns=extra_column_names)
+    if args.genome_diff is not None:
+        previous_results = read_results(args.output, dtype=str)
+        previous_results['needs_fixing'] = previous_results['needs_fixing'] == 'True'
+        data_to_check, previous_extra_cols = split_by_previous_results(allele_data.astype(str), previous_results, list(allele_data.columns), extra_column_names, read_affected_systematic_ids(args.genome_diff))
+        data_to_check = allele_data.loc[data_to_check.index]
+        print(f'{len(data_to_check)} alleles checked, {len(previous_extra_cols)} copied from {args.output}')
+
+    # The parsed parts of the alleles copied from the previous output
+    parsed_parts = dict()
+    if args.parsed_parts is not None and args.genome_diff is not None and os.path.isfile(args.parsed_parts):
+        previous_parsed_parts = read_parsed_parts(args.parsed_parts)
+        for i in previous_extra_cols.index:
+            key = parsed_parts_key(allele_data.loc[i])
+            if key in previous_parsed_parts:
+                parsed_parts[key] = previous_parsed_parts[key]
+
+    extra_cols = previous_extra_cols
+    if len(data_to_check):
+        results = data_to_check.apply(lambda row: check_and_parse_fun(row, genome, syntax_rules_aminoacids, syntax_rules_nucleotides, syntax_rules_disruption, allowed_types), axis=1)
+        extra_cols = pandas.DataFrame([r[0] for r in results], index=data_to_check.index)
+        for i, r in zip(data_to_check.index, results):
+            parsed_parts[parsed_parts_key(data_to_check.loc[i])] = r[1]
+        if len(previous_extra_cols):
+            extra_cols = pandas.concat([extra_cols, previous_extra_cols]).loc[allele_data.index]
+    output_data = pandas.concat([allele_data, extra_cols], axis=1)
     output_data = output_data[column_order]
 
     print_warnings(output_data[(output_data['needs_fixing'] == True) & (output_data['pattern_error'] == '') & (output_data['allele_type'].str.contains('nucleot') | output_data['allele_type'].str.contains('amino'))])
-    output_data.to_csv(args.output, sep='\t', index=False)
+    write_results(output_data, args.output, args.output_format)
+
+    if args.parsed_parts is not None:
+        # In the same order as the output
+        output_keys = [parsed_parts_key(row) for _, row in allele_data.iterrows()]
+        write_parsed_parts(args.parsed_parts, {key: parsed_parts[key] for key in output_keys if key in parsed_parts})
 
     root_output_name = args.output.split('.')[0]
 
@@ -1,5 +1,7 @@
 """
-Uses transvar to represent the allele modifications in standard variant nomenclature.
+Uses transvar to represent the allele modifications in standard variant nomenclature. Simple protein variants
+(substitutions and deletions), and nucleotide substitutions and in-frame deletions inside the CDS, are annotated
+from the genome instead, with the same format (see native_transvar.py).
 
 Removes all lines with sequence errors (needs_fixing == True).
 
@@ -8,10 +10,15 @@ Removes all lines with sequence errors (needs_fixing == True).
 import pandas
 import pickle
 import argparse
-from grammar import aminoacid_grammar, nucleotide_grammar
-from models import SyntaxRule, find_rule
+import json
+from grammar import aminoacid_grammar, nucleotide_grammar, allowed_types_dict, composed_types_dict
+from models import parse_grammar, find_rule, AllowedTypes
 from transvar_functions import parse_transvar_string, get_transvar_str_annotation, get_anno_db, TransvarAnnotation
+from native_transvar import get_protein_variant_coordinates, get_nucleotide_variant_coordinates, get_codon_table, NativeAnnotationError
 from genome_functions import handle_systematic_id_for_allele_qc
+from genome_diff import read_affected_systematic_ids, split_by_previous_results
+from refinement_functions import read_parsed_parts, get_parsed_capture_groups
+from results_io import output_formats, check_output_formats, read_results, write_results
 from tqdm import tqdm
 
 tqdm.pandas()
@@ -32,12 +39,34 @@ def format_transvar_input_list(row, genome, syntax_rules_aminoacids, syntax_rule
         syntax_rule = find_rule(syntax_rules_nucleotides, *row['rules_applied'].split(':'))
         prefix = chromosome
 
-    capture_groups = syntax_rule.get_groups(row['allele_parts'], gene)
+    # Capture groups from the parsed parts of allele_qc.py, if available (see get_parsed_capture_groups)
+    capture_groups = row.get('capture_groups')
+    if capture_groups is None:
+        capture_groups = syntax_rule.get_groups(row['allele_parts'], gene)
     transvar_input_list = ['{}:{}'.format(prefix, x) for x in syntax_rule.format_for_transvar(capture_groups, gene)]
 
     return transvar_input_list
 
 
+def get_native_coordinates_list(row, genome, config) -> list[str]:
+    """
+    Coordinates of the nucleotide variants in transvar_input_list annotated from the genome (see native_transvar.py),
+    None for the variants that must be annotated with transvar.
+    """
+    native_coordinates = [None] * len(row['transvar_input_list'])
+    if 'amino_acid' in row['allele_type']:
+        return native_coordinates
+
+    allele_qc_id = handle_systematic_id_for_allele_qc(row['systematic_id'], row['allele_name'], genome)
+    codon_table = get_codon_table(config['mitochondrial_table'] if allele_qc_id.startswith(config['mitochondrial_prefix']) else 1)
+    for i, var in enumerate(row['transvar_input_list']):
+        try:
+            native_coordinates[i] = get_nucleotide_variant_coordinates(var.split(':', 1)[1], genome[allele_qc_id], codon_table)
+        except NativeAnnotationError:
+            pass
+    return native_coordinates
+
+
 def get_transvar_annotation_coordinates(annotations: list[TransvarAnnotation], gene_id: str, transcript_id: str) -> TransvarAnnotation:
     # There may be multiple annotations for the same systematic_id if there are multiple
     # transcripts
@@ -56,9 +85,21 @@ def get_transvar_coordinates(row, db, genome, exclude_transcripts, sgd_mode=Fals
 
     allele_qc_id = handle_systematic_id_for_allele_qc(row['systematic_id'], row['allele_name'], genome)
     transcript_id = None if (allele_qc_id == row['systematic_id']) else allele_qc_id
+    # Nucleotide variants annotated from the genome in advance (see get_native_coordinates_list)
+    native_coordinates = row.get('native_coordinates')
     try:
         transvar_output = list()
-        for var in row['transvar_input_list']:
+        for i, var in enumerate(row['transvar_input_list']):
+            if native_coordinates is not None and native_coordinates[i] is not None:
+                transvar_output.append(native_coordinates[i])
+                continue
+            # Simple protein variants are annotated from the genome, transvar is used for the rest
+            if 'amino_acid' in row['allele_type']:
+                try:
+                    transvar_output.append(get_protein_variant_coordinates(var.split(':', 1)[1], genome[allele_qc_id]))
+                    continue
+                except NativeAnnotationError:
+                    pass
             transvar_annotation_list = parse_transvar_string(get_transvar_str_annotation('panno' if 'amino_acid' in row['allele_type'] else 'ganno', var, db))
             transvar_output.append(get_transvar_annotation_coordinates(transvar_annotation_list, row['systematic_id'], transcript_id))
         return transvar_output
@@ -73,18 +114,21 @@ def get_transvar_coordinates(row, db, genome, exclude_transcripts, sgd_mode=Fals
             raise e
 
 
-def main(genome_file, allele_results_file, exclude_transcripts_file, output_file, sgd_mode, transvardb, genome_fasta):
+def main(genome_file, allele_results_file, exclude_transcripts_file, output_file, sgd_mode, transvardb, genome_fasta, genome_diff_file=None, config_file='config.json', parsed_parts_file=None, formats=('tsv',)):
 
     with open(genome_file, 'rb') as ins:
         genome = pickle.load(ins)
 
+    with open(config_file) as ins:
+        config = json.load(ins)
+
     with open(exclude_transcripts_file) as ins:
         exclude_transcripts = set(map(str.strip, ins.readlines()))
 
-    syntax_rules_aminoacids = [SyntaxRule.parse_obj(r) for r in aminoacid_grammar]
-    syntax_rules_nucleotides = [SyntaxRule.parse_obj(r) for r in nucleotide_grammar]
+    syntax_rules_aminoacids = parse_grammar(aminoacid_grammar)
+    syntax_rules_nucleotides = parse_grammar(nucleotide_grammar)
 
-    data = pandas.read_csv(allele_results_file, sep='\t', na_filter=False)
+    data = read_results(allele_results_file)
 
     if sgd_mode:
         # Ammend wrong type:
@@ -92,7 +136,8 @@ def main(genome_file, allele_results_file, exclude_transcripts_file, output_file
                      (data['pattern_error'] == '') & \
                      (data['invalid_error'] == '') & \
                      (data['sequence_error'] == '')
-        data.loc[wrong_type, 'allele_type'] = data.loc[wrong_type, 'change_type_to']
+        allowed_types = AllowedTypes(allowed_types=allowed_types_dict, composed_types=composed_types_dict)
+        data.loc[wrong_type, 'allele_type'] = allowed_types.classify_rules_applied(data.loc[wrong_type, 'rules_applied'])
         data.loc[wrong_type, 'needs_fixing'] = False
 
     # Remove all errors
@@ -101,22 +146,49 @@ def main(genome_file, allele_results_file, exclude_transcripts_file, output_file
     # Only allele types that can be fixed
     data = data[data['allele_type'].str.contains('amino_acid|nucleotide', regex=True)].copy()
 
-    # Explode the allele_parts and the rules_applied
-    data_exploded = data.copy()
+    aggregation_columns = ['systematic_id', 'allele_description', 'allele_type']
+
+    # Re-use the coordinates of the previous output for the genes not affected by genome changes
+    data_to_process = data
+    previous_coordinates = pandas.DataFrame(columns=aggregation_columns + ['transvar_coordinates'])
+    if genome_diff_file is not None:
+        previous_results = read_results(output_file, dtype=str)
+        data_to_process, previous_transvar_coordinates = split_by_previous_results(data, previous_results, aggregation_columns, ['transvar_coordinates'], read_affected_systematic_ids(genome_diff_file))
+        previous_coordinates = pandas.concat([data.loc[previous_transvar_coordinates.index, aggregation_columns], previous_transvar_coordinates], axis=1)
+        print(f'{len(data_to_process)} alleles processed, {len(previous_coordinates)} copied from {output_file}')
+
+    # Explode the allele_parts and the rules_applied (and the capture groups of the parsed parts, if available)
+    data_exploded = data_to_process.copy()
+    explode_columns = ['allele_parts', 'rules_applied']
+    if parsed_parts_file is not None and len(data_exploded):
+        parsed_parts = read_parsed_parts(parsed_parts_file)
+        data_exploded['capture_groups'] = data_exploded.apply(get_parsed_capture_groups, axis=1, args=(parsed_parts,))
+        explode_columns.append('capture_groups')
     data_exploded.loc[:, 'allele_parts'] = data_exploded['allele_parts'].apply(str.split, args=['|'])
     data_exploded.loc[:, 'rules_applied'] = data_exploded['rules_applied'].apply(str.split, args=['|'])
-    data_exploded = data_exploded.explode(['allele_parts', 'rules_applied'])
+    data_exploded = data_exploded.explode(explode_columns)
+
+    if len(data_exploded) == 0:
+        write_results(data.merge(previous_coordinates.drop_duplicates(aggregation_columns), on=aggregation_columns, how='left'), output_file, formats)
+        return
 
     # Apply transvar to each allele_parts
     data_exploded['transvar_input_list'] = data_exploded.apply(format_transvar_input_list, axis=1, args=(genome, syntax_rules_aminoacids, syntax_rules_nucleotides))
 
+    # Nucleotide variants in the CDS are annotated from the genome in one go, the rest are passed to transvar
+    data_exploded['native_coordinates'] = data_exploded.apply(get_native_coordinates_list, axis=1, args=(genome, config))
+    native_count = data_exploded['native_coordinates'].apply(lambda x: sum(c is not None for c in x)).sum()
+    print(f'{native_count} nucleotide variants annotated from the genome')
+
     anno_db = get_anno_db(transvardb, genome_fasta)
     print('Running transvar on variants... (will take a while)')
     data_exploded['transvar_coordinates'] = data_exploded.progress_apply(get_transvar_coordinates, args=(anno_db, genome, exclude_transcripts, sgd_mode), axis=1)
 
-    aggregated_data = data_exploded[['systematic_id', 'allele_description', 'allele_type', 'transvar_coordinates']].groupby(['systematic_id', 'allele_description', 'allele_type'], as_index=False).agg({'transvar_coordinates': lambda x: '|'.join(sum(x, []))})
+    aggregated_data = data_exploded[aggregation_columns + ['transvar_coordinates']].groupby(aggregation_columns, as_index=False).agg({'transvar_coordinates': lambda x: '|'.join(sum(x, []))})
+    if len(previous_coordinates):
+        aggregated_data = pandas.concat([aggregated_data, previous_coordinates]).drop_duplicates(aggregation_columns)
 
-    data.merge(aggregated_data, on=['systematic_id', 'allele_description', 'allele_type'], how='left').to_csv(output_file, sep='\t', index=False)
+    write_results(data.merge(aggregated_data, on=aggregation_columns, how='left'), output_file, formats)
 
 
 if __name__ == '__main__':
@@ -130,9 +202,14 @@ if __name__ == '__main__':
     parser.add_argument('--genome_fasta', default='data/pombe_genome.fa', help='input: genome fasta file used by transvar')
     parser.add_argument('--transvardb', default='data/pombe_genome.gtf.transvardb', help='input: path of transvardb file')
     parser.add_argument('--output', default='results/allele_results_transvar.tsv', help='output: file with extra column with transvar coordinates')
+    parser.add_argument('--output_format', nargs='+', choices=output_formats, default=['tsv'], help='format(s) of the output file, the columnar formats (see results_io.py) are written next to it with a different extension')
 
+    parser.add_argument('--config', default='config.json', help='configuration file (mitochondrial codon table)')
+    parser.add_argument('--genome_diff', default=None, help='input (optional): changes between genome builds (see genome_diff.py), only the alleles of affected genes or not in the existing --output file are processed again')
+    parser.add_argument('--parsed_parts', default=None, help='input (optional): parsed allele parts output by allele_qc.py, to skip applying the regular expressions again')
     parser.add_argument('--sgd_mode', type=bool, default=False, help='Skip transcripts that don\'t work and fix allele types, this arg should be removed in the future.')
 
     args = parser.parse_args()
+    check_output_formats(args.output_format)
 
-    main(args.genome, args.allele_results, args.exclude_transcripts, args.output, args.sgd_mode, args.transvardb, args.genome_fasta)
+    main(args.genome, args.allele_results, args.exclude_transcripts, args.output, args.sgd_mode, args.transvardb, args.genome_fasta, args.genome_diff, args.config, args.parsed_parts, args.output_format)
@@ -1,10 +1,10 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Header
 import json
-from starlette.responses import RedirectResponse, PlainTextResponse, FileResponse
+from starlette.responses import RedirectResponse, PlainTextResponse, Response
 from pydantic import BaseModel
 import pickle
 from grammar import allowed_types_dict, composed_types_dict, aminoacid_grammar, nucleotide_grammar, disruption_grammar
-from models import SyntaxRule, find_rule, AllowedTypes
+from models import parse_grammar, find_rule, AllowedTypes
 from refinement_functions import check_allele_description, split_multiple_aa
 from enum import Enum
 from allele_fixes import multi_shift_fix, old_coords_fix, primer_mutagenesis as primer_mutagenesis_func
@@ -14,18 +14,28 @@ from protein_modification_transvar import get_transvar_coordinates as get_transv
 from allele_transvar import get_transvar_coordinates as get_transvar_coordinates_allele, format_transvar_input_list as format_for_transvar_allele
 from ctd_support import ctd_convert_to_normal_variant
 import re
-from typing import Optional
+from typing import Optional, NamedTuple
 from Bio import SeqIO
-import tempfile
 import os
-from starlette.background import BackgroundTask
-from genome_functions import extract_main_feature_and_strand, process_systematic_id, get_nt_at_gene_coord, handle_systematic_id_for_allele_qc
+import io
+import hashlib
+from genome_functions import extract_main_feature_and_strand, process_systematic_id, gene_coords2genome_coords, handle_systematic_id_for_allele_qc
 from Bio.SeqRecord import SeqRecord
-from transvar_functions import get_transvar_str_annotation, parse_transvar_string, TransvarAnnotation, get_anno_db
-
-syntax_rules_aminoacids = [SyntaxRule.parse_obj(r) for r in aminoacid_grammar]
-syntax_rules_nucleotides = [SyntaxRule.parse_obj(r) for r in nucleotide_grammar]
-syntax_rules_disruption = [SyntaxRule.parse_obj(r) for r in disruption_grammar]
+from transvar_functions import get_transvar_str_annotation, parse_transvar_string, TransvarAnnotation, get_anno_db, transvar_annotation_cache
+from residue_search import ResidueIndex, build_residue_index, find_protein_by_residues as find_protein_by_residues_func
+from primer_search import PrimerIndex, build_primer_index, find_primer_in_genome, min_seed_length
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from generate_mutant_protein_sequences import get_allele_qc_id_with_cds, transvar_coordinates_to_variant_sequence
+import functools
+import threading
+import time
+from starlette.requests import Request
+from metrics import registry as metrics_registry, Counter, Histogram, CacheCollector, ProcessMemoryCollector
+
+syntax_rules_aminoacids = parse_grammar(aminoacid_grammar)
+syntax_rules_nucleotides = parse_grammar(nucleotide_grammar)
+syntax_rules_disruption = parse_grammar(disruption_grammar)
 multi_aa_rule = find_rule(syntax_rules_aminoacids, 'amino_acid_mutation', 'multiple_aa')
 allowed_types = AllowedTypes(allowed_types=allowed_types_dict, composed_types=composed_types_dict)
 
@@ -35,6 +45,11 @@ class DNAorProtein(str, Enum):
     dna = 'dna'
 
 
+class Organism(str, Enum):
+    pombe = 'pombe'
+    sgd = 'sgd'
+
+
 class SequenceFileFormat(str, Enum):
     genbank = 'genbank'
     fasta = 'fasta'
@@ -90,9 +105,58 @@ class OldCoordsFix(AlleleFix):
     location: str
 
 
+class ResidueSearchMatch(BaseModel):
+
+    systematic_id: str
+    revision: str
+    mismatches: list[str]
+
+
+class ResiduesAtPositions(BaseModel):
+
+    positions: str
+    sequence: str
+
+
+class PrimerGeneMatch(BaseModel):
+
+    systematic_id: str
+    strand: int
+    nucleotide_description: str
+    aminoacid_description: str
+
+
+class PrimerGenomeMatch(BaseModel):
+
+    contig: str
+    start: int
+    end: int
+    strand: int
+    mismatches: int
+    genes: list[PrimerGeneMatch]
+
+
+class MutantProteinSequenceQuery(BaseModel):
+
+    systematic_id: str
+    allele_description: str
+    allele_type: AlleleType
+    allele_name: str = ''
+
+
+class MutantProteinSequence(MutantProteinSequenceQuery):
+
+    sequence: str = ''
+    error: str = ''
+
+
+# Maximum number of alleles in a request to /mutant_protein_sequences
+max_mutant_protein_sequences = 1000
+
 # For the query field
 systematic_id_description = 'Gene or transcript systematic id, if a gene that contains multiple transcripts is passed, the first transcript is used, `systematic_id.1`'
 systematic_id_description_longest = 'Gene or transcript systematic id, if a gene that contains multiple transcripts is passed, the longest transcript is used'
+organism_description = 'The organism whose data is used, `pombe` (PomBase) or `sgd` (SGD, budding yeast)'
 allele_name_description = 'The allele name. It is only used for alleles of genes with multiple transcripts, in case they start by one of the transcripts names, to use that one. E.g. an allele name starting by zas1.2'
 
 
@@ -206,22 +270,169 @@ def handle_systematic_id_for_allele_qc_http_errors(systematic_id: str, allele_na
         raise HTTPException(404, str(e)) if 'Systematic id' in str(e) else HTTPException(400, str(e))
 
 
-app = FastAPI()
+def get_allele_transvar_coordinates_list(systematic_id: str, allele_type: str, allele_name: str, allele_parts: str, rules_applied: str, genome: dict, db) -> list[str]:
+    """Transvar coordinates of the `|`-separated allele_parts and rules_applied of an allele (see check_allele_description)."""
+    out_list = list()
+    for allele_part, rule_applied in zip(allele_parts.split('|'), rules_applied.split('|')):
+        input_dict = {'systematic_id': systematic_id, 'allele_type': allele_type, 'allele_name': allele_name, 'allele_parts': allele_part, 'rules_applied': rule_applied}
+        input_dict['transvar_input_list'] = format_for_transvar_allele(input_dict, genome, syntax_rules_aminoacids, syntax_rules_nucleotides)
+        # Can give errors for certain transcripts, e.g. it was giving error for frame-shifted transcripts such as SPAC688.08 S1137
+        try:
+            out_list.extend(get_transvar_coordinates_allele(input_dict, db, genome, []))
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+    return out_list
 
 
-@ app.get("/")
-async def root():
-    return RedirectResponse("/docs")
+class OrganismFiles(NamedTuple):
+    """Data files used by the endpoints for an organism, see organism_files."""
+    genome: str
+    transvar_db: str
+    genome_sequence: str
+    coordinate_changes_dict: str
+    allowed_mod_dict: str
+    config: str
+    primer_index: str
 
 
-@ app.get("/check_allele", response_model=CheckAlleleDescriptionResponse)
-async def check_allele(systematic_id: str = Query(example="SPBC359.03c", description=systematic_id_description),
-                       allele_description: str = Query(example="V123A,PLR-140-AAA,150-600"),
-                       allele_type: AlleleType = Query(example="partial_amino_acid_deletion"),
-                       allele_name: str = Query(example='aat1-blah', description=allele_name_description, default='')):
+organism_files = {
+    Organism.pombe: OrganismFiles('data/genome.pickle', 'data/pombe_genome.gtf.transvardb', 'data/pombe_genome.fa', 'data/coordinate_changes_dict.json', 'data/allowed_mod_dict.json', 'config.json', 'data/primer_index.npz'),
+    Organism.sgd: OrganismFiles('data/sgd/genome.pickle', 'data/sgd/features.gtf.transvardb', 'data/sgd/genome_sequence.fsa', 'data/sgd/coordinate_changes_dict.json', 'data/allowed_mod_dict.json', 'data/sgd/config.sgd.json', 'data/sgd/primer_index.npz'),
+}
+
+# The data of each organism is loaded when first used, and kept for at most API_LOADED_ORGANISMS organisms at the
+# same time, those that have been used the least recently are removed from memory first.
+loaded_organisms = int(os.environ.get('API_LOADED_ORGANISMS', len(organism_files)))
+
+
+def genome_version(genome_file: str) -> str:
+    """Identifies the version of the genome file (or another data file), changes when the file is replaced."""
+    stat = os.stat(genome_file)
+    return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+
+@functools.lru_cache(maxsize=loaded_organisms)
+def load_genome(genome_file: str, version: str) -> dict:
+    """Genome used by the endpoints that cache their results, loaded once per process and version (see genome_version)."""
+    with open(genome_file, 'rb') as ins:
+        return pickle.load(ins)
+
+
+def get_genome_version(organism: Organism) -> str:
+    """Version of the genome file of the organism (see genome_version), 404 error if the organism has no genome file."""
+    genome_file = organism_files[organism].genome
+    if not os.path.isfile(genome_file):
+        raise HTTPException(404, f'The data of {organism.value} is not available')
+    return genome_version(genome_file)
+
+
+def get_genome(organism: Organism = Organism.pombe) -> dict:
+    """The current genome of the organism (see load_genome), shared by all the requests, so it must not be modified."""
+    return load_genome(organism_files[organism].genome, get_genome_version(organism))
+
+
+# Up to 3 json files per organism (allowed_mod_dict.json is the same for all of them)
+@functools.lru_cache(maxsize=3 * loaded_organisms)
+def load_json(json_file: str, version: str):
+    """Data file in json format (e.g. data/allowed_mod_dict.json), loaded once per process and version (see genome_version)."""
+    with open(json_file) as ins:
+        return json.load(ins)
+
+
+def get_json(json_file: str):
+    """The current content of json_file (see load_json), shared by all the requests, so it must not be modified."""
+    return load_json(json_file, genome_version(json_file))
+
+
+@functools.lru_cache(maxsize=256)
+def get_genome_region_file(organism: Organism, systematic_id: str, format: str, upstream: int, downstream: int, version: str) -> tuple[str, str]:
+    """
+    The systematic_id of the longest transcript (see process_systematic_id) and the content of the file returned by /genome_region,
+    cached by query and genome version.
+    """
+    genome = load_genome(organism_files[organism].genome, version)
+    systematic_id = process_systematic_id_http_errors(systematic_id, genome, 'longest')
+    seq_record, strand = extract_main_feature_and_strand(genome[systematic_id], downstream, upstream)
+    seq_record.annotations['accession'] = systematic_id
+    if strand == -1:
+        seq_record = seq_record.reverse_complement()
+        seq_record.annotations["molecule_type"] = "DNA"
+        seq_record.annotations['accession'] = systematic_id
+
+    output = io.StringIO()
+    SeqIO.write(seq_record, output, format)
+    return systematic_id, output.getvalue()
+
+
+# lru_cache does not prevent two threads from loading the same database at the same time
+anno_db_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=loaded_organisms)
+def load_anno_db(transvar_db_file: str, genome_sequence_file: str):
+    """Transvar database, loaded once per process, so that the transvar results of all requests can be cached together (see get_transvar_str_annotation)."""
+    return get_anno_db(transvar_db_file, genome_sequence_file)
+
+
+def get_organism_anno_db(organism: Organism = Organism.pombe):
+    """The transvar database of the organism (see load_anno_db)."""
+    with anno_db_lock:
+        return load_anno_db(organism_files[organism].transvar_db, organism_files[organism].genome_sequence)
+
+
+@functools.lru_cache(maxsize=loaded_organisms)
+def load_organism_residue_index(organism: Organism, version: str) -> ResidueIndex:
+    """Residue index (see residue_search.py) built from the genome of the organism, once per process and genome version."""
+    genome = load_genome(organism_files[organism].genome, version)
+    return build_residue_index(genome, get_json(organism_files[organism].coordinate_changes_dict))
+
+
+@functools.lru_cache(maxsize=loaded_organisms)
+def load_organism_primer_index(organism: Organism, version: str) -> PrimerIndex:
+    """
+    Primer index (see primer_search.py) of the organism, from its index file if it is not older than the genome,
+    otherwise built from the genome, once per process and genome version.
+    """
+    genome_file, index_file = organism_files[organism].genome, organism_files[organism].primer_index
+    if os.path.isfile(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(genome_file):
+        return PrimerIndex.load(index_file)
+    return build_primer_index(load_genome(genome_file, version))
+
+
+@functools.lru_cache(maxsize=4096)
+def get_mutant_protein_sequence(organism: Organism, systematic_id: str, allele_name: str, allele_type: str, allele_parts: str, rules_applied: str, version: str) -> str:
+    """
+    Mutant protein sequence of an allele from its parts and rules (see check_allele_description), so that the same
+    allele written in different ways is cached once. allele_name is only used for genes with multiple transcripts.
+    """
+    genome = load_genome(organism_files[organism].genome, version)
+    db = get_organism_anno_db(organism)
+    transvar_coordinates = get_allele_transvar_coordinates_list(systematic_id, allele_type, allele_name, allele_parts, rules_applied, genome, db)
+    if not any('/p.' in c for c in transvar_coordinates):
+        raise HTTPException(400, 'The allele does not have protein coordinates')
+    row = {'systematic_id': systematic_id, 'allele_name': allele_name, 'transvar_coordinates': '|'.join(transvar_coordinates)}
+    try:
+        peptide = str(genome[get_allele_qc_id_with_cds(row, genome)]['peptide'])
+        return transvar_coordinates_to_variant_sequence(peptide, row['transvar_coordinates'])
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+def get_allele_mutant_protein_sequence(systematic_id: str, allele_description: str, allele_type: str, allele_name: str, genome: dict, organism: Organism = Organism.pombe) -> str:
+    """Check the allele description, and get the mutant protein sequence from the cache (see get_mutant_protein_sequence)."""
+    allele_qc_id = handle_systematic_id_for_allele_qc_http_errors(systematic_id, allele_name, genome)
+    syntax_rules = syntax_rules_aminoacids if 'amino' in allele_type else syntax_rules_nucleotides
+    check_allele_resp = check_allele_description(allele_description, syntax_rules, allele_type, allowed_types, genome[allele_qc_id])
+    if check_allele_resp['needs_fixing']:
+        raise HTTPException(400, 'Please fix the allele description first')
+    # The allele name only matters for genes with multiple transcripts
+    if systematic_id in genome:
+        allele_name = ''
+    return get_mutant_protein_sequence(organism, systematic_id, allele_name, allele_type, check_allele_resp['allele_parts'], check_allele_resp['rules_applied'], get_genome_version(organism))
 
-    with open('data/genome.pickle', 'rb') as ins:
-        genome = pickle.load(ins)
+
+def get_check_allele_response(systematic_id: str, allele_description: str, allele_type: str, allele_name: str, organism: Organism = Organism.pombe) -> CheckAlleleDescriptionResponse:
+    genome = get_genome(organism)
     systematic_id = handle_systematic_id_for_allele_qc_http_errors(systematic_id, allele_name, genome)
     if 'amino' in allele_type:
         response_data = CheckAlleleDescriptionResponse.parse_obj(
@@ -236,16 +447,10 @@ async def check_allele(systematic_id: str = Query(example="SPBC359.03c", descrip
     return response_data
 
 
-@ app.get("/check_modification", response_model=CheckModificationResponse)
-async def check_modification(systematic_id: str = Query(example="SPBC359.03c", description=systematic_id_description),
-                             sequence_position: str = Query(example="S12; S23,S31"),
-                             mod_code: str = Query(example="MOD:00046", description='MOD:XXXXX id from the PSI-MOD ontology')):
-
-    with open('data/genome.pickle', 'rb') as ins:
-        genome = pickle.load(ins)
+def get_check_modification_response(systematic_id: str, sequence_position: str, mod_code: str, organism: Organism = Organism.pombe) -> CheckModificationResponse:
+    genome = get_genome(organism)
     systematic_id = process_systematic_id_http_errors(systematic_id, genome, 'first')
-    with open('data/allowed_mod_dict.json', 'r') as ins:
-        allowed_mod_dict = json.load(ins)
+    allowed_mod_dict = get_json(organism_files[organism].allowed_mod_dict)
     errors, change_sequence_position_to = check_modification_description({'systematic_id': systematic_id, 'sequence_position': sequence_position, 'modification': mod_code}, genome, allowed_mod_dict)
     needs_fixing = errors != '' or change_sequence_position_to != ''
     response_data = CheckModificationResponse(sequence_error=errors, change_sequence_position_to=change_sequence_position_to, needs_fixing=needs_fixing)
@@ -253,14 +458,179 @@ async def check_modification(systematic_id: str = Query(example="SPBC359.03c", d
     return response_data
 
 
+def parse_position_ranges(positions: str) -> list[tuple[int, int]]:
+    """Parse `1,3,10-15` into (start, end) ranges, both included, raises ValueError if the syntax is not valid."""
+    ranges = list()
+    for p in positions.split(','):
+        match = re.fullmatch(r'\s*(-?\d+)(?:-(-?\d+))?\s*', p)
+        if match is None:
+            raise ValueError(f'Invalid position: {p}, positions should be in the form 12 or 100-120')
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) is not None else start
+        if start == 0 or end == 0 or start > end:
+            raise ValueError(f'Invalid position: {p}, positions cannot be 0, and ranges must be in increasing order')
+        ranges.append((start, end))
+    return ranges
+
+
+def get_residues_in_range_http_errors(gene: dict, start: int, end: int, dna_or_protein: str) -> str:
+    """
+    The residues from start to end (one-based, both included) of the peptide, or the nucleotides in gene coordinates
+    (see gene_coords2genome_coords) for dna. Only the requested residues are read.
+    """
+    if dna_or_protein == 'protein':
+        if 'peptide' not in gene:
+            raise HTTPException(400, 'cannot read sequence, no peptide')
+        if start < 1 or end > len(gene['peptide']):
+            raise HTTPException(400, f'Position outside of the peptide: {start}-{end}')
+        return str(gene['peptide'][start - 1:end])
+
+    try:
+        genome_start, strand = gene_coords2genome_coords(start, gene)
+        genome_end, _ = gene_coords2genome_coords(end, gene)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    genome_start, genome_end = min(genome_start, genome_end), max(genome_start, genome_end)
+    if genome_start < 1 or genome_end > len(gene['contig']):
+        raise HTTPException(400, f'Position outside of the contig: {start}-{end}')
+    sequence = gene['contig'].seq[genome_start - 1:genome_end]
+    return str(sequence if strand == 1 else sequence.reverse_complement())
+
+
+# Number of threads that run the blocking work of the endpoints, see offload
+worker_threads = int(os.environ.get('API_WORKER_THREADS', 4))
+executor = ThreadPoolExecutor(max_workers=worker_threads, thread_name_prefix='api_worker')
+
+# Maximum number of requests to an endpoint that run at the same time, the others wait without using a worker thread.
+# Can be changed with the environment variable API_CONCURRENCY_LIMITS, e.g. `primer_genome=1,ganno=2`. The endpoints
+# that are not listed can use all the worker threads. Transvar runs one annotation at a time anyway (see transvar_functions.py).
+concurrency_limits = {
+    'primer_genome': 2,
+    'ganno': 1,
+    'canno': 1,
+    'panno': 1,
+    'allele_transvar_coordinates': 2,
+    'protein_modification_transvar_coordinates': 2,
+    'mutant_protein_sequence': 2,
+    'mutant_protein_sequences': 1,
+}
+for limit in filter(None, os.environ.get('API_CONCURRENCY_LIMITS', '').split(',')):
+    endpoint, value = limit.split('=')
+    concurrency_limits[endpoint.strip()] = int(value)
+endpoint_semaphores: dict[str, asyncio.Semaphore] = dict()
+
+
+def offload(endpoint: str):
+    """
+    Decorator to run a blocking endpoint function in the worker threads, so that it does not block the event loop, with
+    at most concurrency_limits[endpoint] requests to that endpoint running at the same time.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if endpoint not in endpoint_semaphores:
+                endpoint_semaphores[endpoint] = asyncio.Semaphore(concurrency_limits.get(endpoint, worker_threads))
+            async with endpoint_semaphores[endpoint]:
+                return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+request_count = Counter('http_requests_total', 'Number of requests by route and status', ('method', 'route', 'status'))
+request_duration = Histogram('http_request_duration_seconds', 'Duration of the requests by route', ('method', 'route'))
+CacheCollector({
+    'genome': load_genome,
+    'genome_region': get_genome_region_file,
+    'mutant_protein_sequence': get_mutant_protein_sequence,
+    'json': load_json,
+    'anno_db': load_anno_db,
+    'residue_index': load_organism_residue_index,
+    'primer_index': load_organism_primer_index,
+    'transvar_annotation': transvar_annotation_cache,
+})
+ProcessMemoryCollector()
+
+
+def preload(organisms: list[Organism]) -> list[Organism]:
+    """
+    Load the data of the organisms used by the endpoints into the caches of this process, so that it is shared by the
+    worker processes forked afterwards (see api_server.py). The grammars are compiled when this module is imported.
+    Returns the organisms that were loaded, those without a genome file are skipped.
+    """
+    loaded = list()
+    for organism in organisms:
+        files = organism_files[organism]
+        if not os.path.isfile(files.genome):
+            continue
+        get_genome(organism)
+        get_json(files.allowed_mod_dict)
+        get_json(files.coordinate_changes_dict)
+        get_json(files.config)
+        if os.path.isfile(files.transvar_db):
+            get_organism_anno_db(organism)
+        loaded.append(organism)
+    return loaded
+
+
+app = FastAPI()
+
+
+@app.middleware('http')
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # The route template (e.g. /ganno), so that the number of labels does not depend on the query
+        route = request.scope.get('route')
+        route_path = route.path if route is not None else 'unmatched'
+        request_count.inc(request.method, route_path, str(status))
+        request_duration.observe(time.perf_counter() - start, request.method, route_path)
+        # Only when several processes serve the requests (see api_server.py)
+        metrics_registry.start_writer()
+
+
+@ app.get("/")
+async def root():
+    return RedirectResponse("/docs")
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Request counts and durations, transvar annotations, cache statistics and memory use in the Prometheus text format."""
+    return PlainTextResponse(metrics_registry.render(), media_type='text/plain; version=0.0.4')
+
+
+@ app.get("/check_allele", response_model=CheckAlleleDescriptionResponse)
+@offload('check_allele')
+def check_allele(systematic_id: str = Query(example="SPBC359.03c", description=systematic_id_description),
+                 allele_description: str = Query(example="V123A,PLR-140-AAA,150-600"),
+                 allele_type: AlleleType = Query(example="partial_amino_acid_deletion"),
+                 allele_name: str = Query(example='aat1-blah', description=allele_name_description, default=''),
+                 organism: Organism = Query(default=Organism.pombe, description=organism_description)):
+    return get_check_allele_response(systematic_id, allele_description, allele_type, allele_name, organism)
+
+
+@ app.get("/check_modification", response_model=CheckModificationResponse)
+@offload('check_modification')
+def check_modification(systematic_id: str = Query(example="SPBC359.03c", description=systematic_id_description),
+                       sequence_position: str = Query(example="S12; S23,S31"),
+                       mod_code: str = Query(example="MOD:00046", description='MOD:XXXXX id from the PSI-MOD ontology'),
+                       organism: Organism = Query(default=Organism.pombe, description=organism_description)):
+    return get_check_modification_response(systematic_id, sequence_position, mod_code, organism)
+
+
 @app.get("/primer")
-async def primer_mutagenesis(systematic_id: str = Query(example="SPAPB1A10.09", description=systematic_id_description),
-                             primer: str = Query(example="TTAGAGGTTATTAATTCCTAAGAAGAAGAAATTTTGG"),
-                             max_mismatch: int = Query(description='The maximum amount of residues that are allowed to change'),
-                             dna_or_protein: DNAorProtein = Query(), upstream: int = 0, downstream: int = 0
-                             ):
-    with open('data/genome.pickle', 'rb') as ins:
-        genome = pickle.load(ins)
+@offload('primer')
+def primer_mutagenesis(systematic_id: str = Query(example="SPAPB1A10.09", description=systematic_id_description),
+                       primer: str = Query(example="TTAGAGGTTATTAATTCCTAAGAAGAAGAAATTTTGG"),
+                       max_mismatch: int = Query(description='The maximum amount of residues that are allowed to change'),
+                       dna_or_protein: DNAorProtein = Query(), upstream: int = 0, downstream: int = 0,
+                       organism: Organism = Query(default=Organism.pombe, description=organism_description)):
+    genome = get_genome(organism)
     systematic_id = process_systematic_id_http_errors(systematic_id, genome, 'first')
     if dna_or_protein == 'protein':
         has_peptide = True
@@ -283,12 +653,37 @@ async def primer_mutagenesis(systematic_id: str = Query(example="SPAPB1A10.09",
     return PlainTextResponse(resp_str)
 
 
+@app.get("/primer_genome", response_model=list[PrimerGenomeMatch])
+@offload('primer_genome')
+def primer_genome(primer: str = Query(example="TTAGAGGTTATTAATTCCTAAGAAGAAGAAATTTTGG"),
+                  max_mismatch: int = Query(ge=0, description='The maximum amount of residues that are allowed to change'),
+                  organism: Organism = Query(default=Organism.pombe, description=organism_description)):
+    """
+    Find the primer in the whole genome (both strands, and the spliced CDSs for primers that span exon borders), and
+    the mutations that it introduces in the genes it overlaps.
+    """
+    genome = get_genome(organism)
+    config = get_json(organism_files[organism].config)
+    primer = re.sub(r'\s+', '', primer.upper())
+    if not re.fullmatch('[ACGT]+', primer):
+        raise HTTPException(422, 'The primer can only contain the nucleotides A, C, G and T')
+    # Otherwise the index cannot be used (see PrimerIndex.candidate_starts), and the primer matches too many positions
+    if len(primer) < min_seed_length:
+        raise HTTPException(422, f'The primer must have at least {min_seed_length} nucleotides')
+    if len(primer) // (max_mismatch + 1) < min_seed_length:
+        raise HTTPException(422, f'At most {len(primer) // min_seed_length - 1} mismatches are allowed for a primer of {len(primer)} nucleotides')
+    index = load_organism_primer_index(organism, get_genome_version(organism))
+    result = find_primer_in_genome(primer, max_mismatch, index, genome, config)
+    return [PrimerGenomeMatch(contig=h.contig, start=h.start, end=h.end, strand=h.strand, mismatches=h.mismatches, genes=[PrimerGeneMatch(**g._asdict()) for g in h.genes]) for h in result]
+
+
 # The same endpoint as above as a get endpoint
 @ app.get("/multi_shift_fix", response_model=list[AlleleFix])
-async def fix_with_multi_shift(systematic_id: str = Query(example="SPAPB1A10.09", description=systematic_id_description), targets: str = Query(example="S123,A124,N125"), dna_or_protein: DNAorProtein = DNAorProtein('protein')):
+@offload('multi_shift_fix')
+def fix_with_multi_shift(systematic_id: str = Query(example="SPAPB1A10.09", description=systematic_id_description), targets: str = Query(example="S123,A124,N125"), dna_or_protein: DNAorProtein = DNAorProtein('protein'),
+                         organism: Organism = Query(default=Organism.pombe, description=organism_description)):
 
-    with open('data/genome.pickle', 'rb') as ins:
-        genome = pickle.load(ins)
+    genome = get_genome(organism)
     systematic_id = process_systematic_id_http_errors(systematic_id, genome, 'first')
 
     gene = genome[systematic_id]
@@ -309,12 +704,12 @@ async def fix_with_multi_shift(systematic_id: str = Query(example="SPAPB1A10.09"
 
 
 @ app.get("/old_coords_fix", response_model=list[OldCoordsFix])
-async def fix_with_old_coords(systematic_id: str = Query(example="SPBC1706.01", description=systematic_id_description), targets: str = Query(example="P170A,V223A,F225A,AEY-171-LLL")):
-    with open('data/coordinate_changes_dict.json') as ins:
-        coordinate_changes_dict = json.load(ins)
+@offload('old_coords_fix')
+def fix_with_old_coords(systematic_id: str = Query(example="SPBC1706.01", description=systematic_id_description), targets: str = Query(example="P170A,V223A,F225A,AEY-171-LLL"),
+                        organism: Organism = Query(default=Organism.pombe, description=organism_description)):
+    coordinate_changes_dict = get_json(organism_files[organism].coordinate_changes_dict)
     # We load the genome just to check if the systematic ID is valid
-    with open('data/genome.pickle', 'rb') as ins:
-        genome = pickle.load(ins)
+    genome = get_genome(organism)
     systematic_id = process_systematic_id_http_errors(systematic_id, genome, 'first')
     targets = process_fix_targets(targets.split(','))
     if systematic_id not in coordinate_changes_dict:
@@ -324,9 +719,10 @@ async def fix_with_old_coords(systematic_id: str = Query(example="SPBC1706.01",
 
 
 @ app.get("/histone_fix", response_model=list[AlleleFix])
-async def fix_histone(systematic_id: str = Query(example="SPAC1834.04", description=systematic_id_description), targets: str = Query(example="ART-1-LLL,K9A,K14R,K14A")):
-    with open('data/genome.pickle', 'rb') as ins:
-        genome = pickle.load(ins)
+@offload('histone_fix')
+def fix_histone(systematic_id: str = Query(example="SPAC1834.04", description=systematic_id_description), targets: str = Query(example="ART-1-LLL,K9A,K14R,K14A"),
+                organism: Organism = Query(default=Organism.pombe, description=organism_description)):
+    genome = get_genome(organism)
     systematic_id = process_systematic_id_http_errors(systematic_id, genome, 'first')
     targets = process_fix_targets(targets.split(','))
     result = apply_histone_fix({'systematic_id': systematic_id, 'targets': ','.join(targets)}, genome, 'targets')
@@ -334,116 +730,175 @@ async def fix_histone(systematic_id: str = Query(example="SPAC1834.04", descript
 
 
 @app.get("/genome_region")
-async def get_genome_region(systematic_id: str = Query(example="SPAC1834.04", description=systematic_id_description_longest), format: SequenceFileFormat = Query(example="genbank"), upstream: int = 0, downstream: int = 0):
-
-    with open('data/genome.pickle', 'rb') as ins:
-        genome = pickle.load(ins)
-    systematic_id = process_systematic_id_http_errors(systematic_id, genome, 'longest')
-
-    seq_record, strand = extract_main_feature_and_strand(genome[systematic_id], downstream, upstream)
-    seq_record.annotations['accession'] = systematic_id
-
-    extension = 'gb'
-
-    if format != 'genbank':
-        extension = format
-
-    with tempfile.NamedTemporaryFile('w', encoding='utf-8', delete=False) as fp:
-        if strand == 1:
-            SeqIO.write(seq_record, fp, format)
-        else:
-            rv = seq_record.reverse_complement()
-            rv.annotations["molecule_type"] = "DNA"
-            rv.annotations['accession'] = systematic_id
-            SeqIO.write(rv, fp, format)
-
-        return FileResponse(fp.name, background=BackgroundTask(lambda: os.remove(fp.name)), filename=f'{systematic_id}.{extension}')
+@offload('genome_region')
+def get_genome_region(systematic_id: str = Query(example="SPAC1834.04", description=systematic_id_description_longest), format: SequenceFileFormat = Query(example="genbank"), upstream: int = 0, downstream: int = 0,
+                      if_none_match: Optional[str] = Header(default=None, description='ETag of a previous response, to get a 304 response if it has not changed'),
+                      organism: Organism = Query(default=Organism.pombe, description=organism_description)):
+    """
+    The sequence of the gene with the upstream and downstream regions in the chosen format. The response has an ETag that
+    depends on the query and the genome version, so that repeated downloads can be answered with 304 Not Modified.
+    """
+    version = get_genome_version(organism)
+    etag = '"' + hashlib.sha1(f'{organism.value}|{systematic_id}|{format.value}|{upstream}|{downstream}|{version}'.encode()).hexdigest() + '"'
+    if if_none_match is not None and etag in [e.strip().removeprefix('W/') for e in if_none_match.split(',')]:
+        return Response(status_code=304, headers={'ETag': etag})
+
+    # Raises a 404 error if the systematic_id does not exist, so that `If-None-Match: *` only matches existing genes
+    systematic_id, content = get_genome_region_file(organism, systematic_id, format.value, upstream, downstream, version)
+    if if_none_match is not None and if_none_match.strip() == '*':
+        return Response(status_code=304, headers={'ETag': etag})
+    extension = 'gb' if format == 'genbank' else format.value
+    return Response(content, media_type='text/plain', headers={'ETag': etag, 'Content-Disposition': f'attachment; filename="{systematic_id}.{extension}"'})
 
 
 @app.get('/residue_at_position', response_class=PlainTextResponse)
-async def get_residue_at_position(systematic_id: str = Query(example='SPAPB1A10.09', description=systematic_id_description), position: int = Query(example=1), dna_or_protein: DNAorProtein = Query(example='protein')):
-    with open('data/genome.pickle', 'rb') as ins:
-        genome = pickle.load(ins)
+@offload('residue_at_position')
+def get_residue_at_position(systematic_id: str = Query(example='SPAPB1A10.09', description=systematic_id_description), position: int = Query(example=1), dna_or_protein: DNAorProtein = Query(example='protein'),
+                            organism: Organism = Query(default=Organism.pombe, description=organism_description)):
+    genome = get_genome(organism)
+    if systematic_id not in genome:
+        raise HTTPException(404, 'Systematic id does not exist')
+    return PlainTextResponse(get_residues_in_range_http_errors(genome[systematic_id], position, position, dna_or_protein))
+
+
+@app.get('/residues_at_positions', response_model=list[ResiduesAtPositions])
+@offload('residues_at_positions')
+def get_residues_at_positions(systematic_id: str = Query(example='SPAPB1A10.09', description=systematic_id_description),
+                              positions: str = Query(example='1,3,10-15', description='Comma-separated positions or ranges of positions (both included)'),
+                              dna_or_protein: DNAorProtein = Query(example='protein'),
+                              organism: Organism = Query(default=Organism.pombe, description=organism_description)):
+    """
+    Same as /residue_at_position for several positions and ranges of positions. For dna, the positions are relative to the
+    start of the CDS (or RNA feature), negative positions are upstream of it, e.g. `-10--1` are the 10 nucleotides upstream.
+    """
+    genome = get_genome(organism)
     if systematic_id not in genome:
         raise HTTPException(404, 'Systematic id does not exist')
+    try:
+        ranges = parse_position_ranges(positions)
+    except ValueError as e:
+        raise HTTPException(422, str(e))
     gene = genome[systematic_id]
-    if dna_or_protein == 'dna':
-        return PlainTextResponse(get_nt_at_gene_coord(position, gene, gene['contig']))
-    elif dna_or_protein == 'protein':
-        if 'peptide' not in gene:
-            raise ValueError('cannot read sequence, no peptide')
-        return PlainTextResponse(gene['peptide'][position - 1])
+    return [ResiduesAtPositions(positions=p, sequence=get_residues_in_range_http_errors(gene, start, end, dna_or_protein)) for p, (start, end) in zip(positions.split(','), ranges)]
+
+
+@app.get('/find_protein_by_residues', response_model=list[ResidueSearchMatch])
+@offload('find_protein_by_residues')
+def find_protein_by_residues(residues: str = Query(example='S103,S107,T106,S110', description='Comma-separated residues'),
+                             st_equivalent: bool = Query(default=False, description='Whether S and T residues are considered equivalent'),
+                             max_mismatches: int = Query(default=0, ge=0, description='The maximum amount of residues that can be missing from the protein'),
+                             organism: Organism = Query(default=Organism.pombe, description=organism_description)):
+    """
+    Proteins in the current genome (empty revision) or previous gene structures that contain the residues, sorted by number of mismatches.
+    """
+    index = load_organism_residue_index(organism, get_genome_version(organism))
+    try:
+        result = find_protein_by_residues_func(residues, index, st_equivalent, max_mismatches)
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+    return [ResidueSearchMatch(systematic_id=m.systematic_id, revision=m.revision, mismatches=m.mismatches) for m in result]
 
 
 @ app.get("/ganno", summary='Variant described at the genome level (gDNA)', response_model=list[TransvarAnnotation])
-async def ganno(variant_description: str = Query(example="II:g.178497T>A", description='Variant described at the genome level (gDNA)')) -> list[TransvarAnnotation]:
+@offload('ganno')
+def ganno(variant_description: str = Query(example="II:g.178497T>A", description='Variant described at the genome level (gDNA)'),
+          organism: Organism = Query(default=Organism.pombe, description=organism_description)) -> list[TransvarAnnotation]:
     try:
-        db = get_anno_db('data/pombe_genome.gtf.transvardb', 'data/pombe_genome.fa')
+        db = get_organism_anno_db(organism)
         return parse_transvar_string(get_transvar_str_annotation('ganno', variant_description, db))
     except Exception as e:
         raise HTTPException(400, str(e))
 
 
 @ app.get("/canno", summary='Variant described at the coding DNA level (cDNA)', response_model=list[TransvarAnnotation])
-async def canno(variant_description: str = Query(example="SPAC3F10.09:c.5A>T", description='Variant described at the coding DNA level (cDNA)')) -> list[TransvarAnnotation]:
+@offload('canno')
+def canno(variant_description: str = Query(example="SPAC3F10.09:c.5A>T", description='Variant described at the coding DNA level (cDNA)'),
+          organism: Organism = Query(default=Organism.pombe, description=organism_description)) -> list[TransvarAnnotation]:
     try:
-        db = get_anno_db('data/pombe_genome.gtf.transvardb', 'data/pombe_genome.fa')
+        db = get_organism_anno_db(organism)
         return parse_transvar_string(get_transvar_str_annotation('canno', variant_description, db))
     except Exception as e:
         raise HTTPException(400, str(e))
 
 
 @ app.get("/panno", summary='Variant described at the protein level', response_model=list[TransvarAnnotation])
-async def panno(variant_description: str = Query(example="SPBC1198.04c:p.N3A", description='Variant described at the protein level')) -> list[TransvarAnnotation]:
+@offload('panno')
+def panno(variant_description: str = Query(example="SPBC1198.04c:p.N3A", description='Variant described at the protein level'),
+          organism: Organism = Query(default=Organism.pombe, description=organism_description)) -> list[TransvarAnnotation]:
     try:
-        db = get_anno_db('data/pombe_genome.gtf.transvardb', 'data/pombe_genome.fa')
+        db = get_organism_anno_db(organism)
         return parse_transvar_string(get_transvar_str_annotation('panno', variant_description, db))
     except Exception as e:
         raise HTTPException(400, str(e))
 
 
 @ app.get("/allele_transvar_coordinates", response_class=PlainTextResponse)
-async def allele_transvar_coordinates(systematic_id: str = Query(example="SPBC359.03c", description=systematic_id_description),
-                                      allele_description: str = Query(example="A3V,SEA23PPP,150-200"),
-                                      allele_type: AlleleType = Query(example="amino_acid_deletion_and_mutation"),
-                                      allele_name: str = Query(example="aat1-1", description=allele_name_description, default='')):
+@offload('allele_transvar_coordinates')
+def allele_transvar_coordinates(systematic_id: str = Query(example="SPBC359.03c", description=systematic_id_description),
+                                allele_description: str = Query(example="A3V,SEA23PPP,150-200"),
+                                allele_type: AlleleType = Query(example="amino_acid_deletion_and_mutation"),
+                                allele_name: str = Query(example="aat1-1", description=allele_name_description, default=''),
+                                organism: Organism = Query(default=Organism.pombe, description=organism_description)):
 
-    check_allele_resp = await check_allele(systematic_id, allele_description, allele_type)
+    check_allele_resp = get_check_allele_response(systematic_id, allele_description, allele_type, allele_name, organism)
 
     if check_allele_resp.needs_fixing:
         raise HTTPException(400, 'Please fix the allele description first')
 
-    with open('data/genome.pickle', 'rb') as ins:
-        genome = pickle.load(ins)
+    genome = get_genome(organism)
+
+    db = get_organism_anno_db(organism)
+
+    out_list = get_allele_transvar_coordinates_list(systematic_id, allele_type, allele_name, check_allele_resp.allele_parts, check_allele_resp.rules_applied, genome, db)
+    return PlainTextResponse('|'.join(out_list))
 
-    db = get_anno_db('data/pombe_genome.gtf.transvardb', 'data/pombe_genome.fa')
 
+@app.get("/mutant_protein_sequence", response_class=PlainTextResponse)
+@offload('mutant_protein_sequence')
+def mutant_protein_sequence(systematic_id: str = Query(example="SPBC359.03c", description=systematic_id_description),
+                            allele_description: str = Query(example="A3V,SEA23PPP,150-200"),
+                            allele_type: AlleleType = Query(example="amino_acid_deletion_and_mutation"),
+                            allele_name: str = Query(example="aat1-1", description=allele_name_description, default=''),
+                            organism: Organism = Query(default=Organism.pombe, description=organism_description)):
+    """
+    Protein sequence of the allele, with the stop codon at the end, as in the FASTA file of generate_mutant_protein_sequences.py.
+    """
+    genome = get_genome(organism)
+    return PlainTextResponse(get_allele_mutant_protein_sequence(systematic_id, allele_description, allele_type, allele_name, genome, organism))
+
+
+@app.post("/mutant_protein_sequences", response_model=list[MutantProteinSequence])
+@offload('mutant_protein_sequences')
+def mutant_protein_sequences(alleles: list[MutantProteinSequenceQuery], organism: Organism = Query(default=Organism.pombe, description=organism_description)):
+    """
+    Same as /mutant_protein_sequence for several alleles, the errors are returned in the `error` field of each allele.
+    """
+    if len(alleles) > max_mutant_protein_sequences:
+        raise HTTPException(422, f'At most {max_mutant_protein_sequences} alleles can be requested at once')
+    genome = get_genome(organism)
     out_list = list()
-    for allele_part, rule_applied in zip(check_allele_resp.allele_parts.split('|'), check_allele_resp.rules_applied.split('|')):
-        input_dict = {'systematic_id': systematic_id, 'allele_description': allele_description, 'allele_type': allele_type, 'allele_name': allele_name, 'allele_parts': allele_part, 'rules_applied': rule_applied}
-        input_dict['transvar_input_list'] = format_for_transvar_allele(input_dict, genome, syntax_rules_aminoacids, syntax_rules_nucleotides)
-        # Can give errors for certain transcripts, e.g. it was giving error for frame-shifted transcripts such as SPAC688.08 S1137
+    for allele in alleles:
         try:
-            out_list.append(get_transvar_coordinates_allele(input_dict, db, genome, []))
-        except ValueError as e:
-            raise HTTPException(400, str(e))
-
-    return PlainTextResponse('|'.join(sum(out_list, [])))
+            out_list.append(MutantProteinSequence(**allele.dict(), sequence=get_allele_mutant_protein_sequence(allele.systematic_id, allele.allele_description, allele.allele_type, allele.allele_name, genome, organism)))
+        except HTTPException as e:
+            out_list.append(MutantProteinSequence(**allele.dict(), error=e.detail))
+    return out_list
 
 
 @ app.get("/protein_modification_transvar_coordinates", response_class=PlainTextResponse)
-async def protein_modification_coordinates(systematic_id: str = Query(example="SPBC359.03c", description=systematic_id_description), sequence_position: str = Query(example="A3,K4")):
+@offload('protein_modification_transvar_coordinates')
+def protein_modification_coordinates(systematic_id: str = Query(example="SPBC359.03c", description=systematic_id_description), sequence_position: str = Query(example="A3,K4"),
+                                     organism: Organism = Query(default=Organism.pombe, description=organism_description)):
 
     # We pass MOD:00000 as mod code, because it allows all aminoacids, we should not check this here
-    check_modification_resp = await check_modification(systematic_id, sequence_position, 'MOD:00000')
+    check_modification_resp = get_check_modification_response(systematic_id, sequence_position, 'MOD:00000', organism)
 
     if check_modification_resp.needs_fixing:
         raise HTTPException(400, 'Please fix the modification description first')
 
-    with open('data/genome.pickle', 'rb') as ins:
-        genome = pickle.load(ins)
+    genome = get_genome(organism)
 
-    db = get_anno_db('data/pombe_genome.gtf.transvardb', 'data/pombe_genome.fa')
+    db = get_organism_anno_db(organism)
 
     out_list = list()
     for sequence_position_i in sequence_position.split(','):
@@ -0,0 +1,113 @@
+"""
+Serve the API (api.py) with several worker processes that share the data used by the endpoints.
+
+The genome, the json data files (data/allowed_mod_dict.json, data/coordinate_changes_dict.json, config.json), the
+transvar database and the grammars are loaded once in this process (see api.preload) for the organisms in --preload,
+and the workers are then forked from it, so that they share that memory copy-on-write instead of loading their own copy,
+as they do with `uvicorn --workers`.
+Workers that exit are replaced, and the memory used by each worker is printed every --memory_report_interval seconds:
+`rss` counts the shared memory in every worker, `pss` divides it between the processes that share it.
+
+Each worker has its own metrics, they write them to a temporary directory, and the /metrics endpoint of any worker
+returns those of all the workers (see metrics.py).
+
+The data loaded by the workers after they have been forked (e.g. a new genome file, or the data of an organism that
+was not preloaded) is not shared.
+
+Linux only (uses fork and /proc).
+"""
+import argparse
+import gc
+import os
+import shutil
+import signal
+import tempfile
+import time
+import uvicorn
+import api
+from metrics import read_memory_rollup
+
+
+def format_memory_report(pids: list[int]) -> str:
+    """Resident, proportional, shared and private memory in MB of each process in pids (see metrics.read_memory_rollup)."""
+    lines = ['pid\trss\tpss\tshared\tprivate']
+    for pid in pids:
+        memory = read_memory_rollup(pid)
+        shared = memory.get('Shared_Clean', 0) + memory.get('Shared_Dirty', 0)
+        private = memory.get('Private_Clean', 0) + memory.get('Private_Dirty', 0)
+        lines.append('\t'.join([str(pid)] + [f'{value / 2 ** 20:.1f}' for value in [memory.get('Rss', 0), memory.get('Pss', 0), shared, private]]))
+    return '\n'.join(lines)
+
+
+def start_worker(config: uvicorn.Config, sock) -> int:
+    """Fork a worker that serves the requests received in sock, returns its pid."""
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    # Restore the default handlers, uvicorn sets its own ones to shut down the worker gracefully
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    uvicorn.Server(config).run(sockets=[sock])
+    os._exit(0)
+
+
+def main(host, port, workers, memory_report_interval, log_level, preload_organisms):
+    print('Loading data...')
+    loaded = api.preload(preload_organisms)
+    print('Loaded the data of:', ', '.join(o.value for o in loaded) or 'no organism')
+    # Objects created so far are not tracked by the garbage collector anymore, otherwise its passes in the workers
+    # write to the memory pages of the preloaded data and they stop being shared
+    gc.collect()
+    gc.freeze()
+
+    api.metrics_registry.multiprocess_dir = tempfile.mkdtemp(prefix='api_metrics_')
+
+    config = uvicorn.Config(api.app, host=host, port=port, log_level=log_level)
+    sock = config.bind_socket()
+    pids = [start_worker(config, sock) for _ in range(workers)]
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    last_report = time.monotonic()
+    while pids:
+        pid, _ = os.waitpid(-1, os.WNOHANG)
+        if pid in pids:
+            pids.remove(pid)
+            if not stopping:
+                print(f'Worker {pid} exited, starting a new one')
+                pids.append(start_worker(config, sock))
+            continue
+        if memory_report_interval > 0 and time.monotonic() - last_report >= memory_report_interval and not stopping:
+            print(format_memory_report([os.getpid()] + pids), flush=True)
+            last_report = time.monotonic()
+        time.sleep(0.5)
+    sock.close()
+    shutil.rmtree(api.metrics_registry.multiprocess_dir)
+
+
+if __name__ == '__main__':
+    class Formatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter):
+        pass
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=Formatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('API_WORKERS', 2)), help='number of worker processes, can be set with the environment variable API_WORKERS')
+    parser.add_argument('--memory_report_interval', type=float, default=600, help='seconds between reports of the memory used by the workers, 0 to disable them')
+    parser.add_argument('--preload', nargs='+', choices=[o.value for o in api.Organism], default=os.environ.get('API_PRELOAD_ORGANISMS', 'pombe').split(','), help='organisms whose data is loaded before starting the workers, can be set with the environment variable API_PRELOAD_ORGANISMS (comma-separated)')
+    parser.add_argument('--log_level', default='info', choices=['critical', 'error', 'warning', 'info', 'debug', 'trace'])
+    args = parser.parse_args()
+
+    main(args.host, args.port, args.workers, args.memory_report_interval, args.log_level, [api.Organism(o) for o in args.preload])
@@ -2,15 +2,15 @@ import sys
 import pandas
 from refinement_functions import check_allele_description
 from grammar import allowed_types_dict, aminoacid_grammar, nucleotide_grammar
-from models import SyntaxRule
+from models import parse_grammar
 import pickle
 
 
 def main(input_file):
     with open('data/genome.pickle', 'rb') as ins:
         genome = pickle.load(ins)
-    syntax_rules_aminoacids = [SyntaxRule.parse_obj(r) for r in aminoacid_grammar]
-    syntax_rules_nucleotides = [SyntaxRule.parse_obj(r) for r in nucleotide_grammar]
+    syntax_rules_aminoacids = parse_grammar(aminoacid_grammar)
+    syntax_rules_nucleotides = parse_grammar(nucleotide_grammar)
     data = pandas.read_csv(input_file, sep='\t')
     data.fillna('', inplace=True)
     for i, line in data.iterrows():
@@ -1,6 +1,8 @@
 import pandas
 from allele_fixes import multi_shift_fix, old_coords_fix, shift_coordinates_by_x, position_or_index_exists
 import re
+import os
+from concurrent.futures import ProcessPoolExecutor
 
 
 def apply_multi_shift_fix(row, genome, target_column):
@@ -71,6 +73,59 @@ def get_preferred_fix(row):
     return '', ''
 
 
+# Columns returned by apply_fixes_by_gene
+fix_columns = ['old_coords_fix', 'old_coords_revision', 'old_coords_location', 'multi_shift_fix', 'histone_fix', 'auto_fix_to', 'auto_fix_comment']
+
+
+def get_gene_fixes(systematic_id: str, gene: dict, coordinate_changes: list[dict], targets_list: list[str]) -> list[dict]:
+    """
+    Apply all fixes to each of the targets of a gene (comma-separated positions, e.g. 'A123,P124V'), and return
+    a dictionary with the fix_columns for each of them. gene and coordinate_changes are the entries of the genome
+    and coordinate_changes_dict for that gene (None if missing).
+    """
+    genome = dict() if gene is None else {systematic_id: gene}
+    coordinate_changes_dict = dict() if coordinate_changes is None else {systematic_id: coordinate_changes}
+    gene_fixes = list()
+    for targets in targets_list:
+        row = {'systematic_id': systematic_id, 'targets': targets}
+        row['old_coords_fix'], row['old_coords_revision'], row['old_coords_location'] = apply_old_coords_fix(row, coordinate_changes_dict, 'targets')
+        row['multi_shift_fix'] = apply_multi_shift_fix(row, genome, 'targets')
+        row['histone_fix'] = apply_histone_fix(row, genome, 'targets')
+        row['auto_fix_to'], row['auto_fix_comment'] = get_preferred_fix(row)
+        gene_fixes.append({column: row[column] for column in fix_columns})
+    return gene_fixes
+
+
+def apply_fixes_by_gene(data: pandas.DataFrame, genome, coordinate_changes_dict, target_column, processes: int = None) -> pandas.DataFrame:
+    """
+    Same as applying apply_old_coords_fix, apply_multi_shift_fix, apply_histone_fix and get_preferred_fix to each row
+    of data, returning the fix_columns with the same index as data. The rows are grouped by systematic_id, and each
+    gene is processed in a worker process (by default as many as CPUs, if processes is 1 everything runs in this process),
+    to which only the peptide and the coordinate changes of the gene are sent.
+    """
+    rows_by_gene = dict()
+    for i, systematic_id, targets in zip(data.index, data['systematic_id'], data[target_column]):
+        rows_by_gene.setdefault(systematic_id, list()).append((i, targets))
+
+    systematic_ids = list(rows_by_gene)
+    # Only the peptide is needed from the gene
+    genes = [{k: v for k, v in genome[s].items() if k == 'peptide'} if s in genome else None for s in systematic_ids]
+    coordinate_changes = [coordinate_changes_dict.get(s) for s in systematic_ids]
+    targets_lists = [[targets for _, targets in rows_by_gene[s]] for s in systematic_ids]
+
+    if processes is None:
+        processes = os.cpu_count()
+    if processes == 1 or len(systematic_ids) < 2:
+        gene_fixes = list(map(get_gene_fixes, systematic_ids, genes, coordinate_changes, targets_lists))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            gene_fixes = list(executor.map(get_gene_fixes, systematic_ids, genes, coordinate_changes, targets_lists, chunksize=8))
+
+    index = [i for s in systematic_ids for i, _ in rows_by_gene[s]]
+    fixes = [fix for this_gene_fixes in gene_fixes for fix in this_gene_fixes]
+    return pandas.DataFrame(fixes, index=index, columns=fix_columns).loc[data.index]
+
+
 def format_auto_fix(row, target_column, syntax_error_column):
     syntax_error = row[syntax_error_column] != ''
 
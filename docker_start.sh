@@ -4,4 +4,5 @@ set -e
 # python build_alignment_dict_from_genome.py
 . transvar_env_vars.sh
 bash set_up_transvar.sh
-uvicorn api:app --host 0.0.0.0 --port 80
\ No newline at end of file
+# Loads the data once and forks API_WORKERS workers that share it (see api_server.py)
+python api_server.py --host 0.0.0.0 --port 80
\ No newline at end of file
@@ -0,0 +1,137 @@
+"""
+Optional stage, run after allele_auto_fix.py and protein_modification_auto_fix.py. For the sequence errors that could not
+be fixed, finds other genes (current or previous gene structures, see residue_search.py) in which all the residues
+mentioned by the alleles / modifications of a gene in a publication exist, which is usually the case when they have been
+attached to the wrong gene (e.g. a paralog).
+
+Inputs:
+    - results/allele_results.tsv: the output of allele_qc.py (to get the reference and the parts of the alleles)
+    - results/allele_cannot_fix_sequence_errors.tsv: the output of allele_auto_fix.py
+    - results/protein_modification_cannot_fix_sequence_errors.tsv: the output of protein_modification_auto_fix.py
+    - data/genome.pickle: the genome data from PomBase (see load_genome.py)
+    - data/coordinate_changes_dict.json: the coordinate changes dictionary (see build_alignment_dict_from_genome.py)
+
+Outputs:
+    - results/allele_gene_reassignment.tsv
+    - results/protein_modification_gene_reassignment.tsv
+
+With one row per candidate gene for each gene and publication (`systematic_id`, `reference`), with the columns:
+    - targets: the residues that were searched
+    - candidate_systematic_id, candidate_revision: the gene in which the residues exist, and the revision of the gene
+      structure if it's not the current one
+    - allele_names / sequence_position: the alleles or modification positions that would be reassigned
+    - mismatches: if --max_mismatches is used, the targets that are not present in the candidate
+"""
+import argparse
+import pickle
+import json
+import re
+import pandas
+from grammar import aminoacid_grammar
+from models import parse_grammar
+from allele_auto_fix import get_aminoacid_alleles, get_allele_mutations
+from residue_search import ResidueIndex, build_residue_index, parse_residues
+from results_io import output_formats, check_output_formats, read_results, write_results
+
+
+def mutation_residues(mutation: str) -> list[str]:
+    """
+    The residues referred to by a mutation (single mutation after splitting the multiple_aa) or modification, e.g.
+    V123A => [V123], PLR-140-AAA => [P140, L141, R142], 150-600 => [].
+    """
+    match = re.match(r'([A-Z]+)-?(\d+)', mutation)
+    if match is None:
+        return []
+    residues, start = match.groups()
+    return [f'{residue}{int(start) + i}' for i, residue in enumerate(residues)]
+
+
+def get_allele_targets(allele_results: pandas.DataFrame, allele_errors: pandas.DataFrame, multiple_aa_regex: str) -> dict[tuple[str, str], tuple[list[str], list[str]]]:
+    """
+    For the alleles that still have sequence errors, dictionary (systematic_id, reference) -> (residues, allele_names),
+    with the residues of all the alleles of that gene in that reference.
+    """
+    data = allele_results.merge(allele_errors[['systematic_id', 'allele_name']].drop_duplicates(), on=['systematic_id', 'allele_name'])
+    data = data[get_aminoacid_alleles(data)]
+    capture_groups = [[None] * len(x.split('|')) for x in data['rules_applied']]
+    allele_mutations = get_allele_mutations(data, capture_groups, multiple_aa_regex)
+
+    targets = dict()
+    for systematic_id, allele_description, allele_name, reference, rule_applied, sequence_error, allele_part, mutation in allele_mutations:
+        residues, allele_names = targets.setdefault((systematic_id, reference), (list(), list()))
+        residues.extend(r for r in mutation_residues(mutation) if r not in residues)
+        if allele_name not in allele_names:
+            allele_names.append(allele_name)
+    return targets
+
+
+def get_modification_targets(modification_errors: pandas.DataFrame) -> dict[tuple[str, str], list[str]]:
+    """Dictionary (systematic_id, reference) -> residues in the sequence_position of the modifications with sequence errors."""
+    targets = dict()
+    for systematic_id, reference, sequence_position in zip(modification_errors['systematic_id'], modification_errors['reference'], modification_errors['sequence_position']):
+        residues = targets.setdefault((systematic_id, reference), list())
+        for position in sequence_position.split(','):
+            residues.extend(r for r in mutation_residues(position) if r not in residues)
+    return targets
+
+
+def find_candidate_genes(targets: dict[tuple[str, str], list[str]], index: ResidueIndex, min_targets: int, max_mismatches: int = 0, st_equivalent: bool = False) -> pandas.DataFrame:
+    """
+    Search the targets of each (systematic_id, reference) in the index, only for those with at least min_targets
+    different positions (otherwise the residues are often found by chance). Returns a dataframe with the columns
+    systematic_id, reference, targets, candidate_systematic_id, candidate_revision and mismatches.
+    """
+    rows = list()
+    for (systematic_id, reference), residues in targets.items():
+        parsed_residues = parse_residues(','.join(residues))
+        if len(set(r[1] for r in parsed_residues)) < min_targets:
+            continue
+        for match in index.search(parsed_residues, st_equivalent, max_mismatches):
+            if match.systematic_id != systematic_id:
+                rows.append((systematic_id, reference, ','.join(residues), match.systematic_id, match.revision, ','.join(match.mismatches)))
+
+    return pandas.DataFrame(rows, columns=['systematic_id', 'reference', 'targets', 'candidate_systematic_id', 'candidate_revision', 'mismatches'])
+
+
+def main(genome_file, coordinate_changes_file, allele_results_file, allele_errors_file, modification_errors_file, output_dir, min_targets=4, max_mismatches=0, st_equivalent=False, formats=('tsv',)):
+    with open(genome_file, 'rb') as ins:
+        genome = pickle.load(ins)
+
+    with open(coordinate_changes_file) as ins:
+        coordinate_changes_dict = json.load(ins)
+
+    index = build_residue_index(genome, coordinate_changes_dict)
+
+    syntax_rules_dict = {f'{r.type}:{r.rule_name}': r for r in parse_grammar(aminoacid_grammar)}
+    allele_targets = get_allele_targets(read_results(allele_results_file), read_results(allele_errors_file), syntax_rules_dict['amino_acid_mutation:multiple_aa'].regex)
+    allele_candidates = find_candidate_genes({key: value[0] for key, value in allele_targets.items()}, index, min_targets, max_mismatches, st_equivalent)
+    allele_candidates['allele_names'] = [','.join(allele_targets[key][1]) for key in zip(allele_candidates['systematic_id'], allele_candidates['reference'])]
+    write_results(allele_candidates, f'{output_dir}/allele_gene_reassignment.tsv', formats)
+
+    modification_targets = get_modification_targets(read_results(modification_errors_file))
+    modification_candidates = find_candidate_genes(modification_targets, index, min_targets, max_mismatches, st_equivalent)
+    write_results(modification_candidates, f'{output_dir}/protein_modification_gene_reassignment.tsv', formats)
+
+    print(f'{allele_candidates[["systematic_id", "reference"]].drop_duplicates().shape[0]} of {len(allele_targets)} gene / reference pairs with allele sequence errors have candidate genes')
+    print(f'{modification_candidates[["systematic_id", "reference"]].drop_duplicates().shape[0]} of {len(modification_targets)} gene / reference pairs with modification sequence errors have candidate genes')
+
+
+if __name__ == '__main__':
+    class Formatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter):
+        pass
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=Formatter)
+    parser.add_argument('--genome', default='data/genome.pickle', help='input: genome dictionary built from contig files (see load_genome.py).')
+    parser.add_argument('--coordinate_changes_dict', default='data/coordinate_changes_dict.json', help='input: coordinate changes dictionary (see build_alignment_dict_from_genome.py -PomBase- or build_alignment_dict_from_peptides.py -SGD- )')
+    parser.add_argument('--allele_results', default='results/allele_results.tsv', help='input: file output by allele_qc.py')
+    parser.add_argument('--allele_errors', default='results/allele_cannot_fix_sequence_errors.tsv', help='input: file output by allele_auto_fix.py')
+    parser.add_argument('--modification_errors', default='results/protein_modification_cannot_fix_sequence_errors.tsv', help='input: file output by protein_modification_auto_fix.py')
+    parser.add_argument('--output_dir', default='results/', help='output directory, will create files allele_gene_reassignment.tsv and protein_modification_gene_reassignment.tsv')
+    parser.add_argument('--min_targets', type=int, default=4, help='minimum number of different positions mentioned in a gene / reference pair to search for other genes')
+    parser.add_argument('--max_mismatches', type=int, default=0, help='maximum number of targets that can be missing from a candidate gene')
+    parser.add_argument('--st_equivalent', action='store_true', help='consider S and T residues equivalent (e.g. for phosphorylation sites)')
+    parser.add_argument('--output_format', nargs='+', choices=output_formats, default=['tsv'], help='format(s) of the output files, the columnar formats (see results_io.py) are written next to them with a different extension')
+    args = parser.parse_args()
+    check_output_formats(args.output_format)
+
+    main(args.genome, args.coordinate_changes_dict, args.allele_results, args.allele_errors, args.modification_errors, args.output_dir, args.min_targets, args.max_mismatches, args.st_equivalent, args.output_format)
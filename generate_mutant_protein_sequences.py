@@ -1,10 +1,23 @@
-import pandas
+"""
+Generate the protein sequences of the alleles with protein coordinates in allele_results_transvar.tsv (the output of
+allele_transvar.py), and write them to a FASTA file sorted by `systematic_id|allele_name`, with `allele_type|allele_description`
+as description.
+
+The alleles are processed per gene in worker processes and streamed to the output (see write_variant_sequences).
+The FASTA file is indexed with a faidx index (.fai) and can be compressed with BGZF (--bgzip), so a single sequence can be
+retrieved with `samtools faidx results/all_protein_variant_sequences.fasta.gz 'SPAC1002.02|allele_name'`.
+"""
+import argparse
+import heapq
+import os
 import pickle
-from genome_functions import handle_systematic_id_for_allele_qc
 import re
-from Bio import SeqIO
-from Bio.Seq import Seq
-from Bio.SeqRecord import SeqRecord
+import struct
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import pandas
+from Bio import bgzf
+from genome_functions import handle_systematic_id_for_allele_qc
 
 
 def transvar_variant_to_substitution_dict(variant: str, seq_length: int) -> dict:
@@ -75,52 +88,69 @@ def transvar_variant_to_substitution_dict(variant: str, seq_length: int) -> dict
 
 
 def variant_sequence_from_subsitution_dicts(sequence: str, substitution_dicts: list[dict]) -> str:
+    """
+    Apply the substitution dicts (see transvar_variant_to_substitution_dict) to the sequence, all referring to the
+    coordinates of the original sequence. The sequence is assembled in a single pass, from the slices of the original
+    sequence between the sorted substitutions:
+
+    * Substitutions that do not change the length of the sequence can overlap with each other (the last one is applied
+      at each position), and are ignored at the positions removed or replaced by substitutions that change the length.
+    * Substitutions that change the length cannot overlap with each other (ValueError).
+    * Insertions (empty ranges) inside a range that is replaced are placed after the replacement, and several insertions
+      at the same position are applied in reverse order.
+    * A stop codon truncates the sequence, the substitutions after it are ignored.
+    """
 
     sequence = sequence.upper()
-    # First we apply the substitutions that do not change the length of the sequence
-    remainning_substitution_dicts = []
-
-    for substitution_dict in substitution_dicts:
-        if len(substitution_dict['replace_by']) == (substitution_dict['range'].stop - substitution_dict['range'].start):
-            sequence = sequence[:substitution_dict['range'].start] + substitution_dict['replace_by'] + sequence[substitution_dict['range'].stop:]
-        else:
-            remainning_substitution_dicts.append(substitution_dict)
-
-    # This is a bit of a hacky trick in which we first substitute the residues that are going to be replaced by a character (first numbers, then
-    # lowercase letters), for instance, if the substitution dict is {'range': slice(1, 3), 'replace_by': 'CCCCC'}, and we want to apply it on a sequence
-    # 'AAAAA', we first replace the residues that will be replaced by a character called replacement_key, in this case 1, `AAAAA` -> `A11AA`, then
-    # we substitute the subsequent occurrences of that replacement_key by CCCCC.
-    # The problem with this approach is handling cases where there are substitutions and insertions after a given position, that's why we handle it on two
-    # steps.
-
-    all_replacement_keys = [str(i) for i in range(10)] + [chr(i) for i in range(ord('a'), ord('z') + 1)]
-    all_replacement_keys.reverse()
-    sequence_replacement_dict = dict()
-    remainning_substitution_dicts2 = list()
-
-    for substitution_dict in remainning_substitution_dicts:
-        substitution_target_length = substitution_dict['range'].stop - substitution_dict['range'].start
-        if substitution_target_length == 0:
-            remainning_substitution_dicts2.append(substitution_dict)
+    # (start, stop, replace_by) without duplicates
+    all_edits = list(dict.fromkeys((s['range'].start, s['range'].stop, s['replace_by']) for s in substitution_dicts))
+
+    # Stop codons replace until the end of the sequence
+    end = min([start for start, stop, replace_by in all_edits if replace_by == '*' and stop == len(sequence)], default=len(sequence))
+    substitutions, replacements, insertions = list(), list(), list()
+    for start, stop, replace_by in all_edits:
+        if start > end or (start == end and stop > start):
+            continue
+        if stop == start:
+            insertions.append((start, replace_by))
+        elif stop - start == len(replace_by):
+            substitutions.append((start, min(stop, end), replace_by[:end - start]))
+        elif stop > end:
+            raise ValueError(f'Substitution overlaps with a stop codon: {start + 1}-{stop}')
         else:
-            try:
-                replacement_key = all_replacement_keys.pop()
-            except IndexError:
-                raise ValueError('More substitutions than replacement keys')
-            sequence = sequence[:substitution_dict['range'].start] + replacement_key * substitution_target_length + sequence[substitution_dict['range'].stop:]
-            sequence_replacement_dict[replacement_key] = substitution_dict['replace_by']
-
-    # We sort the insertions in reverse order of start, so that we can insert them in the sequence without having to worry about the shifting
-    # of the coordinates
-    remainning_substitution_dicts2.sort(key=lambda x: x['range'].start, reverse=True)
-
-    for substitution_dict in remainning_substitution_dicts2:
-        # We can insert directly here
-        sequence = sequence[:substitution_dict['range'].start] + substitution_dict['replace_by'] + sequence[substitution_dict['range'].stop:]
-
-    # Now we substitute the replacement keys by the actual residues
-    for replacement_key, replace_by in sequence_replacement_dict.items():
-        sequence = re.sub(replacement_key + '+', replace_by, sequence)
+            replacements.append((start, stop, replace_by))
+
+    replacements.sort()
+    for (start1, stop1, _), (start2, stop2, _) in zip(replacements, replacements[1:]):
+        if start2 < stop1:
+            raise ValueError(f'Overlapping substitutions: {start1 + 1}-{stop1} and {start2 + 1}-{stop2}')
+
+    # Residues changed by the substitutions outside of the replacements, the last substitution is kept at each position
+    replaced_positions = set(i for start, stop, _ in replacements for i in range(start, stop))
+    substituted_residues = dict()
+    for start, stop, replace_by in substitutions:
+        for i, residue in zip(range(start, stop), replace_by):
+            if i not in replaced_positions:
+                substituted_residues[i] = residue
+
+    # Sorted by position, with the insertions before the edits at the same position, and in reverse order among them
+    sorted_edits = [(start, 1, (0, 0), stop, replace_by) for start, stop, replace_by in replacements]
+    sorted_edits += [(i, 1, (0, 0), i + 1, residue) for i, residue in substituted_residues.items()]
+    # Insertions inside of a replacement are placed after it
+    replacement_stops = {i: stop for start, stop, _ in replacements for i in range(start + 1, stop)}
+    for i, (start, replace_by) in enumerate(insertions):
+        position = replacement_stops.get(start, start)
+        sorted_edits.append((position, 0, (start, -i), position, replace_by))
+    sorted_edits.sort()
+
+    pieces = list()
+    position = 0
+    for start, _, _, stop, replace_by in sorted_edits:
+        pieces.append(sequence[position:start])
+        pieces.append(replace_by)
+        position = stop
+    pieces.append(sequence[position:end])
+    sequence = ''.join(pieces)
 
     if not sequence.endswith('*'):
         sequence = sequence + '*'  # Add stop codon if it's not there
@@ -128,41 +158,160 @@ def variant_sequence_from_subsitution_dicts(sequence: str, substitution_dicts: l
     return sequence
 
 
-def process_row(row, genome):
+def transvar_coordinates_to_variant_sequence(peptide: str, transvar_coordinates: str) -> str:
+    """Variant sequence of peptide from the `|`-separated transvar_coordinates of an allele (only the protein part is used)."""
+    substitution_dicts = [transvar_variant_to_substitution_dict(v.split('/')[2], len(peptide)) for v in transvar_coordinates.split('|')]
+    # Remove the None values
+    substitution_dicts = [s for s in substitution_dicts if s is not None]
+    return variant_sequence_from_subsitution_dicts(peptide, substitution_dicts)
 
-    allele_qc_id = handle_systematic_id_for_allele_qc(row['systematic_id'], row['allele_name'], genome)
 
-    gene = genome[allele_qc_id]
-    if 'CDS' not in gene:
+def get_allele_qc_id_with_cds(row, genome) -> str:
+    """The transcript used for the allele (see handle_systematic_id_for_allele_qc), which must have a CDS."""
+    allele_qc_id = handle_systematic_id_for_allele_qc(row['systematic_id'], row['allele_name'], genome)
+    if 'CDS' not in genome[allele_qc_id]:
         raise ValueError(f'gene {row["systematic_id"]} does not have a CDS, but has transvar protein coordinates {row["transvar_coordinates"]}')
+    return allele_qc_id
 
-    peptide_length = len(gene['peptide'])
-    substitution_dicts = [transvar_variant_to_substitution_dict(v.split('/')[2], peptide_length) for v in row['transvar_coordinates'].split('|')]
-    # Remove the None values
-    substitution_dicts = [s for s in substitution_dicts if s is not None]
-    return variant_sequence_from_subsitution_dicts(str(gene['peptide']), substitution_dicts)
+
+def process_row(row, genome):
+    gene = genome[get_allele_qc_id_with_cds(row, genome)]
+    return transvar_coordinates_to_variant_sequence(str(gene['peptide']), row['transvar_coordinates'])
+
+
+def gene_variant_records(peptide: str, alleles: list[tuple[str, str, str]]) -> list[tuple[str, str, str]]:
+    """
+    Records (sequence_id, description, variant_sequence) for the alleles (sequence_id, description, transvar_coordinates)
+    of the gene with this peptide. Runs in the worker processes, see write_variant_sequences.
+    """
+    return [(sequence_id, description, transvar_coordinates_to_variant_sequence(peptide, transvar_coordinates)) for sequence_id, description, transvar_coordinates in alleles]
 
 
-def main():
+def fasta_record(sequence_id: str, description: str, sequence: str, line_width: int = 60) -> tuple[str, int]:
+    """FASTA text of a record (same format as SeqIO.write), and the length of its header line."""
+    header = f'>{sequence_id} {description}\n'
+    lines = [sequence[i:i + line_width] + '\n' for i in range(0, len(sequence), line_width)]
+    return header + ''.join(lines), len(header)
 
-    with open('data/genome.pickle', 'rb') as ins:
+
+class IndexedFastaWriter:
+    """
+    Writes a FASTA file with uniform line width and its faidx index (.fai), optionally compressed with BGZF (bgzip)
+    in which case the block index (.gzi) is also written, so that records can be fetched with `samtools faidx` or
+    Bio.SeqIO.index.
+    """
+
+    def __init__(self, output_file: str, bgzip: bool = False, line_width: int = 60):
+        self.output_file = output_file
+        self.line_width = line_width
+        self.handle = bgzf.BgzfWriter(output_file, 'wb') if bgzip else open(output_file, 'wb')
+        self.fai = open(output_file + '.fai', 'w')
+        # (compressed, uncompressed) offsets of the start of each BGZF block after the first one
+        self.block_offsets = list() if bgzip else None
+        self.offset = 0
+
+    def write(self, sequence_id: str, description: str, sequence: str):
+        text, header_length = fasta_record(sequence_id, description, sequence, self.line_width)
+        self.fai.write(f'{sequence_id}\t{len(sequence)}\t{self.offset + header_length}\t{self.line_width}\t{self.line_width + 1}\n')
+        data = text.encode()
+        # BgzfWriter writes blocks of 65536 bytes, at most one block is written per call with this slicing
+        for i in range(0, len(data), 65536):
+            self.handle.write(data[i:i + 65536])
+            self.offset += len(data[i:i + 65536])
+            if self.block_offsets is not None:
+                block_start, within_block = bgzf.split_virtual_offset(self.handle.tell())
+                if block_start != (self.block_offsets[-1][0] if self.block_offsets else 0):
+                    self.block_offsets.append((block_start, self.offset - within_block))
+
+    def close(self):
+        self.handle.close()
+        self.fai.close()
+        if self.block_offsets is not None:
+            with open(self.output_file + '.gzi', 'wb') as out:
+                out.write(struct.pack(f'<{1 + 2 * len(self.block_offsets)}Q', len(self.block_offsets), *(o for offsets in self.block_offsets for o in offsets)))
+
+
+def write_sorted_run(records: list[tuple[str, str, str]], run_file: str):
+    """Write the records sorted by sequence_id, one per line, for merge_sorted_runs."""
+    with open(run_file, 'w') as out:
+        for record in sorted(records, key=lambda x: x[0]):
+            out.write('\t'.join(record) + '\n')
+
+
+def merge_sorted_runs(run_files: list[str]):
+    """Iterate over the records of all the run files sorted by sequence_id, keeping the order of the runs for equal ids."""
+    handles = [open(f) for f in run_files]
+    try:
+        for line in heapq.merge(*handles, key=lambda x: x.split('\t', 1)[0]):
+            yield tuple(line.rstrip('\n').split('\t'))
+    finally:
+        for handle in handles:
+            handle.close()
+
+
+def write_variant_sequences(genome: dict, allele_results_file: str, output_file: str, bgzip: bool = False, processes: int = None, chunk_size: int = 50000):
+    """
+    Write the variant sequences of the alleles with protein coordinates in allele_results_file to an indexed FASTA file
+    (see IndexedFastaWriter) sorted by sequence id (`systematic_id|allele_name`).
+
+    The file is read in chunks of chunk_size rows. The alleles of each chunk are grouped by gene, and each gene is
+    processed in a worker process (by default as many as CPUs, if processes is 1 everything runs in this process),
+    to which only the peptide is sent. Each chunk is written as a sorted run to a temporary directory, and the runs are
+    merged at the end, so memory use does not depend on the number of alleles.
+    """
+    if processes is None:
+        processes = os.cpu_count()
+    executor = ProcessPoolExecutor(max_workers=processes) if processes > 1 else None
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        run_files = list()
+        columns = ['systematic_id', 'allele_name', 'allele_description', 'allele_type', 'transvar_coordinates']
+        try:
+            for allele_data in pandas.read_csv(allele_results_file, sep='\t', na_filter=False, dtype=str, usecols=columns, chunksize=chunk_size):
+                # We keep all protein variants (even if they were not described at the protein level)
+                allele_data = allele_data[allele_data['transvar_coordinates'].str.contains('/p.')]
+                alleles_by_gene = dict()
+                for i, row in allele_data.iterrows():
+                    allele = (f'{row["systematic_id"]}|{row["allele_name"]}', f'{row["allele_type"]}|{row["allele_description"]}', row['transvar_coordinates'])
+                    alleles_by_gene.setdefault(get_allele_qc_id_with_cds(row, genome), list()).append(allele)
+
+                peptides = [str(genome[allele_qc_id]['peptide']) for allele_qc_id in alleles_by_gene]
+                if executor is None:
+                    gene_records = map(gene_variant_records, peptides, alleles_by_gene.values())
+                else:
+                    gene_records = executor.map(gene_variant_records, peptides, alleles_by_gene.values(), chunksize=8)
+
+                run_files.append(os.path.join(tmp_dir, f'run_{len(run_files)}.tsv'))
+                write_sorted_run([record for records in gene_records for record in records], run_files[-1])
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        writer = IndexedFastaWriter(output_file, bgzip)
+        for sequence_id, description, sequence in merge_sorted_runs(run_files):
+            writer.write(sequence_id, description, sequence)
+        writer.close()
+
+
+def main(genome_file, allele_results_file, output_file, bgzip=False, processes=None, chunk_size=50000):
+
+    with open(genome_file, 'rb') as ins:
         genome = pickle.load(ins)
-    allele_data = pandas.read_csv('results/allele_results_transvar.tsv', delimiter='\t', na_filter=False)
-
-    # We keep all protein variants (even if they were not described at the protein level)
-    allele_data = allele_data[allele_data['transvar_coordinates'].str.contains('/p.')].copy()
-    allele_data['variant_sequence'] = allele_data.apply(lambda row: process_row(row, genome), axis=1)
-    seq_records = list()
-    for i, row in allele_data.iterrows():
-        sequence_name = f'{row["systematic_id"]}|{row["allele_name"]}'
-        sequence_description = f'{row["allele_type"]}|{row["allele_description"]}'
-        # We trim the stop codon
-        seq_records.append(SeqRecord(Seq(row['variant_sequence']), id=sequence_name, description=sequence_description))
-    # Sort by id
-    seq_records = sorted(seq_records, key=lambda x: x.id)
-    with open('results/all_protein_variant_sequences.fasta', 'w') as out_file:
-        SeqIO.write(seq_records, out_file, 'fasta')
+
+    write_variant_sequences(genome, allele_results_file, output_file, bgzip, processes, chunk_size)
 
 
 if __name__ == '__main__':
-    main()
+    class Formatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter):
+        pass
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=Formatter)
+    parser.add_argument('--genome', default='data/genome.pickle', help='input: genome dictionary built from contig files (see load_genome.py).')
+    parser.add_argument('--allele_results', default='results/allele_results_transvar.tsv', help='input: file output by allele_transvar.py')
+    parser.add_argument('--output', default='results/all_protein_variant_sequences.fasta', help='output FASTA file, the faidx index is written next to it (.fai)')
+    parser.add_argument('--bgzip', action='store_true', help='compress the output with BGZF, the .gz extension is added to --output, and the .gzi index is also written')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes (by default, the number of CPUs)')
+    parser.add_argument('--chunk_size', type=int, default=50000, help='number of rows of --allele_results processed at a time')
+    args = parser.parse_args()
+
+    main(args.genome, args.allele_results, args.output + '.gz' if args.bgzip else args.output, args.bgzip, args.processes, args.chunk_size)
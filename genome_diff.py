@@ -0,0 +1,134 @@
+"""
+Compare two genome builds (see load_genome.py) and output the changes as json, so that the QC and transvar stages
+can re-process only the affected genes (see the --genome_diff argument of allele_qc.py, protein_modification_qc.py,
+allele_transvar.py and protein_modification_transvar.py).
+
+The output has the structure:
+
+{
+    "added": ["SPAC1234.01", ...],                  # systematic ids (genes or transcripts) only in the new genome
+    "removed": ["SPAC1234.02.2", ...],              # systematic ids only in the old genome
+    "location_changed": {                           # features whose location changed, or that were added / removed
+        "SPAC23E2.02": {"CDS": {"old": "join{[...]}", "new": "join{[...]}"}, ...}
+    },
+    "peptide_changed": ["SPAC23E2.02", ...],        # genes whose peptide sequence changed
+    "dna_changed": ["SPAC4F8.01", ...],             # genes with the same locations, but a different sequence (UTRs included)
+    "affected_systematic_ids": [...]                # all of the above, including the gene ids of affected transcripts
+}
+"""
+import argparse
+import json
+import pickle
+import pandas
+from genome_functions import Genome, build_transcript_index, get_main_feature_start_end_strand
+
+
+def get_feature_locations(gene: dict) -> dict[str, str]:
+    """The location of each feature of the gene as a string, and the id of the contig."""
+    locations = {feature_type: str(feature.location) for feature_type, feature in gene.items() if feature_type not in ('contig', 'peptide')}
+    locations['contig'] = gene['contig'].id
+    return locations
+
+
+def get_main_feature_sequence(gene: dict) -> str:
+    """Sequence of the main feature of the gene, including UTRs (None for genes that are not supported)."""
+    try:
+        start, end, _ = get_main_feature_start_end_strand(gene, 0, 0)
+    except ValueError:
+        return None
+    return str(gene['contig'].seq[start:end])
+
+
+def get_transcript_to_gene_dict(genome: dict) -> dict[str, str]:
+    """Map the transcript ids of multi-transcript genes to the gene id (e.g. SPBC1198.04c.2 -> SPBC1198.04c)."""
+    transcript_index = genome.transcript_index if isinstance(genome, Genome) else build_transcript_index(genome)
+    return {transcript: systematic_id for systematic_id, entry in transcript_index.items() for transcript in entry.transcripts}
+
+
+def compare_genomes(old_genome: dict, new_genome: dict) -> dict:
+    """
+    Return the changes between the two genomes, see the docstring of this module.
+    """
+    added = [systematic_id for systematic_id in new_genome if systematic_id not in old_genome]
+    removed = [systematic_id for systematic_id in old_genome if systematic_id not in new_genome]
+
+    location_changed = dict()
+    peptide_changed = list()
+    dna_changed = list()
+    for systematic_id in new_genome:
+        if systematic_id not in old_genome:
+            continue
+        old_gene = old_genome[systematic_id]
+        new_gene = new_genome[systematic_id]
+
+        old_locations = get_feature_locations(old_gene)
+        new_locations = get_feature_locations(new_gene)
+        changed_features = dict()
+        for feature_type in sorted(set(old_locations) | set(new_locations)):
+            if old_locations.get(feature_type) != new_locations.get(feature_type):
+                changed_features[feature_type] = {'old': old_locations.get(feature_type), 'new': new_locations.get(feature_type)}
+        if changed_features:
+            location_changed[systematic_id] = changed_features
+
+        if ('peptide' in old_gene or 'peptide' in new_gene) and str(old_gene.get('peptide')) != str(new_gene.get('peptide')):
+            peptide_changed.append(systematic_id)
+
+        # If the locations are the same, the contig sequence may have changed
+        if not changed_features and get_main_feature_sequence(old_gene) != get_main_feature_sequence(new_gene):
+            dna_changed.append(systematic_id)
+
+    affected_systematic_ids = set(added) | set(removed) | set(location_changed) | set(peptide_changed) | set(dna_changed)
+    # Alleles and modifications use the gene id of multi-transcript genes
+    transcript_to_gene = get_transcript_to_gene_dict(old_genome) | get_transcript_to_gene_dict(new_genome)
+    affected_systematic_ids |= {transcript_to_gene[i] for i in affected_systematic_ids if i in transcript_to_gene}
+
+    return {
+        'added': added,
+        'removed': removed,
+        'location_changed': location_changed,
+        'peptide_changed': peptide_changed,
+        'dna_changed': dna_changed,
+        'affected_systematic_ids': sorted(affected_systematic_ids),
+    }
+
+
+def read_affected_systematic_ids(genome_diff_file: str) -> set[str]:
+    with open(genome_diff_file) as ins:
+        return set(json.load(ins)['affected_systematic_ids'])
+
+
+def split_by_previous_results(data: pandas.DataFrame, previous_results: pandas.DataFrame, key_columns: list[str], result_columns: list[str], affected_systematic_ids: set[str]) -> tuple[pandas.DataFrame, pandas.DataFrame]:
+    """
+    Split `data` into the rows that must be processed again, and the rows for which the `result_columns` can be
+    copied from `previous_results`: those that have the same values in `key_columns` in the previous results, and
+    whose systematic_id is not affected by the genome changes. The second dataframe contains the `result_columns`
+    and keeps the index of `data`.
+    """
+    previous_results = previous_results[key_columns + result_columns].drop_duplicates(subset=key_columns)
+    merged = data[key_columns].merge(previous_results, on=key_columns, how='left', indicator=True)
+    merged.index = data.index
+    can_reuse = (merged['_merge'] == 'both') & ~data['systematic_id'].isin(affected_systematic_ids)
+
+    return data[~can_reuse].copy(), merged.loc[can_reuse, result_columns].copy()
+
+
+if __name__ == '__main__':
+    class Formatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter):
+        pass
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=Formatter)
+    parser.add_argument('--old_genome', required=True, help='input: genome dictionary of the previous build (see load_genome.py)')
+    parser.add_argument('--new_genome', default='data/genome.pickle', help='input: genome dictionary of the new build (see load_genome.py)')
+    parser.add_argument('--output', default='data/genome_diff.json', help='output: json file with the changes')
+    args = parser.parse_args()
+
+    with open(args.old_genome, 'rb') as ins:
+        old_genome = pickle.load(ins)
+    with open(args.new_genome, 'rb') as ins:
+        new_genome = pickle.load(ins)
+
+    genome_diff = compare_genomes(old_genome, new_genome)
+    print(f'{len(genome_diff["affected_systematic_ids"])} systematic ids affected by the changes')
+
+    with open(args.output, 'w') as out:
+        json.dump(genome_diff, out, indent=4)
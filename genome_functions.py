@@ -2,9 +2,33 @@ from Bio.SeqFeature import FeatureLocation, SeqFeature
 from Bio.Seq import reverse_complement
 from Bio.GenBank import _FeatureConsumer
 from Bio.SeqRecord import SeqRecord
+from typing import NamedTuple, Optional
 import re
 
 
+class TranscriptIndexEntry(NamedTuple):
+    """
+    Transcripts of a gene with multiple transcripts, see build_transcript_index.
+    """
+    transcripts: tuple[str, ...]
+    first: str
+    longest: str
+    primary_name: Optional[str]
+    # Matches allele names starting with the primary name + .1, .2, etc. (e.g. zas1.2-V123A)
+    transcript_pattern: Optional[re.Pattern]
+
+
+class Genome(dict):
+    """
+    Genome dictionary (see load_genome.py) that also stores the transcript index of the genome (see build_transcript_index)
+    in the attribute `transcript_index`, so that it is pickled with it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.transcript_index: dict[str, TranscriptIndexEntry] = dict()
+
+
 def get_nt_at_gene_coord(pos: int, gene: dict, contig):
     # genome_coord is one-based
     genome_coord, strand = gene_coords2genome_coords(pos, gene)
@@ -46,6 +70,19 @@ def gene_coords2genome_coords(pos: int, gene: dict) -> tuple[int, int]:
     return pos + 1, loc.strand
 
 
+def genome_coords2gene_coords(genome_pos: int, gene: dict) -> int:
+    """
+    Opposite of gene_coords2genome_coords, genome_pos is one-based, and the returned gene coordinate is negative
+    for positions upstream of the main feature.
+    """
+    loc = get_CDS_or_RNA_feature(gene).location
+    if loc.strand == 1:
+        pos = genome_pos - 1 - loc.start
+    else:
+        pos = loc.end - genome_pos
+    return pos + 1 if pos >= 0 else pos
+
+
 def get_feature_location_from_string(location_str: str) -> FeatureLocation:
     fc = _FeatureConsumer(use_fuzziness=False)
     # We need to initialize a dummy feature
@@ -94,7 +131,11 @@ def get_other_index_from_alignment(this_alignment, other_alignment, this_index):
     return None
 
 
-def extract_main_feature_and_strand(gene: dict, downstream: int, upstream: int, get_utrs: bool = True) -> tuple[SeqRecord, int]:
+def get_main_feature_start_end_strand(gene: dict, downstream: int, upstream: int, get_utrs: bool = True) -> tuple[int, int, int]:
+    """
+    Zero-based start and end coordinates in the contig of the main feature of the gene (see get_CDS_or_RNA_feature), including
+    the UTRs if get_utrs is True and the upstream and downstream extensions, and the strand of the feature.
+    """
     if 'CDS' not in gene:
 
         if len(gene) == 2:
@@ -117,6 +158,12 @@ def extract_main_feature_and_strand(gene: dict, downstream: int, upstream: int,
         end = gene[start_feature].location.end + upstream
         start = gene[end_feature].location.start - downstream
 
+    return start, end, strand
+
+
+def extract_main_feature_and_strand(gene: dict, downstream: int, upstream: int, get_utrs: bool = True) -> tuple[SeqRecord, int]:
+    start, end, strand = get_main_feature_start_end_strand(gene, downstream, upstream, get_utrs)
+
     # Add translation if it exists
     if 'CDS' in gene:
         feat: SeqFeature = gene['CDS']
@@ -125,6 +172,65 @@ def extract_main_feature_and_strand(gene: dict, downstream: int, upstream: int,
     return gene['contig'][start:end], strand
 
 
+def build_transcript_index_entry(systematic_id: str, genome: dict) -> Optional[TranscriptIndexEntry]:
+    """
+    Return the TranscriptIndexEntry of a gene with multiple transcripts (systematic_id.1, systematic_id.2, etc. in genome),
+    or None if the gene does not have them. The longest transcript is the one for which the main feature, including
+    the UTRs, is the longest (if several have the same length, the first one).
+    """
+    transcripts = list()
+    while f'{systematic_id}.{len(transcripts) + 1}' in genome:
+        transcripts.append(f'{systematic_id}.{len(transcripts) + 1}')
+    if len(transcripts) == 0:
+        return None
+
+    longest_transcript_systematic_id = None
+    longest_transcript_length = 0
+    for transcript in transcripts:
+        start, end, _ = get_main_feature_start_end_strand(genome[transcript], 0, 0)
+        transcript_length = end - start
+        if transcript_length > longest_transcript_length:
+            longest_transcript_length = transcript_length
+            longest_transcript_systematic_id = transcript
+
+    try:
+        primary_name = get_CDS_or_RNA_feature(genome[transcripts[0]]).qualifiers['primary_name'][0]
+        transcript_pattern = re.compile('^' + re.escape(primary_name) + r'\.(\d+)')
+    except (KeyError, ValueError):
+        primary_name = None
+        transcript_pattern = None
+
+    return TranscriptIndexEntry(tuple(transcripts), transcripts[0], longest_transcript_systematic_id, primary_name, transcript_pattern)
+
+
+def build_transcript_index(genome: dict) -> dict[str, TranscriptIndexEntry]:
+    """
+    Map the systematic_id of every gene with multiple transcripts in genome (e.g. SPBC1198.04c, for which the genome contains
+    SPBC1198.04c.1 and SPBC1198.04c.2) to its TranscriptIndexEntry.
+    """
+    transcript_index = dict()
+    for transcript_id in genome:
+        systematic_id, _, transcript_number = transcript_id.rpartition('.')
+        if transcript_number != '1' or systematic_id in genome:
+            continue
+        transcript_index[systematic_id] = build_transcript_index_entry(systematic_id, genome)
+    return transcript_index
+
+
+def get_transcript_index_entry(systematic_id: str, genome: dict) -> TranscriptIndexEntry:
+    """
+    Get the TranscriptIndexEntry of a gene with multiple transcripts from the transcript index of the genome if it
+    has one (see Genome), otherwise build it. Raises ValueError if the systematic_id is not a gene with multiple transcripts.
+    """
+    if isinstance(genome, Genome):
+        entry = genome.transcript_index.get(systematic_id)
+    else:
+        entry = build_transcript_index_entry(systematic_id, genome)
+    if entry is None:
+        raise ValueError('Systematic id does not exist:', systematic_id)
+    return entry
+
+
 def process_systematic_id(systematic_id: str, genome: dict, when_several_transcripts: str) -> str:
     """
     If no multiple transcripts exist, return the systematic id, else
@@ -136,25 +242,12 @@ def process_systematic_id(systematic_id: str, genome: dict, when_several_transcr
         return systematic_id
 
     if when_several_transcripts not in ('longest', 'first'):
-        return ValueError('when_several_transcripts must be either "longest" or "first"')
-
-    if when_several_transcripts == 'first' and systematic_id + '.1' in genome:
-        return systematic_id + '.1'
+        raise ValueError('when_several_transcripts must be either "longest" or "first"')
 
-    # For loci with multiple transcripts, we need to find the one that is the longest
-    i = 1
-    longest_transcript_systematic_id = None
-    longest_transcript_length = 0
-    while systematic_id + '.' + str(i) in genome:
-        transcript_seq_record, _ = extract_main_feature_and_strand(genome[systematic_id + '.' + str(i)], 0, 0)
-        if len(transcript_seq_record) > longest_transcript_length:
-            longest_transcript_length = len(transcript_seq_record)
-            longest_transcript_systematic_id = systematic_id + '.' + str(i)
-        i += 1
-    if longest_transcript_systematic_id is None:
-        raise ValueError('Systematic id does not exist:', systematic_id)
-    else:
-        return longest_transcript_systematic_id
+    entry = get_transcript_index_entry(systematic_id, genome)
+    if when_several_transcripts == 'first':
+        return entry.first
+    return entry.longest
 
 
 def handle_systematic_id_for_allele_qc(systematic_id, allele_name, genome: dict) -> str:
@@ -169,17 +262,12 @@ def handle_systematic_id_for_allele_qc(systematic_id, allele_name, genome: dict)
     if systematic_id in genome:
         return systematic_id
 
-    # Get the first multiple transcript id, if it is a multi-transcript gene
-    first_multi_transcript = process_systematic_id(systematic_id, genome, 'first')
-
-    gene_name = get_CDS_or_RNA_feature(genome[first_multi_transcript]).qualifiers['primary_name'][0]
-
     # If we have reached here, it means that the systematic_id is from a multi-transcript gene
     # If the allele name contains the primary name .1, .2, etc, (e.g. zas1.2) then we pick that transcript (SPBC1198.04c.2).
     # Otherwise, we pick the first transcript
-
-    transcript_id_regex = '^' + gene_name + '\.(\d+)'
-    match = re.search(transcript_id_regex, allele_name)
-    if match:
-        return systematic_id + '.' + match.groups()[0]
-    return first_multi_transcript
+    entry = get_transcript_index_entry(systematic_id, genome)
+    if entry.transcript_pattern is not None:
+        match = entry.transcript_pattern.search(allele_name)
+        if match:
+            return systematic_id + '.' + match.groups()[0]
+    return entry.first
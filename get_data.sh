@@ -35,6 +35,9 @@ curl -k https://curation.pombase.org/dumps/latest_build/pombe-embl/telomeric.con
 echo -e "${GREEN}Loading the genome${NC}"
 python load_genome.py data/*.contig
 
+# k-mer index of the genome, for the genome-wide primer search
+python primer_search.py
+
 # Get updates to genome coordinates from PomBase, these can be used to update alleles that used
 # previous gene feature coordinates.
 echo -e "${GREEN}Getting coordinate changes${NC}"
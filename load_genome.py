@@ -12,48 +12,68 @@ and the value is a dictionary of features with the feature_type as key.
     "contig": SeqRecord of the sequence where this gene is found (generated from one of the files passed as arguments)
 }
 
-The dictionary is stored in a pickle file, specified by the argument --output.
+The genome also contains a transcript index for genes with multiple transcripts (see Genome and build_transcript_index
+in genome_functions.py), in the attribute `transcript_index`.
+
+The files are read in parallel (one process per file, see --processes), and the genes found in each of them are
+merged in the order in which the files are passed.
+
+The dictionary is stored in a pickle file, specified by the argument --output. Since it is a Genome, the scripts that
+unpickle it must be able to import genome_functions (e.g. run them from this directory, or add it to sys.path).
 """
 import pickle
 from Bio import SeqIO
 from Bio.SeqFeature import SeqFeature
+from Bio.SeqRecord import SeqRecord
 import argparse
 import json
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
+from genome_functions import Genome, build_transcript_index
 
-genome: dict[str, dict[str, SeqFeature]] = dict()
-
-
-class Formatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter):
-    pass
-
-
-parser = argparse.ArgumentParser(description=__doc__, formatter_class=Formatter)
-parser.add_argument('files', metavar='N', type=str, nargs='+',
-                    help='files to be read')
-parser.add_argument('--format', default='embl', help='format of the files to be read (for Biopython)')
-parser.add_argument('--output', default='data/genome.pickle', help='output file (using pickle)')
-parser.add_argument('--config', default='config.json', help='configuration file')
-
-args = parser.parse_args()
-
-with open(args.config) as ins:
-    config = json.load(ins)
 
-locus_tag_equivalent = 'locus_tag'
-if 'locus_tag_equivalent' in config:
-    locus_tag_equivalent = config['locus_tag_equivalent']
-
-filename2chromosome_dict = {v: k for k, v in config['chromosome2file'].items()}
-
-
-for f in args.files:
-    print('\033[0;32m reading: ' + f + '\033[0m')
-    iterator = SeqIO.parse(f, args.format)
+def translate_cds_features(genes: dict[str, dict[str, SeqFeature]], contig: SeqRecord, config: dict) -> list[str]:
+    """
+    Add the 'peptide' to all genes with a CDS in `genes`, all found in `contig`. Returns a list of error messages
+    for the CDSs that don't look right.
+    """
+    errors = list()
+    for gene_id, gene in genes.items():
+        if 'CDS' not in gene:
+            continue
+        # if not any([('pseudogene' in prod or 'dubious' in prod) for prod in feature.qualifiers['product']]):
+        cds_seq = gene['CDS'].extract(contig).seq
+        if gene_id.startswith(config['mitochondrial_prefix']):
+            gene['peptide'] = cds_seq.translate(table=config['mitochondrial_table'])
+        else:
+            gene['peptide'] = cds_seq.translate()
+        cds_errors = list()
+        if len(cds_seq) % 3 != 0:
+            cds_errors.append('CDS length not multiple of 3')
+        if gene['peptide'][-1] != '*':
+            cds_errors.append('does not end with STOP codon')
+        if gene['peptide'].count('*') > 1:
+            cds_errors.append('multiple stop codons')
+        if len(cds_errors):
+            errors.append('\t'.join([gene_id, 'CDS errors:', ','.join(cds_errors)]))
+    return errors
+
+
+def read_contig_file(f: str, file_format: str, config: dict) -> tuple[SeqRecord, dict[str, dict[str, SeqFeature]], list[str]]:
+    """
+    Read a single-sequence file, and return the contig, a dictionary with the features of each gene in it (without
+    the 'contig' key), and the errors found in the CDSs (see translate_cds_features).
+    """
+    locus_tag_equivalent = config.get('locus_tag_equivalent', 'locus_tag')
+    filename2chromosome_dict = {v: k for k, v in config['chromosome2file'].items()}
+
+    iterator = SeqIO.parse(f, file_format)
     contig = next(iterator)
     if next(iterator, None) is not None:
         raise ValueError(f'multiple sequences in file {f}')
-    for feature in tqdm(contig.features, desc="Reading sequence features", unit="feature"):
+
+    genes: dict[str, dict[str, SeqFeature]] = dict()
+    for feature in contig.features:
         feature: SeqFeature
         if locus_tag_equivalent not in feature.qualifiers:
             continue
@@ -62,36 +82,67 @@ for f in args.files:
         if feature_type in ['intron', 'misc_feature', 'exon']:
             continue
 
-        if gene_id not in genome:
-            genome[gene_id] = dict()
-            # assigned only once
-            file_name = f.split('/')[-1].split('.')[0]
-            # We set the id to the value in the filename2chromosome_dict
-            contig.id = filename2chromosome_dict[file_name]
-            genome[gene_id]['contig'] = contig
-
-        if (feature_type in genome[gene_id]) and feature_type != 'mRNA':
+        if gene_id not in genes:
+            genes[gene_id] = dict()
+
+        if (feature_type in genes[gene_id]) and feature_type != 'mRNA':
             raise ValueError(f'several features of {feature_type} for {gene_id}')
 
-        genome[gene_id][feature_type] = feature
-
-        # if feature_type == 'CDS' and not any([('pseudogene' in prod or 'dubious' in prod) for prod in feature.qualifiers['product']]):
-        if feature_type == 'CDS':
-            cds_seq = feature.extract(contig).seq
-            if gene_id.startswith(config['mitochondrial_prefix']):
-                genome[gene_id]['peptide'] = cds_seq.translate(table=config['mitochondrial_table'])
-            else:
-                genome[gene_id]['peptide'] = cds_seq.translate()
-            errors = list()
-            if len(cds_seq) % 3 != 0:
-                errors.append('CDS length not multiple of 3')
-            if genome[gene_id]['peptide'][-1] != '*':
-                errors.append('does not end with STOP codon')
-            if genome[gene_id]['peptide'].count('*') > 1:
-                errors.append('multiple stop codons')
-            if len(errors):
-                print(gene_id, 'CDS errors:', ','.join(errors), sep='\t')
-
-
-with open(args.output, 'wb') as out:
-    pickle.dump(genome, out, pickle.HIGHEST_PROTOCOL)
+        genes[gene_id][feature_type] = feature
+
+    if len(genes):
+        # We set the id to the value in the filename2chromosome_dict
+        file_name = f.split('/')[-1].split('.')[0]
+        contig.id = filename2chromosome_dict[file_name]
+
+    return contig, genes, translate_cds_features(genes, contig, config)
+
+
+def merge_contig_genes(genome: Genome, contig: SeqRecord, genes: dict[str, dict[str, SeqFeature]]):
+    """
+    Add the genes read from a contig to the genome. A gene found in several contigs keeps the first contig.
+    """
+    for gene_id, gene in genes.items():
+        if gene_id not in genome:
+            genome[gene_id] = {'contig': contig}
+        for feature_type, feature in gene.items():
+            if (feature_type in genome[gene_id]) and feature_type != 'mRNA':
+                raise ValueError(f'several features of {feature_type} for {gene_id}')
+            genome[gene_id][feature_type] = feature
+
+
+def load_genome(files: list[str], file_format: str, config: dict, processes: int = None) -> Genome:
+
+    genome = Genome()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        contig_results = executor.map(read_contig_file, files, [file_format] * len(files), [config] * len(files))
+        for contig, genes, errors in tqdm(contig_results, total=len(files), desc='Reading contig files', unit='file'):
+            merge_contig_genes(genome, contig, genes)
+            for error in errors:
+                print(error)
+
+    genome.transcript_index = build_transcript_index(genome)
+    return genome
+
+
+if __name__ == '__main__':
+    class Formatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter):
+        pass
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=Formatter)
+    parser.add_argument('files', metavar='N', type=str, nargs='+',
+                        help='files to be read')
+    parser.add_argument('--format', default='embl', help='format of the files to be read (for Biopython)')
+    parser.add_argument('--output', default='data/genome.pickle', help='output file (using pickle)')
+    parser.add_argument('--config', default='config.json', help='configuration file')
+    parser.add_argument('--processes', type=int, default=None, help='number of files read in parallel (by default, the number of CPUs)')
+
+    args = parser.parse_args()
+
+    with open(args.config) as ins:
+        config = json.load(ins)
+
+    genome = load_genome(args.files, args.format, config, args.processes)
+
+    with open(args.output, 'wb') as out:
+        pickle.dump(genome, out, pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,278 @@
+"""
+Minimal metrics in the Prometheus text format (see https://prometheus.io/docs/instrumenting/exposition_formats/), used by
+the /metrics endpoint of api.py, so that no client library or external service is needed.
+
+The metrics are registered in `registry` when they are created, and registry.render() returns the text of all of them.
+
+When the requests are served by several processes (see api_server.py), registry.multiprocess_dir is set to a directory
+shared by them, in which each process writes its metrics (see Registry.write_process_metrics), and registry.render()
+returns the metrics of all of them: the counters and histograms are added up, and the gauges (e.g. memory, cache sizes)
+get a `pid` label.
+"""
+import os
+import pickle
+import resource
+import sys
+import threading
+import time
+from typing import NamedTuple
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_labels(label_names: tuple[str, ...], label_values: tuple[str, ...]) -> str:
+    """Labels in the Prometheus format, e.g. `{route="/ganno",status="200"}`."""
+    labels = list()
+    for name, value in zip(label_names, label_values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        labels.append(f'{name}="{value}"')
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class MetricFamily(NamedTuple):
+    name: str
+    # counter, gauge or histogram
+    type: str
+    documentation: str
+    # (sample name, label names, label values, value), e.g. ('duration_seconds_count', ('route',), ('/ganno',), 4)
+    samples: list[tuple[str, tuple[str, ...], tuple[str, ...], float]]
+
+
+def format_family(family: MetricFamily) -> list[str]:
+    lines = [f'# HELP {family.name} {family.documentation}', f'# TYPE {family.name} {family.type}']
+    for sample_name, label_names, label_values, value in family.samples:
+        lines.append(f'{sample_name}{format_labels(label_names, label_values)} {value}')
+    return lines
+
+
+def process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def merge_process_families(process_families: dict[int, list[MetricFamily]]) -> list[MetricFamily]:
+    """
+    Merge the metric families of several processes (pid -> families): the values of counters and histograms are added
+    up, and the samples of gauges get a `pid` label, only for the processes that still exist.
+    """
+    merged: dict[str, tuple[MetricFamily, dict]] = dict()
+    for pid, families in sorted(process_families.items()):
+        for family in families:
+            if family.name not in merged:
+                merged[family.name] = (family, dict())
+            samples = merged[family.name][1]
+            if family.type == 'gauge':
+                if not process_exists(pid):
+                    continue
+                for sample_name, label_names, label_values, value in family.samples:
+                    samples[(sample_name, label_names + ('pid',), label_values + (str(pid),))] = value
+            else:
+                for sample_name, label_names, label_values, value in family.samples:
+                    key = (sample_name, label_names, label_values)
+                    samples[key] = samples.get(key, 0) + value
+    return [family._replace(samples=[key + (value,) for key, value in samples.items()]) for family, samples in merged.values()]
+
+
+class Registry:
+
+    def __init__(self):
+        self.collectors = list()
+        # Directory shared by the processes that serve the requests, if there are several (see api_server.py)
+        self.multiprocess_dir = None
+        self.changed = False
+        self.writer_pid = None
+
+    def register(self, collector):
+        self.collectors.append(collector)
+        return collector
+
+    def collect(self) -> list[MetricFamily]:
+        return [family for collector in self.collectors for family in collector.collect()]
+
+    def write_process_metrics(self):
+        """Write the metrics of this process to multiprocess_dir, so that the other processes can read them."""
+        self.changed = False
+        file_name = os.path.join(self.multiprocess_dir, f'{os.getpid()}.pickle')
+        with open(file_name + '.tmp', 'wb') as out:
+            pickle.dump(self.collect(), out)
+        os.replace(file_name + '.tmp', file_name)
+
+    def start_writer(self, interval: float = 1):
+        """
+        In multiprocess mode, write the metrics of this process every interval seconds if they have changed (and every
+        30 seconds anyway, for the gauges) from a background thread. Called on every request, it only starts the thread
+        once per process.
+        """
+        if self.multiprocess_dir is None or self.writer_pid == os.getpid():
+            return
+        self.writer_pid = os.getpid()
+
+        def writer():
+            last_write = 0
+            while True:
+                time.sleep(interval)
+                if self.changed or time.monotonic() - last_write >= 30:
+                    self.write_process_metrics()
+                    last_write = time.monotonic()
+
+        threading.Thread(target=writer, name='metrics_writer', daemon=True).start()
+
+    def render(self) -> str:
+        if self.multiprocess_dir is None:
+            families = self.collect()
+        else:
+            self.write_process_metrics()
+            process_families = dict()
+            for file_name in os.listdir(self.multiprocess_dir):
+                if file_name.endswith('.pickle'):
+                    with open(os.path.join(self.multiprocess_dir, file_name), 'rb') as ins:
+                        process_families[int(file_name.split('.')[0])] = pickle.load(ins)
+            families = merge_process_families(process_families)
+        return ''.join(line + '\n' for family in families for line in format_family(family))
+
+
+registry = Registry()
+
+
+class Counter:
+    """Counter by label values."""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = (), register: bool = True):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.values: dict[tuple[str, ...], float] = dict()
+        if register:
+            registry.register(self)
+
+    def inc(self, *label_values, amount: float = 1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+        registry.changed = True
+
+    def collect(self) -> list[MetricFamily]:
+        with self.lock:
+            samples = [(self.name, self.label_names, label_values, value) for label_values, value in sorted(self.values.items())]
+        return [MetricFamily(self.name, 'counter', self.documentation, samples)]
+
+    def render(self) -> list[str]:
+        return format_family(self.collect()[0])
+
+
+class Histogram:
+    """Histogram of observed values (e.g. durations in seconds) by label values, with cumulative buckets."""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = default_buckets, register: bool = True):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        # label values -> (count per bucket, the last one is +Inf, sum)
+        self.values: dict[tuple[str, ...], tuple[list[int], float]] = dict()
+        if register:
+            registry.register(self)
+
+    def observe(self, value: float, *label_values):
+        with self.lock:
+            counts, total = self.values.get(label_values, ([0] * (len(self.buckets) + 1), 0))
+            bucket = next((i for i, upper in enumerate(self.buckets) if value <= upper), len(self.buckets))
+            counts[bucket] += 1
+            self.values[label_values] = (counts, total + value)
+        registry.changed = True
+
+    def collect(self) -> list[MetricFamily]:
+        samples = list()
+        with self.lock:
+            for label_values, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for upper, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if upper == float('inf') else repr(float(upper))
+                    samples.append((f'{self.name}_bucket', self.label_names + ('le',), label_values + (le,), cumulative))
+                samples.append((f'{self.name}_sum', self.label_names, label_values, total))
+                samples.append((f'{self.name}_count', self.label_names, label_values, cumulative))
+        return [MetricFamily(self.name, 'histogram', self.documentation, samples)]
+
+    def render(self) -> list[str]:
+        return format_family(self.collect()[0])
+
+
+class CacheCollector:
+    """
+    Hits, misses and size of caches, read when rendering from their cache_info() method (functools.lru_cache or any
+    object returning something with the hits, misses and currsize attributes).
+    """
+
+    def __init__(self, caches: dict[str, object], register: bool = True):
+        self.caches = caches
+        if register:
+            registry.register(self)
+
+    def collect(self) -> list[MetricFamily]:
+        infos = {name: cache.cache_info() for name, cache in self.caches.items()}
+        families = list()
+        for metric, attribute, metric_type, documentation in [
+            ('cache_hits_total', 'hits', 'counter', 'Number of cache hits'),
+            ('cache_misses_total', 'misses', 'counter', 'Number of cache misses'),
+            ('cache_size', 'currsize', 'gauge', 'Number of entries in the cache'),
+        ]:
+            families.append(MetricFamily(metric, metric_type, documentation, [(metric, ('cache',), (name,), getattr(info, attribute)) for name, info in infos.items()]))
+        # Only for the caches that merge concurrent requests (see SingleFlightCache in transvar_functions.py)
+        coalesced = [('cache_coalesced_total', ('cache',), (name,), info.coalesced) for name, info in infos.items() if hasattr(info, 'coalesced')]
+        if coalesced:
+            families.append(MetricFamily('cache_coalesced_total', 'counter', 'Number of requests that waited for an identical request being computed', coalesced))
+        return families
+
+    def render(self) -> list[str]:
+        return [line for family in self.collect() for line in format_family(family)]
+
+
+def read_memory_rollup(pid='self') -> dict[str, int]:
+    """
+    Memory of a process in bytes from /proc/<pid>/smaps_rollup (only on Linux): Rss, Pss (the resident memory shared with
+    other processes divided between them), Shared_Clean, Private_Dirty, etc. Empty if it cannot be read.
+    """
+    values = dict()
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as ins:
+            for line in ins:
+                fields = line.split()
+                if len(fields) == 3 and fields[2] == 'kB':
+                    values[fields[0].rstrip(':')] = int(fields[1]) * 1024
+    except OSError:
+        pass
+    return values
+
+
+class ProcessMemoryCollector:
+    """Resident memory of the process (current and proportional, only on Linux, and maximum)."""
+
+    def __init__(self, register: bool = True):
+        if register:
+            registry.register(self)
+
+    def collect(self) -> list[MetricFamily]:
+        families = list()
+        try:
+            with open('/proc/self/statm') as ins:
+                resident_pages = int(ins.read().split()[1])
+            families.append(MetricFamily('process_resident_memory_bytes', 'gauge', 'Resident memory size in bytes', [('process_resident_memory_bytes', (), (), resident_pages * os.sysconf('SC_PAGE_SIZE'))]))
+        except OSError:
+            pass
+        proportional = read_memory_rollup().get('Pss')
+        if proportional is not None:
+            families.append(MetricFamily('process_proportional_memory_bytes', 'gauge', 'Resident memory size in bytes, with the memory shared with other processes divided between them', [('process_proportional_memory_bytes', (), (), proportional)]))
+        # ru_maxrss is in kilobytes on Linux, and bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        families.append(MetricFamily('process_max_resident_memory_bytes', 'gauge', 'Maximum resident memory size in bytes', [('process_max_resident_memory_bytes', (), (), max_rss)]))
+        return families
+
+    def render(self) -> list[str]:
+        return [line for family in self.collect() for line in format_family(family)]
@@ -2,9 +2,14 @@
 Pydantic models to define syntax rules. This is useful for type-hinting. An example grammar can be found in grammar.py.
 
 We define a grammar as a list of SyntaxRule objects, see the readme.
+
+The pydantic models are used to validate the grammar when it is loaded. Code that applies the rules to many alleles
+should use the CompiledSyntaxRule returned by parse_grammar, which has the regex pre-compiled and a lighter
+attribute access.
 """
-from typing import Callable
-from pydantic import BaseModel
+from typing import Callable, Iterable, Union
+from pydantic import BaseModel, PrivateAttr
+import itertools
 import re
 
 
@@ -17,24 +22,72 @@ class SyntaxRule(BaseModel):
     further_check: Callable[[list[str], dict], bool] = lambda g, gg: True
     format_for_transvar: Callable[[list[str], dict], list[str]] = lambda g, gg: []
 
+    @property
+    def pattern(self) -> re.Pattern:
+        return re.compile(self.regex)
+
     def get_groups(self, allele_sub_string: str, gene: dict) -> list[str]:
         """
         Match an allele description with the regex of this syntax rule (should match entire string), and further_checks.
         Returns the match.groups().
         """
-        match = re.match(self.regex, allele_sub_string)
-        if match is None:
-            raise ValueError(f'allele_substring {allele_sub_string} does not match regex of {self.type}:{self.rule_name}')
+        return _get_groups(self, allele_sub_string, gene)
+
+    def compile(self) -> 'CompiledSyntaxRule':
+        return CompiledSyntaxRule(self.type, self.rule_name, self.regex, self.apply_syntax, self.check_sequence, self.further_check, self.format_for_transvar)
+
+
+class CompiledSyntaxRule:
+    """
+    Immutable equivalent of SyntaxRule, with the regex compiled once. Do not build it directly from a
+    dictionary, use SyntaxRule.compile or parse_grammar so that the rule is validated first.
+    """
+    __slots__ = ('type', 'rule_name', 'regex', 'pattern', 'apply_syntax', 'check_sequence', 'further_check', 'format_for_transvar')
+
+    def __init__(self, type: str, rule_name: str, regex: str, apply_syntax, check_sequence, further_check, format_for_transvar):
+        for name, value in zip(self.__slots__, (type, rule_name, regex, re.compile(regex), apply_syntax, check_sequence, further_check, format_for_transvar)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{self.__class__.__name__} is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{self.__class__.__name__} is immutable')
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.type}:{self.rule_name})'
+
+    def get_groups(self, allele_sub_string: str, gene: dict) -> list[str]:
+        """See SyntaxRule.get_groups"""
+        return _get_groups(self, allele_sub_string, gene)
 
-        groups = match.groups()
-        if self.further_check(groups, gene):
-            return groups
-        raise ValueError(f'allele_substring {allele_sub_string} does not match further_check rule {self.type}:{self.rule_name}')
+
+def _get_groups(syntax_rule: Union[SyntaxRule, CompiledSyntaxRule], allele_sub_string: str, gene: dict) -> list[str]:
+    match = syntax_rule.pattern.match(allele_sub_string)
+    if match is None:
+        raise ValueError(f'allele_substring {allele_sub_string} does not match regex of {syntax_rule.type}:{syntax_rule.rule_name}')
+
+    groups = match.groups()
+    if syntax_rule.further_check(groups, gene):
+        return groups
+    raise ValueError(f'allele_substring {allele_sub_string} does not match further_check rule {syntax_rule.type}:{syntax_rule.rule_name}')
+
+
+def parse_grammar(grammar: list[dict]) -> list[CompiledSyntaxRule]:
+    """
+    Validate the rules of a grammar (see grammar.py) and return them as CompiledSyntaxRule objects.
+    """
+    return [SyntaxRule.parse_obj(r).compile() for r in grammar]
 
 
 class AllowedTypes(BaseModel):
     allowed_types: dict[frozenset, str]
     composed_types: dict[str, list[str]]
+    _lookup_table: dict[frozenset, str] = PrivateAttr(default_factory=dict)
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        self._lookup_table = self.build_lookup_table()
 
     def split_composed_types(self, types: list[str]) -> list[str]:
         """
@@ -48,12 +101,45 @@ class AllowedTypes(BaseModel):
                 splitted_types.append(type)
         return frozenset(splitted_types)
 
+    def build_lookup_table(self) -> dict[frozenset, str]:
+        """
+        Map every set of types that can be encountered in an allele (including composed types) to the allele type. E.g.
+        for the allowed type frozenset({'amino_acid_mutation', 'partial_amino_acid_deletion'}) the sets {'amino_acid_deletion_and_mutation'},
+        {'amino_acid_deletion_and_mutation', 'amino_acid_mutation'}, etc. are also included. Sets of types that
+        are not allowed are not in the table.
+        """
+        lookup_table = dict()
+        for allowed_key, allele_type in self.allowed_types.items():
+            # Types that could appear in an allele of this allowed_key: the types themselves, or composed
+            # types made only of them
+            candidates = list(allowed_key) + [t for t, parts in self.composed_types.items() if set(parts) <= allowed_key]
+            for n in range(1, len(candidates) + 1):
+                for encountered_types in itertools.combinations(candidates, n):
+                    if self.split_composed_types(encountered_types) == allowed_key:
+                        lookup_table[frozenset(encountered_types)] = allele_type
+        return lookup_table
+
     def __getitem__(self, types: frozenset) -> str:
-        splitted_types = self.split_composed_types(types)
-        return self.allowed_types[splitted_types]
+        if not isinstance(types, frozenset):
+            types = frozenset(types)
+        return self._lookup_table[types]
+
+    def classify_rules_applied(self, rules_applied_list: Iterable[str]) -> list[str]:
+        """
+        Return the allele type for each of the values of the `rules_applied` column of the allele_qc.py output, e.g.
+        'amino_acid_mutation:single_aa|partial_amino_acid_deletion:multiple_aa' -> 'amino_acid_deletion_and_mutation'.
+        Each distinct value is classified only once.
+        """
+        classified = dict()
+        out_list = list()
+        for rules_applied in rules_applied_list:
+            if rules_applied not in classified:
+                classified[rules_applied] = self[frozenset(r.split(':')[0] for r in rules_applied.split('|'))]
+            out_list.append(classified[rules_applied])
+        return out_list
 
 
-def find_rule(grammar: list[SyntaxRule], rule_type, rule_name) -> SyntaxRule:
+def find_rule(grammar: list[Union[SyntaxRule, CompiledSyntaxRule]], rule_type, rule_name) -> Union[SyntaxRule, CompiledSyntaxRule]:
     for rule in grammar:
         if rule.type == rule_type and rule.rule_name == rule_name:
             return rule
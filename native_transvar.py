@@ -0,0 +1,393 @@
+"""
+Native version of the transvar annotations used in the pipeline, based on the CDS of the genes in the genome
+dictionary (see load_genome.py) instead of the transvar database. The functions return the same coordinate
+strings as transvar (gDNA/cDNA/protein, e.g. `I:g.1822619A>G/c.571T>C/p.S191P`), and raise NativeAnnotationError
+for the cases that are not supported, so that the caller can fall back to transvar (see get_protein_variant_coordinates).
+
+For protein variants, we use the codon tables of transvar, so that the choice of codon for a protein substitution
+(the one with fewest changes, in the order of transvar's reverse_codon_table) is the same. Like transvar, they use the
+standard genetic code also for mitochondrial genes.
+
+For genomic variants in the CDS (see get_nucleotide_variant_coordinates), the consequence is computed with the codon
+table of the gene (see get_codon_table and `mitochondrial_table` in config.json), so for mitochondrial genes the
+protein consequence may differ from the one of transvar (e.g. TGA is translated as W).
+"""
+import re
+from functools import lru_cache
+from Bio.Seq import reverse_complement, complement
+from Bio.Data import CodonTable
+from transvar.transcripts import standard_codon_table, reverse_codon_table, codondiff, translate_seq
+from transvar.err import IncompatibleTranscriptError
+from transvar.utils import double_trim
+
+# Default value of --seqmax in transvar: deleted sequences longer than this are shown as their length
+SEQMAX = 10
+
+
+class NativeAnnotationError(ValueError):
+    """The variant is not supported by the native annotation, transvar should be used instead."""
+    pass
+
+
+def translate_codons(natural_seq: str) -> str:
+    """Translate like transvar (stops at the first stop codon)."""
+    try:
+        return translate_seq(natural_seq)
+    except IncompatibleTranscriptError:
+        raise NativeAnnotationError('invalid codon sequence', natural_seq)
+
+
+class CDSCoordinates:
+    """
+    Coordinates of the CDS of a gene, to convert between cDNA positions (1-based, the first nucleotide of the
+    CDS is c.1) and genome positions (1-based, as used by transvar).
+    """
+
+    def __init__(self, gene: dict):
+        if 'CDS' not in gene:
+            raise NativeAnnotationError('gene has no CDS')
+        self.chromosome = gene['contig'].id
+        self.contig_seq = gene['contig'].seq
+        location = gene['CDS'].location
+        self.strand = location.strand
+        # Parts of the CDS in transcript order
+        self.parts = [(int(part.start), int(part.end)) for part in location.parts]
+        self.cds_length = sum(end - start for start, end in self.parts)
+        # Number of codons, excluding the last one (normally the stop codon). We don't support variants in the last
+        # codon, since whether it is included in the CDS of transvar depends on the annotation file.
+        self.codon_number = self.cds_length // 3 - 1
+
+    def tnuc2gnuc(self, tnuc_pos: int) -> int:
+        offset = tnuc_pos - 1
+        for start, end in self.parts:
+            if offset < end - start:
+                return start + offset + 1 if self.strand == 1 else end - offset
+            offset -= end - start
+        raise NativeAnnotationError('position outside of CDS', tnuc_pos)
+
+    def gnuc2tnuc(self, gnuc_pos: int) -> int:
+        offset = 0
+        for start, end in self.parts:
+            if start < gnuc_pos <= end:
+                return offset + (gnuc_pos - start if self.strand == 1 else end - gnuc_pos + 1)
+            offset += end - start
+        raise NativeAnnotationError('position outside of CDS', gnuc_pos)
+
+    def in_single_part(self, gnuc_beg: int, gnuc_end: int) -> bool:
+        """Whether the genome positions between gnuc_beg and gnuc_end (included) are in the same exon of the CDS."""
+        return any(start < gnuc_beg and gnuc_end <= end for start, end in self.parts)
+
+    def genome_seq(self, gnuc_beg: int, gnuc_end: int) -> str:
+        """Sequence of the genome between the two positions (included), in the forward strand."""
+        return str(self.contig_seq[gnuc_beg - 1:gnuc_end]).upper()
+
+    def codon(self, taa_pos: int) -> tuple[list[int], str]:
+        """Return the genome positions of the codon, in transcript order, and its sequence in the transcript."""
+        if taa_pos < 1 or taa_pos > self.codon_number:
+            raise NativeAnnotationError('codon position not supported', taa_pos)
+        positions = [self.tnuc2gnuc(taa_pos * 3 - 2 + i) for i in range(3)]
+        seq = ''.join(self.genome_seq(p, p) for p in positions)
+        return positions, seq if self.strand == 1 else complement(seq)
+
+    def codon_aa(self, taa_pos: int) -> str:
+        return translate_codons(self.codon(taa_pos)[1])
+
+    def tnuc_range2gnuc_range(self, tnuc_beg: int, tnuc_end: int) -> tuple[int, int]:
+        return tuple(sorted([self.tnuc2gnuc(tnuc_beg), self.tnuc2gnuc(tnuc_end)]))
+
+
+def protein_substitution_coordinates(cds: CDSCoordinates, ref: str, pos: int, alt: str) -> str:
+    """Equivalent to transvar panno of p.{ref}{pos}{alt} (see _annotate_snv_protein in transvar)."""
+    positions, codon_seq = cds.codon(pos)
+    if codon_seq not in standard_codon_table:
+        raise NativeAnnotationError('invalid codon sequence', codon_seq)
+    if ref and codon_seq not in reverse_codon_table[ref]:
+        raise NativeAnnotationError('reference amino acid does not match', ref, pos)
+
+    target_codons = [c for c in reverse_codon_table[alt] if c != codon_seq]
+    if len(target_codons) == 0:
+        raise NativeAnnotationError('no alternative codon', alt)
+    diffs = [codondiff(c, codon_seq) for c in target_codons]
+    # Stable sorting, like in transvar
+    best_index = sorted(range(len(diffs)), key=lambda i: len(diffs[i]))[0]
+    diff = diffs[best_index]
+    target_codon = target_codons[best_index]
+    alt = standard_codon_table[target_codon]
+
+    if len(diff) == 1:
+        tnuc_ref = codon_seq[diff[0]]
+        tnuc_alt = target_codon[diff[0]]
+        gnuc_ref, gnuc_alt = (tnuc_ref, tnuc_alt) if cds.strand == 1 else (complement(tnuc_ref), complement(tnuc_alt))
+        gdna = f'g.{positions[diff[0]]}{gnuc_ref}>{gnuc_alt}'
+        cdna = f'c.{(pos - 1) * 3 + 1 + diff[0]}{tnuc_ref}>{tnuc_alt}'
+    else:
+        tnuc_ref = codon_seq[diff[0]:diff[-1] + 1]
+        tnuc_alt = target_codon[diff[0]:diff[-1] + 1]
+        gnuc_beg, gnuc_end = sorted([positions[diff[0]], positions[diff[-1]]])
+        # Transvar does not reverse-complement the sequences in the genomic coordinates of multi-nucleotide
+        # changes in the negative strand, we keep it that way for consistency with existing results.
+        gdna = f'g.{gnuc_beg}_{gnuc_end}del{tnuc_ref}ins{tnuc_alt}'
+        cdna = f'c.{(pos - 1) * 3 + 1 + diff[0]}_{(pos - 1) * 3 + 1 + diff[-1]}del{tnuc_ref}ins{tnuc_alt}'
+
+    return f'{cds.chromosome}:{gdna}/{cdna}/p.{ref}{pos}{alt}'
+
+
+def protein_position_coordinates(cds: CDSCoordinates, ref: str, pos: int) -> str:
+    """Equivalent to transvar panno of p.{ref}{pos} (see annotate_region_protein_transcript1 in transvar)."""
+    aa = cds.codon_aa(pos)
+    if ref and ref != aa:
+        raise NativeAnnotationError('reference amino acid does not match', ref, pos)
+    gnuc_beg, gnuc_end = cds.tnuc_range2gnuc_range(pos * 3 - 2, pos * 3)
+    return f'{cds.chromosome}:g.{gnuc_beg}_{gnuc_end}/c.{pos * 3 - 2}_{pos * 3}/p.{pos}{aa}'
+
+
+def protein_deletion_coordinates(cds: CDSCoordinates, beg: int, end: int) -> str:
+    """
+    Equivalent to transvar panno of p.{beg}_{end}del (see annotate_deletion_protein in transvar). Only deletions
+    that don't need to be aligned (same result when shifted left or right) are supported.
+    """
+    if beg > end:
+        raise NativeAnnotationError('invalid deletion range', beg, end)
+    # Raises an error if the codons are not valid
+    beg_aa = cds.codon_aa(beg)
+    end_aa = cds.codon_aa(end)
+
+    tnuc_beg = beg * 3 - 2
+    tnuc_end = end * 3
+    gnuc_beg, gnuc_end = cds.tnuc_range2gnuc_range(tnuc_beg, tnuc_end)
+    gnuc_delseq = cds.genome_seq(gnuc_beg, gnuc_end)
+
+    # Transvar shifts the deletion to the right in the genome (and also to the left in the negative strand)
+    if cds.genome_seq(gnuc_end + 1, gnuc_end + 1) == gnuc_delseq[0] or (cds.strand == -1 and cds.genome_seq(gnuc_beg - 1, gnuc_beg - 1) == gnuc_delseq[-1]):
+        raise NativeAnnotationError('deletion can be aligned in the genome')
+    # and in the protein
+    if end + 1 <= cds.codon_number and cds.codon_aa(end + 1) == beg_aa:
+        raise NativeAnnotationError('deletion can be aligned in the protein')
+
+    tnuc_delseq = gnuc_delseq if cds.strand == 1 else reverse_complement(gnuc_delseq)
+    gnuc_delrep = str(len(gnuc_delseq)) if len(gnuc_delseq) > SEQMAX else gnuc_delseq
+    tnuc_delrep = str(len(tnuc_delseq)) if len(tnuc_delseq) > SEQMAX else tnuc_delseq
+
+    if beg == end:
+        protein = f'{beg_aa}{beg}del{beg_aa}'
+    else:
+        taa_delrep = str(end - beg + 1) if end - beg + 1 > SEQMAX else translate_codons(''.join(cds.codon(i)[1] for i in range(beg, end + 1)))
+        protein = f'{beg_aa}{beg}_{end_aa}{end}del{taa_delrep}'
+
+    return f'{cds.chromosome}:g.{gnuc_beg}_{gnuc_end}del{gnuc_delrep}/c.{tnuc_beg}_{tnuc_end}del{tnuc_delrep}/p.{protein}'
+
+
+def get_protein_variant_coordinates(variant_description: str, gene: dict) -> str:
+    """
+    Return the transvar coordinates (gDNA/cDNA/protein) of a protein variant in the transvar input format, without
+    the gene id (e.g. p.S191P, p.S191, p.191_200del, p.S191*) for the CDS of `gene`. Raises NativeAnnotationError
+    for variants that are not supported.
+    """
+    cds = CDSCoordinates(gene)
+
+    # Substitution, or single position
+    match = re.match(r'^p\.([A-Z*]?)(\d+)([A-Z*]?)$', variant_description)
+    if match:
+        ref, pos, alt = match.groups()
+        if ref == '*' or (ref and ref not in reverse_codon_table) or (alt and alt not in reverse_codon_table):
+            raise NativeAnnotationError('unsupported amino acid', variant_description)
+        if alt:
+            return protein_substitution_coordinates(cds, ref, int(pos), alt)
+        return protein_position_coordinates(cds, ref, int(pos))
+
+    # Deletion (transvar does not check the reference amino acids)
+    match = re.match(r'^p\.[A-Z]?(\d+)(?:_[A-Z]?(\d+))?del$', variant_description)
+    if match:
+        beg, end = match.groups()
+        return protein_deletion_coordinates(cds, int(beg), int(end) if end else int(beg))
+
+    raise NativeAnnotationError('unsupported variant', variant_description)
+
+
+@lru_cache()
+def get_codon_table(table_id: int = 1) -> dict[str, str]:
+    """Codon to amino acid dictionary (stop codons as *) for a NCBI table id (see `mitochondrial_table` in config.json)."""
+    table = CodonTable.unambiguous_dna_by_id[table_id]
+    return table.forward_table | {codon: '*' for codon in table.stop_codons}
+
+
+def translate_with_table(natural_seq: str, codon_table: dict[str, str]) -> str:
+    try:
+        return ''.join(codon_table[natural_seq[i:i + 3]] for i in range(0, len(natural_seq), 3))
+    except KeyError:
+        raise NativeAnnotationError('invalid codon sequence', natural_seq)
+
+
+def check_codon_range(cds: CDSCoordinates, taa_beg: int, taa_end: int):
+    # Transvar does not give the protein consequence of changes in the first or last codon of the CDS (which
+    # may be the stop codon or the one before, depending on the annotation file).
+    if taa_beg < 2 or taa_end > cds.codon_number - 1:
+        raise NativeAnnotationError('variant in the first or last codons of the CDS', taa_beg, taa_end)
+
+
+def genomic_substitution_coordinates(cds: CDSCoordinates, gnuc_pos: int, gnuc_ref: str, gnuc_alt: str, codon_table: dict[str, str]) -> str:
+    """Equivalent to transvar ganno of g.{gnuc_pos}{gnuc_ref}>{gnuc_alt} (see annotate_snv_gdna_trannscript in transvar)."""
+    tnuc_pos = cds.gnuc2tnuc(gnuc_pos)
+    taa_pos = (tnuc_pos + 2) // 3
+    check_codon_range(cds, taa_pos, taa_pos)
+    positions, codon_seq = cds.codon(taa_pos)
+    index = positions.index(gnuc_pos)
+    tnuc_ref, tnuc_alt = (gnuc_ref, gnuc_alt) if cds.strand == 1 else (complement(gnuc_ref), complement(gnuc_alt))
+    alt_codon_seq = codon_seq[:index] + tnuc_alt + codon_seq[index + 1:]
+    taa_ref = translate_with_table(codon_seq, codon_table)
+    taa_alt = translate_with_table(alt_codon_seq, codon_table)
+
+    return f'{cds.chromosome}:g.{gnuc_pos}{gnuc_ref}>{gnuc_alt}/c.{tnuc_pos}{tnuc_ref}>{tnuc_alt}/p.{taa_ref}{taa_pos}{taa_alt}'
+
+
+def genomic_block_substitution_coordinates(cds: CDSCoordinates, gnuc_beg: int, gnuc_end: int, gnuc_altseq: str, codon_table: dict[str, str]) -> str:
+    """
+    Equivalent to transvar ganno of g.{gnuc_beg}_{gnuc_end}delins{gnuc_altseq}, where the reference sequence has the same
+    length as gnuc_altseq, and differs from it in the first and last positions (see annotate_mnv_gdna in transvar).
+    """
+    # Transvar does not give the protein consequence if the change is next to a splice site
+    if not cds.in_single_part(gnuc_beg - 1, gnuc_end + 1):
+        raise NativeAnnotationError('variant not inside a CDS exon', gnuc_beg, gnuc_end)
+    tnuc_beg, tnuc_end = sorted([cds.gnuc2tnuc(gnuc_beg), cds.gnuc2tnuc(gnuc_end)])
+    tnuc_altseq = gnuc_altseq if cds.strand == 1 else reverse_complement(gnuc_altseq)
+    taa_beg = (tnuc_beg + 2) // 3
+    taa_end = (tnuc_end + 2) // 3
+    check_codon_range(cds, taa_beg, taa_end)
+
+    old_seq = ''.join(cds.codon(i)[1] for i in range(taa_beg, taa_end + 1))
+    offset = tnuc_beg - (taa_beg * 3 - 2)
+    new_seq = old_seq[:offset] + tnuc_altseq + old_seq[offset + len(tnuc_altseq):]
+    old_taa_seq = translate_with_table(old_seq, codon_table)
+    new_taa_seq = translate_with_table(new_seq, codon_table)
+    # Transvar stops translating at stop codons
+    if '*' in old_taa_seq + new_taa_seq:
+        raise NativeAnnotationError('stop codon in block substitution')
+
+    if old_taa_seq == new_taa_seq:
+        protein = '(=)'
+    else:
+        old_taa_seq, new_taa_seq, head_trim, tail_trim = double_trim(old_taa_seq, new_taa_seq)
+        if len(old_taa_seq) == 1:
+            protein = f'{old_taa_seq}{taa_beg + head_trim}{new_taa_seq}'
+        else:
+            protein = f'{old_taa_seq[0]}{taa_beg + head_trim}_{old_taa_seq[-1]}{taa_end - tail_trim}delins{new_taa_seq}'
+
+    return f'{cds.chromosome}:g.{gnuc_beg}_{gnuc_end}delins{gnuc_altseq}/c.{tnuc_beg}_{tnuc_end}delins{tnuc_altseq}/p.{protein}'
+
+
+def taa_deletion(cds: CDSCoordinates, taa_beg: int, taa_end: int, codon_table: dict[str, str]) -> str:
+    """Protein part of a deletion of codons taa_beg to taa_end, shifted to the right like in taa_set_del of transvar."""
+    def aa(taa_pos):
+        return translate_with_table(cds.codon(taa_pos)[1], codon_table)
+
+    while True:
+        next_pos = taa_end + 1
+        if next_pos >= cds.codon_number:
+            # Whether transvar shifts into the last codon depends on the annotation file
+            if next_pos == cds.codon_number and aa(next_pos) == aa(taa_beg):
+                raise NativeAnnotationError('deletion can be aligned to the end of the protein')
+            break
+        if aa(next_pos) != aa(taa_beg):
+            break
+        taa_beg += 1
+        taa_end += 1
+
+    if taa_beg == taa_end:
+        return f'{aa(taa_beg)}{taa_beg}del{aa(taa_beg)}'
+    taa_delrep = str(taa_end - taa_beg + 1) if taa_end - taa_beg + 1 > SEQMAX else ''.join(aa(i) for i in range(taa_beg, taa_end + 1))
+    return f'{aa(taa_beg)}{taa_beg}_{aa(taa_end)}{taa_end}del{taa_delrep}'
+
+
+def genomic_deletion_coordinates(cds: CDSCoordinates, gnuc_beg: int, gnuc_end: int, codon_table: dict[str, str]) -> str:
+    """
+    Equivalent to transvar ganno of g.{gnuc_beg}_{gnuc_end}del (see annotate_deletion_gdna in transvar). Only in-frame
+    deletions are supported.
+    """
+    if (gnuc_end - gnuc_beg + 1) % 3 != 0:
+        raise NativeAnnotationError('frameshift deletion')
+
+    # Transvar shows the deletion shifted to the right in the genome, and to the left for the cDNA in the negative strand
+    gnuc_beg_r, gnuc_end_r = gnuc_beg, gnuc_end
+    while cds.genome_seq(gnuc_end_r + 1, gnuc_end_r + 1) == cds.genome_seq(gnuc_beg_r, gnuc_beg_r) != 'N':
+        gnuc_beg_r += 1
+        gnuc_end_r += 1
+    gnuc_beg_l, gnuc_end_l = gnuc_beg, gnuc_end
+    while gnuc_beg_l > 1 and cds.genome_seq(gnuc_beg_l - 1, gnuc_beg_l - 1) == cds.genome_seq(gnuc_end_l, gnuc_end_l) != 'N':
+        gnuc_beg_l -= 1
+        gnuc_end_l -= 1
+
+    for beg, end in [(gnuc_beg, gnuc_end), (gnuc_beg_l, gnuc_end_l), (gnuc_beg_r, gnuc_end_r)]:
+        if not cds.in_single_part(beg - 1, end + 1):
+            raise NativeAnnotationError('deletion not inside a CDS exon', beg, end)
+
+    if cds.strand == 1:
+        tnuc_beg_r, tnuc_end_r = cds.gnuc2tnuc(gnuc_beg_r), cds.gnuc2tnuc(gnuc_end_r)
+        tnuc_delseq = cds.genome_seq(gnuc_beg_r, gnuc_end_r)
+    else:
+        tnuc_beg_r, tnuc_end_r = cds.gnuc2tnuc(gnuc_end_l), cds.gnuc2tnuc(gnuc_beg_l)
+        tnuc_delseq = reverse_complement(cds.genome_seq(gnuc_beg_l, gnuc_end_l))
+    gnuc_delseq = cds.genome_seq(gnuc_beg_r, gnuc_end_r)
+    gnuc_delrep = str(len(gnuc_delseq)) if len(gnuc_delseq) > SEQMAX else gnuc_delseq
+    tnuc_delrep = str(len(tnuc_delseq)) if len(tnuc_delseq) > SEQMAX else tnuc_delseq
+
+    # The protein change is computed from the position in the input (see del_coding_inframe in transvar)
+    tnuc_beg, tnuc_end = sorted([cds.gnuc2tnuc(gnuc_beg), cds.gnuc2tnuc(gnuc_end)])
+    taa_beg = (tnuc_beg + 2) // 3
+    taa_end = (tnuc_end + 2) // 3
+    check_codon_range(cds, taa_beg, taa_end)
+    if tnuc_beg % 3 == 1:
+        protein = taa_deletion(cds, taa_beg, taa_end, codon_table)
+    else:
+        old_seq = ''.join(cds.codon(i)[1] for i in range(taa_beg, taa_end + 1))
+        offset = tnuc_beg - (taa_beg * 3 - 2)
+        taa_alt = translate_with_table(old_seq[:offset] + old_seq[offset + tnuc_end - tnuc_beg + 1:], codon_table)
+        taa_delseq = translate_with_table(old_seq, codon_table)
+        if '*' in taa_delseq:
+            raise NativeAnnotationError('stop codon in deletion')
+        if taa_alt == taa_delseq[-1]:
+            protein = taa_deletion(cds, taa_beg, taa_end - 1, codon_table)
+        elif taa_alt == taa_delseq[0]:
+            protein = taa_deletion(cds, taa_beg + 1, taa_end, codon_table)
+        else:
+            protein = f'{taa_delseq[0]}{taa_beg}_{taa_delseq[-1]}{taa_end}delins{taa_alt}'
+
+    return f'{cds.chromosome}:g.{gnuc_beg_r}_{gnuc_end_r}del{gnuc_delrep}/c.{tnuc_beg_r}_{tnuc_end_r}del{tnuc_delrep}/p.{protein}'
+
+
+def get_nucleotide_variant_coordinates(variant_description: str, gene: dict, codon_table: dict[str, str]) -> str:
+    """
+    Return the transvar coordinates (gDNA/cDNA/protein) of a genomic variant in the transvar input format, without
+    the chromosome (e.g. g.1822619A>G, g.1822619_1822621delAATinsGGC, g.1822619_1822624del), for the CDS of
+    `gene`, using `codon_table` (see get_codon_table). Only substitutions and in-frame deletions inside the exons
+    of the CDS are supported, NativeAnnotationError is raised for the rest (introns, UTRs, frameshifts, etc.).
+    """
+    cds = CDSCoordinates(gene)
+
+    # Substitution
+    match = re.match(r'^g\.(\d+)([ACGT])>([ACGT])$', variant_description)
+    if match:
+        pos, ref, alt = match.groups()
+        if cds.genome_seq(int(pos), int(pos)) != ref:
+            raise NativeAnnotationError('reference sequence does not match', variant_description)
+        return genomic_substitution_coordinates(cds, int(pos), ref, alt, codon_table)
+
+    # Block substitution
+    match = re.match(r'^g\.(\d+)_(\d+)del([ACGT]+)ins([ACGT]+)$', variant_description)
+    if match:
+        beg, end, refseq, altseq = match.groups()
+        if cds.genome_seq(int(beg), int(end)) != refseq:
+            raise NativeAnnotationError('reference sequence does not match', variant_description)
+        refseq, altseq, head_trim, tail_trim = double_trim(refseq, altseq)
+        if len(refseq) != len(altseq) or len(refseq) == 0:
+            raise NativeAnnotationError('unsupported variant', variant_description)
+        if len(refseq) == 1:
+            return genomic_substitution_coordinates(cds, int(beg) + head_trim, refseq, altseq, codon_table)
+        return genomic_block_substitution_coordinates(cds, int(beg) + head_trim, int(end) - tail_trim, altseq, codon_table)
+
+    # Deletion
+    match = re.match(r'^g\.(\d+)(?:_(\d+))?del$', variant_description)
+    if match:
+        beg, end = match.groups()
+        return genomic_deletion_coordinates(cds, int(beg), int(end) if end else int(beg), codon_table)
+
+    raise NativeAnnotationError('unsupported variant', variant_description)
@@ -0,0 +1,275 @@
+"""
+Genome-wide search of primers, to find the gene(s) that a mutagenesis primer targets without knowing the gene
+beforehand (see also the /primer endpoint, which searches in a single gene).
+
+The search uses a k-mer index of all the contigs of the genome (PrimerIndex), built once and stored with --output:
+
+* The primer and its reverse complement are split into max_mismatches + 1 non-overlapping seeds (of length k or
+  shorter). If the primer aligns with at most max_mismatches substitutions, at least one seed matches exactly, so
+  the positions of the seeds in the index are the only candidate placements. Since the k-mers are sorted, the
+  positions of a seed shorter than k are a contiguous range of the index.
+* The candidates are verified by counting the mismatches (Hamming distance) of the whole primer.
+* If the seeds would be too short (see min_seed_length), all positions are checked instead (see primer_mismatches
+  in allele_fixes.py).
+
+The spliced CDSs of the genes with several exons are also indexed, so that primers designed on the cDNA that span
+exon borders are found as well.
+
+For each placement, the genes whose main feature (including UTRs) overlaps with it are reported, with the implied
+allele descriptions at the nucleotide level (gene coordinates, see genome_coords2gene_coords) and protein level.
+
+Run this script after load_genome.py to build the index.
+"""
+import argparse
+import pickle
+import numpy
+from typing import NamedTuple, Optional
+from Bio.Seq import Seq, complement
+from allele_fixes import primer_mismatches
+from genome_functions import get_main_feature_start_end_strand, genome_coords2gene_coords
+
+# 2-bit code of each nucleotide (ASCII code -> code), other characters (e.g. N) are 4, and are not indexed
+nucleotide_codes = numpy.full(256, 4, dtype=numpy.uint8)
+for i, nt in enumerate('ACGT'):
+    nucleotide_codes[ord(nt)] = i
+    nucleotide_codes[ord(nt.lower())] = i
+
+# Shorter seeds find too many candidates, all positions are checked instead
+min_seed_length = 6
+
+
+def kmer_codes(seq: numpy.ndarray, k: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Integer code of each k-mer of seq (array of ASCII codes), and boolean array of whether the k-mer contains
+    only A, C, G or T.
+    """
+    nb_kmers = max(len(seq) - k + 1, 0)
+    codes = nucleotide_codes[seq]
+    invalid = numpy.concatenate([[0], numpy.cumsum(codes == 4)])
+    valid = (invalid[k:k + nb_kmers] - invalid[:nb_kmers]) == 0
+    codes = numpy.where(codes == 4, 0, codes).astype(numpy.uint32)
+    kmers = numpy.zeros(nb_kmers, dtype=numpy.uint32)
+    for i in range(k):
+        kmers = (kmers << 2) | codes[i:i + nb_kmers]
+    return kmers, valid
+
+
+class PrimerHit(NamedTuple):
+    systematic_id: str
+    # The strand in which the primer sequence is found, relative to the gene
+    strand: int
+    nucleotide_description: str
+    aminoacid_description: str
+
+
+class PrimerGenomeHit(NamedTuple):
+    contig: str
+    # One-based, inclusive
+    start: int
+    end: int
+    # The strand of the contig in which the primer sequence is found
+    strand: int
+    mismatches: int
+    genes: list[PrimerHit]
+
+
+class PrimerIndex:
+    """
+    k-mer index of the contigs of a genome, see the docstring of the module. The contigs are concatenated in
+    `sequence`, separated by an N. The positions of each k-mer are kmer_positions[kmer_offsets[code]:kmer_offsets[code + 1]].
+    """
+
+    def __init__(self, contig_ids: list[str], sequence: numpy.ndarray, contig_starts: numpy.ndarray, k: int, kmer_offsets: numpy.ndarray, kmer_positions: numpy.ndarray):
+        self.contig_ids = list(contig_ids)
+        self.sequence = sequence
+        self.contig_starts = contig_starts
+        self.k = int(k)
+        self.kmer_offsets = kmer_offsets
+        self.kmer_positions = kmer_positions
+
+    @classmethod
+    def from_contigs(cls, contigs: dict[str, str], k: int = 10) -> 'PrimerIndex':
+        sequence = numpy.frombuffer('N'.join(contigs.values()).encode(), dtype=numpy.uint8)
+        contig_starts = numpy.cumsum([0] + [len(c) + 1 for c in contigs.values()])[:-1]
+        kmers, valid = kmer_codes(sequence, k)
+        positions = numpy.flatnonzero(valid)
+        kmers = kmers[positions]
+        order = numpy.argsort(kmers, kind='stable')
+        kmer_offsets = numpy.zeros(4 ** k + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(kmers, minlength=4 ** k), out=kmer_offsets[1:])
+        return cls(list(contigs), sequence, contig_starts, k, kmer_offsets, positions[order].astype(numpy.uint32))
+
+    def save(self, output_file: str):
+        numpy.savez(output_file, contig_ids=numpy.array(self.contig_ids), sequence=self.sequence, contig_starts=self.contig_starts,
+                    k=self.k, kmer_offsets=self.kmer_offsets, kmer_positions=self.kmer_positions)
+
+    @classmethod
+    def load(cls, input_file: str) -> 'PrimerIndex':
+        data = numpy.load(input_file)
+        return cls(data['contig_ids'].tolist(), data['sequence'], data['contig_starts'], data['k'], data['kmer_offsets'], data['kmer_positions'])
+
+    def candidate_starts(self, primer: str, max_mismatches: int) -> Optional[numpy.ndarray]:
+        """
+        Start positions where the primer may align with at most max_mismatches, from max_mismatches + 1 seeds, or None if
+        the seeds would be shorter than min_seed_length or contain other characters than ACGT.
+        """
+        seed_length = min(self.k, len(primer) // (max_mismatches + 1))
+        if seed_length < min_seed_length:
+            return None
+        seeds, valid = kmer_codes(numpy.frombuffer(primer.encode(), dtype=numpy.uint8), seed_length)
+        starts = list()
+        for offset in range(0, seed_length * (max_mismatches + 1), seed_length):
+            if not valid[offset]:
+                return None
+            # The k-mers starting by the seed are contiguous in kmer_positions
+            first_kmer = int(seeds[offset]) << (2 * (self.k - seed_length))
+            last_kmer = (int(seeds[offset]) + 1) << (2 * (self.k - seed_length))
+            starts.append(self.kmer_positions[self.kmer_offsets[first_kmer]:self.kmer_offsets[last_kmer]].astype(numpy.int64) - offset)
+        # Seeds in the last k - 1 positions of a contig are not indexed, so we check those placements as well
+        contig_ends = numpy.append(self.contig_starts[1:] - 1, len(self.sequence))
+        starts.extend(numpy.arange(end - len(primer) - self.k + 1, end - len(primer) + 1) for end in contig_ends)
+        return numpy.unique(numpy.concatenate(starts))
+
+    def search(self, primer: str, max_mismatches: int) -> list[tuple[int, int, int]]:
+        """
+        Placements of the primer (strand 1) or its reverse complement (strand -1) in the concatenated contigs with
+        at most max_mismatches, as a list of (start, strand, mismatches), sorted by mismatches and position.
+        """
+        primer = primer.upper()
+        out_list = list()
+        for strand, strand_primer in [(1, primer), (-1, str(Seq(primer).reverse_complement()))]:
+            primer_array = numpy.frombuffer(strand_primer.encode(), dtype=numpy.uint8)
+            starts = self.candidate_starts(strand_primer, max_mismatches)
+            if starts is None:
+                distances = primer_mismatches(self.sequence, [primer_array])[0]
+                starts = numpy.flatnonzero(distances <= max_mismatches)
+                distances = distances[starts]
+            else:
+                starts = starts[(starts >= 0) & (starts <= len(self.sequence) - len(primer))]
+                windows = self.sequence[starts[:, None] + numpy.arange(len(primer))]
+                distances = (windows != primer_array).sum(axis=1)
+                starts, distances = starts[distances <= max_mismatches], distances[distances <= max_mismatches]
+            # Discard placements across two contigs (the end is the position after the placement, or the separator)
+            same_contig = numpy.searchsorted(self.contig_starts, starts, side='right') == numpy.searchsorted(self.contig_starts, starts + len(primer), side='right')
+            out_list.extend((int(start), strand, int(distance)) for start, distance in zip(starts[same_contig], distances[same_contig]))
+
+        return sorted(out_list, key=lambda x: (x[2], x[0], -x[1]))
+
+    def contig_position(self, start: int) -> tuple[str, int]:
+        """Contig and zero-based position in the contig of a position of the concatenated contigs."""
+        contig_index = int(numpy.searchsorted(self.contig_starts, start, side='right')) - 1
+        return self.contig_ids[contig_index], start - int(self.contig_starts[contig_index])
+
+
+def get_genome_contigs(genome: dict) -> dict[str, str]:
+    """
+    Sequences of the contigs of the genome (a contig may be shared by several genes), and of the spliced CDSs of
+    the genes with several exons, with the key `systematic_id:CDS`, to find primers that span exon borders.
+    """
+    contigs = dict()
+    for gene in genome.values():
+        if gene['contig'].id not in contigs:
+            contigs[gene['contig'].id] = str(gene['contig'].seq)
+    for systematic_id, gene in genome.items():
+        if 'CDS' in gene and len(gene['CDS'].location.parts) > 1:
+            contigs[f'{systematic_id}:CDS'] = str(gene['CDS'].location.extract(gene['contig'].seq))
+    return contigs
+
+
+def build_primer_index(genome: dict, k: int = 10) -> PrimerIndex:
+    return PrimerIndex.from_contigs(get_genome_contigs(genome), k)
+
+
+def gene_primer_hit(systematic_id: str, gene: dict, mutated_positions: dict[int, str], codon_table: int = 1) -> PrimerHit:
+    """
+    Allele descriptions implied by replacing the nucleotides of the contig of the gene at the positions in
+    mutated_positions (zero-based position -> nucleotide in the forward strand of the contig).
+    """
+    contig_seq = str(gene['contig'].seq)
+    feature_strand = get_main_feature_start_end_strand(gene, 0, 0)[2]
+    mutated_positions = {pos: nt for pos, nt in mutated_positions.items() if contig_seq[pos] != nt}
+
+    nucleotide_mutations = list()
+    for pos, mutated in mutated_positions.items():
+        original = contig_seq[pos]
+        gene_pos = genome_coords2gene_coords(pos + 1, gene)
+        if feature_strand == -1:
+            original, mutated = complement(original), complement(mutated)
+        nucleotide_mutations.append((gene_pos, f'{original}{gene_pos if gene_pos > 0 else f"({gene_pos})"}{mutated}'))
+
+    aminoacid_mutations = list()
+    if 'peptide' in gene and len(mutated_positions):
+        mutated_contig = list(contig_seq[min(mutated_positions):max(mutated_positions) + 1])
+        for pos, mutated in mutated_positions.items():
+            mutated_contig[pos - min(mutated_positions)] = mutated
+        mutated_contig = Seq(contig_seq[:min(mutated_positions)] + ''.join(mutated_contig) + contig_seq[max(mutated_positions) + 1:])
+        mutated_peptide = str(gene['CDS'].location.extract(mutated_contig).translate(table=codon_table))
+        for i, (original, mutated) in enumerate(zip(str(gene['peptide']), mutated_peptide)):
+            if original != mutated:
+                aminoacid_mutations.append(f'{original}{i + 1}{mutated}')
+
+    return PrimerHit(systematic_id, feature_strand, ','.join(m[1] for m in sorted(nucleotide_mutations)), ','.join(aminoacid_mutations))
+
+
+def find_primer_in_genome(primer: str, max_mismatches: int, index: PrimerIndex, genome: dict, config: dict = None) -> list[PrimerGenomeHit]:
+    """
+    Find the placements of the primer in the genome with at most max_mismatches (see PrimerIndex.search), and the
+    genes that they overlap. If config is passed, the mitochondrial genes are translated with `mitochondrial_table`.
+    """
+    primer = primer.upper()
+    gene_locations = dict()
+    for systematic_id, gene in genome.items():
+        try:
+            start, end, _ = get_main_feature_start_end_strand(gene, 0, 0)
+        except ValueError:
+            continue
+        gene_locations.setdefault(gene['contig'].id, list()).append((start, end, systematic_id))
+
+    def get_codon_table(systematic_id):
+        if config is not None and systematic_id.startswith(config['mitochondrial_prefix']):
+            return config['mitochondrial_table']
+        return 1
+
+    out_list = list()
+    for index_start, strand, mismatches in index.search(primer, max_mismatches):
+        contig, start = index.contig_position(index_start)
+        strand_primer = primer if strand == 1 else str(Seq(primer).reverse_complement())
+
+        if contig.endswith(':CDS'):
+            # Spliced CDS, we only keep the placements that span an exon border (the rest are found in the contig)
+            systematic_id = contig[:-4]
+            gene = genome[systematic_id]
+            cds_strand = gene['CDS'].location.strand
+            positions = list(gene['CDS'].location)[start:start + len(primer)]
+            if abs(positions[-1] - positions[0]) == len(primer) - 1:
+                continue
+            mutated_positions = {pos: nt if cds_strand == 1 else complement(nt) for pos, nt in zip(positions, strand_primer)}
+            gene_hit = gene_primer_hit(systematic_id, gene, mutated_positions, get_codon_table(systematic_id))
+            out_list.append(PrimerGenomeHit(gene['contig'].id, min(positions) + 1, max(positions) + 1, strand * cds_strand, mismatches, [gene_hit._replace(strand=strand)]))
+            continue
+
+        mutated_positions = {start + i: nt for i, nt in enumerate(strand_primer)}
+        genes = list()
+        for gene_start, gene_end, systematic_id in gene_locations.get(contig, []):
+            if gene_start < start + len(primer) and gene_end > start:
+                gene_hit = gene_primer_hit(systematic_id, genome[systematic_id], mutated_positions, get_codon_table(systematic_id))
+                genes.append(gene_hit._replace(strand=strand * gene_hit.strand))
+        out_list.append(PrimerGenomeHit(contig, start + 1, start + len(primer), strand, mismatches, genes))
+
+    return out_list
+
+
+if __name__ == '__main__':
+    class Formatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter):
+        pass
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=Formatter)
+    parser.add_argument('--genome', default='data/genome.pickle', help='input: genome dictionary built from contig files (see load_genome.py).')
+    parser.add_argument('--output', default='data/primer_index.npz', help='output: the k-mer index of the contigs')
+    parser.add_argument('--k', type=int, default=10, help='length of the k-mers (seeds)')
+    args = parser.parse_args()
+
+    with open(args.genome, 'rb') as ins:
+        genome = pickle.load(ins)
+
+    build_primer_index(genome, args.k).save(args.output)
@@ -17,76 +17,79 @@ Outputs:
 The extra columns generated in the results file are described in the readme.
 
 For now it works for PomBase data with the default paths, but it can be easily adapted to other data sources.
+
+The input files are read from the columnar versions if available, and the outputs can be written in other formats with
+--output_format (see results_io.py).
 """
 
 import json
 import pickle
-import pandas
-from common_autofix_functions import apply_multi_shift_fix, apply_old_coords_fix, apply_histone_fix, get_preferred_fix, format_auto_fix
-
+import argparse
+from common_autofix_functions import apply_fixes_by_gene, fix_columns, format_auto_fix
+from results_io import output_formats, check_output_formats, read_results, write_results
 
-with open('data/genome.pickle', 'rb') as ins:
-    genome = pickle.load(ins)
 
-data = pandas.read_csv('results/protein_modification_results_errors_aggregated.tsv', sep='\t', na_filter=False)
+if __name__ == '__main__':
+    class Formatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter):
+        pass
 
-with open('data/coordinate_changes_dict.json') as ins:
-    coordinate_changes_dict = json.load(ins)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=Formatter)
+    parser.add_argument('--output_format', nargs='+', choices=output_formats, default=['tsv'], help='format(s) of the output files, the columnar formats (see results_io.py) are written next to them with a different extension')
+    parser.add_argument('--processes', type=int, default=None, help='number of processes used to apply the fixes (by default, the number of CPUs)')
+    args = parser.parse_args()
+    check_output_formats(args.output_format)
 
+    with open('data/genome.pickle', 'rb') as ins:
+        genome = pickle.load(ins)
 
-print('applying fixes...')
-extra_cols = data.apply(apply_old_coords_fix, axis=1, result_type='expand', args=[coordinate_changes_dict, 'sequence_position'])
-data.loc[:, 'old_coords_fix'] = extra_cols.iloc[:, 0]
-data.loc[:, 'old_coords_revision'] = extra_cols.iloc[:, 1]
-data.loc[:, 'old_coords_location'] = extra_cols.iloc[:, 2]
+    data = read_results('results/protein_modification_results_errors_aggregated.tsv')
 
-data['multi_shift_fix'] = data.apply(apply_multi_shift_fix, axis=1, args=[genome, 'sequence_position'])
-data['histone_fix'] = data.apply(apply_histone_fix, axis=1, args=[genome, 'sequence_position'])
+    with open('data/coordinate_changes_dict.json') as ins:
+        coordinate_changes_dict = json.load(ins)
 
-extra_cols = data.apply(get_preferred_fix, axis=1, result_type='expand')
-data.loc[:, 'auto_fix_to'] = extra_cols.iloc[:, 0]
-data.loc[:, 'auto_fix_comment'] = extra_cols.iloc[:, 1]
-data.rename(columns={'sequence_position': 'auto_fix_from'}, inplace=True)
+    print('applying fixes...')
+    data[fix_columns] = apply_fixes_by_gene(data, genome, coordinate_changes_dict, 'sequence_position', args.processes)
+    data.rename(columns={'sequence_position': 'auto_fix_from'}, inplace=True)
 
-# Store all possible fixes
-data.to_csv('results/protein_modification_auto_fix_info.tsv', sep='\t', index=False)
+    # Store all possible fixes
+    write_results(data, 'results/protein_modification_auto_fix_info.tsv', args.output_format)
 
-# Apply the fixes in the data
-error_data = pandas.read_csv('results/protein_modification_results_errors.tsv', sep='\t', na_filter=False)
+    # Apply the fixes in the data
+    error_data = read_results('results/protein_modification_results_errors.tsv')
 
-autofix_data = error_data.merge(data[['systematic_id', 'reference', 'auto_fix_from', 'auto_fix_to', 'auto_fix_comment']], on=['systematic_id', 'reference'], how='left')
-autofix_data.fillna('', inplace=True)
-extra_cols = autofix_data.apply(format_auto_fix, axis=1, result_type='expand', args=['sequence_position', 'change_sequence_position_to'])
+    autofix_data = error_data.merge(data[['systematic_id', 'reference', 'auto_fix_from', 'auto_fix_to', 'auto_fix_comment']], on=['systematic_id', 'reference'], how='left')
+    autofix_data.fillna('', inplace=True)
+    extra_cols = autofix_data.apply(format_auto_fix, axis=1, result_type='expand', args=['sequence_position', 'change_sequence_position_to'])
 
-# Overwrite these columns with the new values
-autofix_data.loc[:, 'change_sequence_position_to'] = extra_cols.iloc[:, 0].apply(lambda x: x.split('|'))
-autofix_data.loc[:, 'auto_fix_comment'] = extra_cols.iloc[:, 1].apply(lambda x: x.split('|'))
-autofix_data.drop(columns=['auto_fix_from', 'auto_fix_to'], inplace=True)
+    # Overwrite these columns with the new values
+    autofix_data.loc[:, 'change_sequence_position_to'] = extra_cols.iloc[:, 0].apply(lambda x: x.split('|'))
+    autofix_data.loc[:, 'auto_fix_comment'] = extra_cols.iloc[:, 1].apply(lambda x: x.split('|'))
+    autofix_data.drop(columns=['auto_fix_from', 'auto_fix_to'], inplace=True)
 
-# Explode columns with multiple solutions
-autofix_data.loc[:, 'solution_index'] = autofix_data['change_sequence_position_to'].apply(lambda x: list(range(len(x))) if len(x) > 1 else [None, ])
-autofix_data = autofix_data.explode(['change_sequence_position_to', 'auto_fix_comment', 'solution_index'])
+    # Explode columns with multiple solutions
+    autofix_data.loc[:, 'solution_index'] = autofix_data['change_sequence_position_to'].apply(lambda x: list(range(len(x))) if len(x) > 1 else [None, ])
+    autofix_data = autofix_data.explode(['change_sequence_position_to', 'auto_fix_comment', 'solution_index'])
 
-# Print some stats
-nb_errors = autofix_data.shape[0]
-errors_fixed = sum(autofix_data.change_sequence_position_to != '')
-syntax_errors = sum(autofix_data.auto_fix_comment == 'syntax_error')
-multiple_fixes = sum(autofix_data.change_sequence_position_to.str.contains('\|'))
-sequence_errors = errors_fixed - syntax_errors
+    # Print some stats
+    nb_errors = autofix_data.shape[0]
+    errors_fixed = sum(autofix_data.change_sequence_position_to != '')
+    syntax_errors = sum(autofix_data.auto_fix_comment == 'syntax_error')
+    multiple_fixes = sum(autofix_data.change_sequence_position_to.str.contains('\|'))
+    sequence_errors = errors_fixed - syntax_errors
 
-print(f'{nb_errors} errors found, of which {errors_fixed} fixed:\n  - {sequence_errors} sequence errors\n  - {syntax_errors} syntax errors\n  - {multiple_fixes} have several possible fixes, for those check the `change_sequence_position_to` field for "|" characters')
-print('', 'Types of errors fixed:', '', autofix_data['auto_fix_comment'].apply(lambda x: x.split(',')[0]).value_counts(), sep='\n')
-# If you want to print only the dubious cases
-# print(autofix_data[autofix_data.change_sequence_position_to.str.contains('\|')])
+    print(f'{nb_errors} errors found, of which {errors_fixed} fixed:\n  - {sequence_errors} sequence errors\n  - {syntax_errors} syntax errors\n  - {multiple_fixes} have several possible fixes, for those check the `change_sequence_position_to` field for "|" characters')
+    print('', 'Types of errors fixed:', '', autofix_data['auto_fix_comment'].apply(lambda x: x.split(',')[0]).value_counts(), sep='\n')
+    # If you want to print only the dubious cases
+    # print(autofix_data[autofix_data.change_sequence_position_to.str.contains('\|')])
 
-fixed_rows = autofix_data.change_sequence_position_to != ''
-autofix_data[fixed_rows].to_csv('results/protein_modification_auto_fix.tsv', sep='\t', index=False)
+    fixed_rows = autofix_data.change_sequence_position_to != ''
+    write_results(autofix_data[fixed_rows], 'results/protein_modification_auto_fix.tsv', args.output_format)
 
-other_errors_names = ['not_protein_gene', 'pattern_error', 'residue_not_allowed']
+    other_errors_names = ['not_protein_gene', 'pattern_error', 'residue_not_allowed']
 
-cannot_fix = autofix_data[~fixed_rows].drop(columns=['change_sequence_position_to', 'auto_fix_comment', 'solution_index'])
+    cannot_fix = autofix_data[~fixed_rows].drop(columns=['change_sequence_position_to', 'auto_fix_comment', 'solution_index'])
 
-other_errors = cannot_fix.sequence_error.isin(other_errors_names)
+    other_errors = cannot_fix.sequence_error.isin(other_errors_names)
 
-cannot_fix[other_errors].rename(columns={'sequence_error': 'error'}).to_csv('results/protein_modification_cannot_fix_other_errors.tsv', sep='\t', index=False)
-cannot_fix[~other_errors].to_csv('results/protein_modification_cannot_fix_sequence_errors.tsv', sep='\t', index=False)
+    write_results(cannot_fix[other_errors].rename(columns={'sequence_error': 'error'}), 'results/protein_modification_cannot_fix_other_errors.tsv', args.output_format)
+    write_results(cannot_fix[~other_errors], 'results/protein_modification_cannot_fix_sequence_errors.tsv', args.output_format)
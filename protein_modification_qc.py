@@ -16,17 +16,43 @@ The extra columns of the output are:
     - change_sequence_position_to: the sequence position that the error should be changed to (only fixes syntax errors)
 
 For now it works for PomBase data with the default paths, but it can be easily adapted to other data sources.
+
+If --genome_diff is passed (see genome_diff.py), only the modifications of affected genes, or that are not in the
+existing results/protein_modification_results.tsv are checked again.
 """
 
 import pandas
-from models import SyntaxRule
+import argparse
+from models import CompiledSyntaxRule, parse_grammar
 from grammar import check_sequence_single_pos, aa
 from refinement_functions import replace_allele_features_with_syntax_rules
 from genome_functions import process_systematic_id
+from genome_diff import read_affected_systematic_ids, split_by_previous_results
+from results_io import output_formats, check_output_formats, read_results, write_results
 import pickle
 import re
 import json
 
+# We create a dummy syntax rule for the aa modifications (single aminoacid not preceded with an aminoacid, followed
+# by number, and optionally followed by another aminoacid -sometimes people would write S123A to indicate that S123
+# is phosphorylated- ), and one for the special abbreviations for CTD modifications
+modification_grammar = [
+    {
+        'type': 'dummy',
+        'rule_name': 'dummy',
+        'regex': f'(?<!{aa})({aa})(\d+){aa}?',
+        'apply_syntax': lambda x: f'{x[0]}{x[1]}',
+    },
+    {
+        'type': 'ctd_abbreviations',
+        'rule_name': 'ctd_abbreviations',
+        'regex': '(CTD_S2|CTD_T4|CTD_S5|CTD_S7)',
+        'apply_syntax': lambda x: x[0]
+    },
+]
+
+modification_syntax_rules = parse_grammar(modification_grammar)
+
 
 def check_func(row, genome, allowed_mod_dict):
     """
@@ -52,27 +78,10 @@ def check_func(row, genome, allowed_mod_dict):
     if 'CDS' not in gene:
         return 'not_protein_gene', ''
 
-    # We create a dummy syntax rule for the aa modifications (single aminoacid not preceded with an aminoacid, followed
-    # by number, and optionally followed by another aminoacid -sometimes people would write S123A to indicate that S123
-    # is phosphorylated- )
-    dummy_rule = SyntaxRule(
-        type='dummy',
-        rule_name='dummy',
-        regex=f'(?<!{aa})({aa})(\d+){aa}?',
-        apply_syntax=lambda x: f'{x[0]}{x[1]}',
-    )
-    # Special abbreviations for CTD modifications
-    ctd_rule = SyntaxRule(
-        type='ctd_abbreviations',
-        rule_name='ctd_abbreviations',
-        regex='(CTD_S2|CTD_T4|CTD_S5|CTD_S7)',
-        apply_syntax=lambda x: x[0]
-    )
-
-    result = replace_allele_features_with_syntax_rules([dummy_rule, ctd_rule], [row['sequence_position']], [], gene)
+    result = replace_allele_features_with_syntax_rules(modification_syntax_rules, [row['sequence_position']], [], gene)
 
     # Extract the matched and unmatched elements
-    match_groups: list[tuple[re.Match, SyntaxRule]] = list(filter(lambda x: type(x) != str, result))
+    match_groups: list[tuple[re.Match, CompiledSyntaxRule]] = list(filter(lambda x: type(x) != str, result))
     # The regex excludes non-digit non-letter characters
     unmatched = list(filter(lambda x: type(x) == str and not re.match('^[^a-zA-Z\d]+$', x), result))
 
@@ -118,6 +127,15 @@ def check_func(row, genome, allowed_mod_dict):
 
 
 if __name__ == "__main__":
+    class Formatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter):
+        pass
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=Formatter)
+    parser.add_argument('--genome_diff', default=None, help='input (optional): changes between genome builds (see genome_diff.py)')
+    parser.add_argument('--output_format', nargs='+', choices=output_formats, default=['tsv'], help='format(s) of the output files, the columnar formats (see results_io.py) are written next to them with a different extension')
+    args = parser.parse_args()
+    check_output_formats(args.output_format)
+
     with open('data/genome.pickle', 'rb') as ins:
         genome = pickle.load(ins)
 
@@ -128,15 +146,25 @@ if __name__ == "__main__":
     data.columns = ['systematic_id', 'primary_name', 'modification', 'evidence', 'sequence_position', 'annotation_extension', 'reference', 'taxon', 'date']
     data = data[data['sequence_position'] != '']
 
-    extra_cols = data.apply(check_func, axis=1, result_type='expand', args=[genome, allowed_mod_dict])
-    data.loc[:, 'sequence_error'] = extra_cols.loc[:, 0]
-    data.loc[:, 'change_sequence_position_to'] = extra_cols.loc[:, 1]
+    data_to_check = data
+    extra_cols = pandas.DataFrame(columns=[0, 1])
+    if args.genome_diff is not None:
+        previous_results = read_results('results/protein_modification_results.tsv', dtype=str)
+        data_to_check, extra_cols = split_by_previous_results(data.astype(str), previous_results, list(data.columns), ['sequence_error', 'change_sequence_position_to'], read_affected_systematic_ids(args.genome_diff))
+        data_to_check = data.loc[data_to_check.index]
+        extra_cols.columns = [0, 1]
+        print(f'{len(data_to_check)} modifications checked, {len(extra_cols)} copied from results/protein_modification_results.tsv')
+
+    if len(data_to_check):
+        extra_cols = pandas.concat([data_to_check.apply(check_func, axis=1, result_type='expand', args=[genome, allowed_mod_dict]), extra_cols])
+    data.loc[:, 'sequence_error'] = extra_cols.loc[data.index, 0]
+    data.loc[:, 'change_sequence_position_to'] = extra_cols.loc[data.index, 1]
     # data.loc[:, ['sequence_error', 'change_sequence_position_to']] = data.apply(check_func, axis=1, result_type='expand')
     data.sort_values(['systematic_id', 'sequence_position'], inplace=True)
-    data.to_csv('results/protein_modification_results.tsv', sep='\t', index=False)
+    write_results(data, 'results/protein_modification_results.tsv', args.output_format)
 
     error_data = data[(data['sequence_error'] != '') | (data['change_sequence_position_to'] != '')].copy()
-    error_data.to_csv('results/protein_modification_results_errors.tsv', sep='\t', index=False)
+    write_results(error_data, 'results/protein_modification_results_errors.tsv', args.output_format)
 
     # Aggregate the errors
     sequence_error_data = error_data[~error_data['sequence_error'].isin(['', 'pattern_error', 'not_protein_gene', 'residue_not_allowed'])].copy()
@@ -150,4 +178,4 @@ if __name__ == "__main__":
     sequence_error_data.loc[:, 'sorting_col'] = sequence_error_data['sequence_position'].apply(lambda x: int(x[1:]))
     sequence_error_data.sort_values('sorting_col', inplace=True)
     aggregated_sequence_error_data = sequence_error_data[['systematic_id', 'reference', 'sequence_position', 'sequence_error']].drop_duplicates().groupby(['systematic_id', 'reference'], as_index=False).agg({'sequence_position': ','.join, 'sequence_error': lambda x: '|'.join(x) if any(x) else ''})
-    aggregated_sequence_error_data.to_csv('results/protein_modification_results_errors_aggregated.tsv', sep='\t', index=False)
+    write_results(aggregated_sequence_error_data, 'results/protein_modification_results_errors_aggregated.tsv', args.output_format)
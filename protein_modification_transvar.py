@@ -1,5 +1,6 @@
 """
-Uses transvar to represent the modification positions in standard genomic coordinates.
+Uses transvar to represent the modification positions in standard genomic coordinates. The positions are
+annotated from the genome when possible, with the same format (see native_transvar.py).
 
 Removes all lines with sequence errors.
 
@@ -9,7 +10,10 @@ import pandas
 import pickle
 import argparse
 from transvar_functions import parse_transvar_string, get_transvar_str_annotation, get_anno_db, TransvarAnnotation
+from native_transvar import get_protein_variant_coordinates, NativeAnnotationError
 from genome_functions import process_systematic_id
+from genome_diff import read_affected_systematic_ids, split_by_previous_results
+from results_io import output_formats, check_output_formats, read_results, write_results
 from tqdm import tqdm
 
 tqdm.pandas()
@@ -57,6 +61,12 @@ def get_transvar_coordinates(row, db, genome, exclude_transcripts):
     qc_id = process_systematic_id(row['systematic_id'], genome, 'first')
     transcript_id = None if (qc_id == row['systematic_id']) else qc_id
 
+    # Positions are annotated from the genome, transvar is used for the cases that are not supported
+    try:
+        return get_protein_variant_coordinates(row['transvar_input'].split(':', 1)[1], genome[qc_id])
+    except NativeAnnotationError:
+        pass
+
     try:
         transvar_annotation_list = parse_transvar_string(get_transvar_str_annotation('panno', row['transvar_input'], db))
         return get_transvar_annotation_coordinates(transvar_annotation_list, row['systematic_id'], transcript_id)
@@ -67,7 +77,7 @@ def get_transvar_coordinates(row, db, genome, exclude_transcripts):
             raise e
 
 
-def main(genome_file, protein_modification_results_file, exclude_transcripts_file, output_file):
+def main(genome_file, protein_modification_results_file, exclude_transcripts_file, output_file, genome_diff_file=None, formats=('tsv',)):
 
     with open(genome_file, 'rb') as ins:
         genome = pickle.load(ins)
@@ -75,7 +85,7 @@ def main(genome_file, protein_modification_results_file, exclude_transcripts_fil
     with open(exclude_transcripts_file) as ins:
         exclude_transcripts = set(map(str.strip, ins.readlines()))
 
-    data = pandas.read_csv(protein_modification_results_file, sep='\t', na_filter=False)
+    data = read_results(protein_modification_results_file)
 
     # Remove sequence errors
     data = data[data['sequence_error'] == ''].copy()
@@ -87,12 +97,29 @@ def main(genome_file, protein_modification_results_file, exclude_transcripts_fil
     # Expand CTD abbreviations
     data['exploded_sequence_position'] = data['sequence_position'].apply(expand_CTD_abbreviations)
 
+    aggregation_columns = ['systematic_id', 'sequence_position']
+
+    # Re-use the coordinates of the previous output for the genes not affected by genome changes
+    data_to_process = data
+    previous_coordinates = pandas.DataFrame(columns=aggregation_columns + ['transvar_coordinates'])
+    if genome_diff_file is not None:
+        previous_results = read_results(output_file, dtype=str)
+        data_to_process, previous_transvar_coordinates = split_by_previous_results(data, previous_results, aggregation_columns, ['transvar_coordinates'], read_affected_systematic_ids(genome_diff_file))
+        previous_coordinates = pandas.concat([data.loc[previous_transvar_coordinates.index, aggregation_columns], previous_transvar_coordinates], axis=1)
+        print(f'{len(data_to_process)} modifications processed, {len(previous_coordinates)} copied from {output_file}')
+
     # Explode the sequence_position and the rules_applied
-    data_exploded = data[['systematic_id', 'sequence_position', 'exploded_sequence_position']].copy()
+    data_exploded = data_to_process[['systematic_id', 'sequence_position', 'exploded_sequence_position']].copy()
     data_exploded.drop_duplicates(inplace=True)
     data_exploded.loc[:, 'exploded_sequence_position'] = data_exploded['exploded_sequence_position'].apply(str.split, args=[','])
     data_exploded = data_exploded.explode(['exploded_sequence_position'])
 
+    if len(data_exploded) == 0:
+        data = data.merge(previous_coordinates.drop_duplicates(aggregation_columns), on=aggregation_columns, how='left')
+        data.drop(columns=['exploded_sequence_position'], inplace=True)
+        write_results(data, output_file, formats)
+        return
+
     # Apply transvar syntax to each sequence position
     data_exploded['transvar_input'] = data_exploded.apply(format_for_transvar, axis=1, args=(genome,))
 
@@ -100,11 +127,13 @@ def main(genome_file, protein_modification_results_file, exclude_transcripts_fil
     print('Running transvar on protein modifications... (will take a while)')
     data_exploded['transvar_coordinates'] = data_exploded.progress_apply(get_transvar_coordinates, args=(anno_db, genome, exclude_transcripts), axis=1)
 
-    aggregated_data = data_exploded.groupby(['systematic_id', 'sequence_position'], as_index=False).agg({'transvar_coordinates': '|'.join})
+    aggregated_data = data_exploded.groupby(aggregation_columns, as_index=False).agg({'transvar_coordinates': '|'.join})
+    if len(previous_coordinates):
+        aggregated_data = pandas.concat([aggregated_data, previous_coordinates]).drop_duplicates(aggregation_columns)
 
-    data = data.merge(aggregated_data, on=['systematic_id', 'sequence_position'], how='left')
+    data = data.merge(aggregated_data, on=aggregation_columns, how='left')
     data.drop(columns=['exploded_sequence_position'], inplace=True)
-    data.to_csv(output_file, sep='\t', index=False)
+    write_results(data, output_file, formats)
 
 
 if __name__ == '__main__':
@@ -116,7 +145,10 @@ if __name__ == '__main__':
     parser.add_argument('--protein_modification_results', default='results/protein_modification_results.tsv', help='output of protein_modification_qc.py')
     parser.add_argument('--exclude_transcripts', default='data/frame_shifted_transcripts.tsv', help='transcripts to exclude from transvar because they are known to be problematic')
     parser.add_argument('--output', default='results/protein_modification_results_transvar.tsv', help='output file')
+    parser.add_argument('--output_format', nargs='+', choices=output_formats, default=['tsv'], help='format(s) of the output file, the columnar formats (see results_io.py) are written next to it with a different extension')
+    parser.add_argument('--genome_diff', default=None, help='changes between genome builds (see genome_diff.py), only the modifications of affected genes or not in the existing --output file are processed again')
 
     args = parser.parse_args()
-    main(args.genome, args.protein_modification_results, args.exclude_transcripts, args.output)
+    check_output_formats(args.output_format)
+    main(args.genome, args.protein_modification_results, args.exclude_transcripts, args.output, args.genome_diff, args.output_format)
 
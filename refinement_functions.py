@@ -1,5 +1,6 @@
 import re
-from models import SyntaxRule
+import json
+from models import SyntaxRule, CompiledSyntaxRule
 from typing import Union
 
 
@@ -18,7 +19,7 @@ def replace_substring_by_match_group(input_str: str, match_group: tuple[re.Match
     return list(filter(lambda x: x != '', this_list))
 
 
-def replace_allele_features_with_syntax_rules(syntax_rules: list[SyntaxRule], input_list: list[str, re.Match], match_groups: list[tuple[re.Match, SyntaxRule]], gene: dict) -> list[Union[str, tuple[re.Match, SyntaxRule]]]:
+def replace_allele_features_with_syntax_rules(syntax_rules: list[Union[SyntaxRule, CompiledSyntaxRule]], input_list: list[str, re.Match], match_groups: list[tuple[re.Match, SyntaxRule]], gene: dict) -> list[Union[str, tuple[re.Match, SyntaxRule]]]:
     """
     Looks for matches to the regex patterns in `regex_patterns` in the strings in `input_list`,
     if `matches` is an empty list. If `matches` is not empty, it uses those matches.
@@ -48,7 +49,7 @@ def replace_allele_features_with_syntax_rules(syntax_rules: list[SyntaxRule], in
         # If matches are not provided, we find them with regex, not only the match, but also we check the syntax rule further_check function.
         if len(match_groups) == 0:
             for syntax_rule in syntax_rules:
-                match_groups += [(match, syntax_rule) for match in re.finditer(syntax_rule.regex, allele_substring) if syntax_rule.further_check(match.groups(), gene)]
+                match_groups += [(match, syntax_rule) for match in syntax_rule.pattern.finditer(allele_substring) if syntax_rule.further_check(match.groups(), gene)]
             # We sort the matches, to replace the longest matching ones first.
             match_groups.sort(key=lambda match_group: len(match_group[0].group()), reverse=True)
 
@@ -92,12 +93,28 @@ def get_allele_parts_from_result(result):
     return allele_parts
 
 
-def check_allele_description(allele_description, syntax_rules: list[SyntaxRule], allele_type, allowed_types, gene):
+def check_allele_description(allele_description, syntax_rules: list[Union[SyntaxRule, CompiledSyntaxRule]], allele_type, allowed_types, gene):
     """
     Use replace_allele_features to identify patterns based on syntax rules, then validate
     the content of those patterns based on the grammar rules, and return output. See the
     example from test_data/allele_expected_results.tsv
     """
+    return check_and_parse_allele_description(allele_description, syntax_rules, allele_type, allowed_types, gene)[0]
+
+
+def check_and_parse_allele_description(allele_description, syntax_rules: list[Union[SyntaxRule, CompiledSyntaxRule]], allele_type, allowed_types, gene) -> tuple[dict, list[dict]]:
+    """
+    Same as check_allele_description, but also returns the parsed allele parts, in the same order as `allele_parts`
+    (empty if there is a pattern_error), as dictionaries:
+
+    {
+        'part': 'v123a',                                # the substring of allele_description
+        'rule': 'amino_acid_mutation:single_aa',        # type:rule_name of the syntax rule that matched
+        'groups': ['v', '123', 'a'],                    # the capture groups of the regex
+        'span': [0, 5],                                 # the position of the part in allele_description
+        'formatted': 'V123A'                            # the output of the apply_syntax of the rule
+    }
+    """
 
     result = replace_allele_features_with_syntax_rules(syntax_rules, [allele_description], [], gene)
     allele_parts = get_allele_parts_from_result(result)
@@ -120,13 +137,13 @@ def check_allele_description(allele_description, syntax_rules: list[SyntaxRule],
 
     if len(unmatched):
         output_dict['pattern_error'] = ','.join(unmatched)
-        return output_dict
+        return output_dict, []
 
     # Very special case, in which the allele description contains no alphanumeric characters
     # and therefore both matches and unmatched are empty (see sort_result function)
     if len(match_groups) == 0:
         output_dict['pattern_error'] = allele_description
-        return output_dict
+        return output_dict, []
 
     # By default empty strings
     allele_part_types = ['' for m in match_groups]
@@ -161,7 +178,51 @@ def check_allele_description(allele_description, syntax_rules: list[SyntaxRule],
     must_be_empty = ['pattern_error', 'invalid_error', 'sequence_error', 'change_description_to', 'change_type_to']
     output_dict['needs_fixing'] = any(output_dict[key] for key in must_be_empty)
 
-    return output_dict
+    parsed_parts = list()
+    for i, match_group in enumerate(match_groups):
+        match = match_group[0]
+        parsed_parts.append({'part': match.group(), 'rule': rules_applied[i], 'groups': list(match.groups()), 'span': list(match.span()), 'formatted': correct_name_list[i]})
+
+    return output_dict, parsed_parts
+
+
+def parsed_parts_key(row) -> tuple[str, str, str, str]:
+    """Key of an allele in the parsed parts file (the allele name is included, since it determines the transcript)."""
+    return row['systematic_id'], row['allele_name'], row['allele_description'], row['allele_type']
+
+
+def write_parsed_parts(parsed_parts_file: str, parsed_parts: dict[tuple[str, str, str, str], list[dict]]):
+    """
+    Write the parsed parts of the alleles (see check_and_parse_allele_description) as JSON Lines, one line per
+    allele, with the keys of parsed_parts_key and `parts`.
+    """
+    with open(parsed_parts_file, 'w') as out:
+        for key, parts in parsed_parts.items():
+            if len(parts):
+                out.write(json.dumps(dict(zip(['systematic_id', 'allele_name', 'allele_description', 'allele_type'], key)) | {'parts': parts}) + '\n')
+
+
+def read_parsed_parts(parsed_parts_file: str) -> dict[tuple[str, str, str, str], list[dict]]:
+    """Opposite of write_parsed_parts."""
+    parsed_parts = dict()
+    with open(parsed_parts_file) as ins:
+        for line in ins:
+            entry = json.loads(line)
+            parsed_parts[parsed_parts_key(entry)] = entry['parts']
+    return parsed_parts
+
+
+def get_parsed_capture_groups(row, parsed_parts: dict[tuple[str, str, str, str], list[dict]]) -> list[tuple]:
+    """
+    The capture groups of each of the `allele_parts` of a row of the allele_qc.py output, from the parsed parts. If the
+    allele is missing from the parsed parts, or they don't match `allele_parts` and `rules_applied` (e.g. the file comes
+    from a different run), a list of None is returned, and the groups should be obtained with the regex instead.
+    """
+    allele_parts = row['allele_parts'].split('|')
+    parts = parsed_parts.get(parsed_parts_key(row), [])
+    if [p['part'] for p in parts] != allele_parts or [p['rule'] for p in parts] != row['rules_applied'].split('|'):
+        return [None] * len(allele_parts)
+    return [tuple(p['groups']) for p in parts]
 
 
 def seq_error_change_description_to(allele_name, sequence_error):
@@ -190,8 +251,12 @@ def seq_error_change_description_to(allele_name, sequence_error):
 
 def split_multiple_aa(value, regex):
     """Split into single variants: VLP123AAA => ['V123A', 'L124A', 'P125A']"""
-    groups = re.match(regex, value).groups()
-    return [f'{aa1}{int(groups[1])+i}{aa2}' for i, (aa1, aa2) in enumerate(zip(groups[0], groups[2]))]
+    return split_multiple_aa_groups(re.match(regex, value).groups())
+
+
+def split_multiple_aa_groups(groups):
+    """Same as split_multiple_aa, from the capture groups: ('VLP', '123', 'AAA') => ['V123A', 'L124A', 'P125A']"""
+    return [f'{aa1}{int(groups[1])+i}{aa2}' for i, (aa1, aa2) in enumerate(zip(groups[0].upper(), groups[2].upper()))]
 
 
 def join_multiple_aa(values):
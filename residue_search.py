@@ -0,0 +1,102 @@
+"""
+Find which protein a list of residues (e.g. `S103,S107,T106`) belongs to, in the current genome or in previous versions
+of the gene structures (old alignments in coordinate_changes_dict.json). This is how curators resolve alleles or
+modifications attached to the wrong gene.
+
+All peptides are concatenated into a single numpy array, with the offset and length of each peptide, so checking a
+residue position in all peptides is a single vectorised lookup, and a search takes a few milliseconds.
+"""
+import re
+import numpy
+from typing import NamedTuple
+
+# The residues that are considered equivalent when st_equivalent is True
+st_residues = numpy.frombuffer(b'ST', dtype=numpy.uint8)
+
+
+class ResidueSearchMatch(NamedTuple):
+    systematic_id: str
+    # Empty string for the current genome
+    revision: str
+    # The residues of the query that are not present in the peptide (or outside of it)
+    mismatches: list[str]
+
+
+def parse_residues(residues: str) -> list[tuple[str, int]]:
+    """
+    Parse a list of residues like `S103,S107,T106` into sorted, unique (residue, zero-based index) tuples.
+    """
+    out = set()
+    for r in residues.split(','):
+        r = r.strip().upper()
+        if not re.fullmatch(r'[A-Z]\d+', r) or int(r[1:]) == 0:
+            raise ValueError(f'Invalid residue: {r}, residues should be in the form S103')
+        out.add((r[0], int(r[1:]) - 1))
+    return sorted(out, key=lambda x: (x[1], x[0]))
+
+
+class ResidueIndex:
+    """
+    Index of current and past peptides, see the docstring of the module.
+    """
+
+    def __init__(self, peptides: list[tuple[str, str, str]]):
+        """peptides is a list of (systematic_id, revision, peptide) tuples, revision is an empty string for the current genome."""
+        self.systematic_ids = [p[0] for p in peptides]
+        self.revisions = [p[1] for p in peptides]
+        self.lengths = numpy.array([len(p[2]) for p in peptides], dtype=numpy.int64)
+        self.offsets = numpy.zeros(len(peptides), dtype=numpy.int64)
+        numpy.cumsum(self.lengths[:-1], out=self.offsets[1:])
+        self.sequence = numpy.frombuffer(''.join(p[2] for p in peptides).encode(), dtype=numpy.uint8)
+
+    def __len__(self):
+        return len(self.systematic_ids)
+
+    def mismatch_matrix(self, residues: list[tuple[str, int]], st_equivalent: bool = False) -> numpy.ndarray:
+        """Boolean matrix of len(residues) x len(self), True where the residue is not in the peptide, or the position is outside of it."""
+        out = numpy.ones((len(residues), len(self)), dtype=bool)
+        for i, (residue, index) in enumerate(residues):
+            in_peptide = self.lengths > index
+            values = self.sequence[self.offsets[in_peptide] + index]
+            if st_equivalent and residue in 'ST':
+                out[i, in_peptide] = ~numpy.isin(values, st_residues)
+            else:
+                out[i, in_peptide] = values != ord(residue)
+        return out
+
+    def search(self, residues: list[tuple[str, int]], st_equivalent: bool = False, max_mismatches: int = 0) -> list[ResidueSearchMatch]:
+        """
+        Peptides that contain the residues, with at most max_mismatches residues missing, sorted by number of mismatches.
+        """
+        if len(residues) == 0:
+            return []
+        mismatch_matrix = self.mismatch_matrix(residues, st_equivalent)
+        nb_mismatches = mismatch_matrix.sum(axis=0)
+        # Stable sort, so that matches with the same number of mismatches keep the order of the index
+        hits = numpy.flatnonzero(nb_mismatches <= max_mismatches)
+        hits = hits[numpy.argsort(nb_mismatches[hits], kind='stable')]
+        return [
+            ResidueSearchMatch(
+                self.systematic_ids[i],
+                self.revisions[i],
+                [f'{residues[j][0]}{residues[j][1] + 1}' for j in numpy.flatnonzero(mismatch_matrix[:, i])]
+            )
+            for i in hits
+        ]
+
+
+def build_residue_index(genome: dict, coordinate_changes_dict: dict) -> ResidueIndex:
+    """Index the peptides in the genome, and the old peptides in coordinate_changes_dict."""
+    peptides = [(systematic_id, '', str(genome[systematic_id]['peptide'])) for systematic_id in genome if 'peptide' in genome[systematic_id]]
+    for systematic_id in coordinate_changes_dict:
+        for revision in coordinate_changes_dict[systematic_id]:
+            peptides.append((systematic_id, revision['revision'], revision['old_alignment'].replace('-', '')))
+    return ResidueIndex(peptides)
+
+
+def find_protein_by_residues(residues: str, index: ResidueIndex, st_equivalent: bool = False, max_mismatches: int = 0) -> list[ResidueSearchMatch]:
+    """
+    Find the current or past peptides that contain the residues (e.g. `S103,S107,T106`), see ResidueIndex.search.
+    If st_equivalent is True, S and T in the residues match either S or T in the peptide.
+    """
+    return index.search(parse_residues(residues), st_equivalent, max_mismatches)
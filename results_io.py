@@ -0,0 +1,91 @@
+"""
+Reading and writing of the results files (allele_results.tsv, allele_results_transvar.tsv, protein_modification_results.tsv,
+the auto-fix outputs, etc.).
+
+The results are always written as TSV by default, but they can also (or instead) be written as typed columnar files
+(Parquet or Feather, requires pyarrow), with the same path and a different extension. In the columnar files:
+
+* The column types are those that pandas.read_csv(..., sep='\t', na_filter=False) would infer from the TSV, so e.g.
+  `needs_fixing` is a boolean column.
+* The `|`-separated columns with one value per allele part or position (see list_columns) are list columns, e.g.
+  `E325A|G338D` is stored as `['E325A', 'G338D']`.
+
+read_results reads the columnar file if present (and not older than the TSV), and returns the same dataframe that reading
+the TSV would.
+"""
+import importlib.util
+import io
+import os
+import pandas
+
+output_formats = ['tsv', 'parquet', 'feather']
+
+# Columns where the values are joined by `|`, stored as list columns in the columnar formats
+list_columns = ['allele_parts', 'rules_applied', 'sequence_error', 'transvar_coordinates']
+
+
+def results_file_path(tsv_file: str, output_format: str) -> str:
+    """Path of the results file in the given format, e.g. results/allele_results.parquet for parquet."""
+    if output_format == 'tsv':
+        return tsv_file
+    return os.path.splitext(tsv_file)[0] + '.' + output_format
+
+
+def check_output_formats(formats: list[str]):
+    """Raise an error before running the analysis if a columnar format is requested, but pyarrow is not installed."""
+    for output_format in formats:
+        if output_format not in output_formats:
+            raise ValueError(f'Unknown output format: {output_format}')
+        if output_format != 'tsv' and importlib.util.find_spec('pyarrow') is None:
+            raise ImportError(f'pyarrow is required for the {output_format} output format, install it with `pip install pyarrow`')
+
+
+def to_columnar(data: pandas.DataFrame) -> pandas.DataFrame:
+    """Typed version of data for the columnar formats, see the docstring of this module."""
+    # Infer the types the same way as when reading the TSV
+    typed_data = pandas.read_csv(io.StringIO(data.to_csv(sep='\t', index=False)), sep='\t', na_filter=False)
+    for col in list_columns:
+        if col in typed_data.columns and typed_data[col].dtype == object:
+            typed_data[col] = typed_data[col].apply(lambda x: [] if x == '' else x.split('|'))
+    return typed_data
+
+
+def from_columnar(data: pandas.DataFrame) -> pandas.DataFrame:
+    """Opposite of to_columnar."""
+    for col in list_columns:
+        if col in data.columns:
+            data[col] = data[col].apply(lambda x: x if isinstance(x, str) else '|'.join(x))
+    return data
+
+
+def write_results(data: pandas.DataFrame, tsv_file: str, formats: list[str] = ('tsv',)):
+    """Write data to tsv_file, and / or the equivalent columnar files (see results_file_path)."""
+    if 'tsv' in formats:
+        data.to_csv(tsv_file, sep='\t', index=False)
+    columnar_formats = [f for f in formats if f != 'tsv']
+    if len(columnar_formats) == 0:
+        return
+    typed_data = to_columnar(data)
+    for output_format in columnar_formats:
+        if output_format == 'parquet':
+            typed_data.to_parquet(results_file_path(tsv_file, output_format), index=False)
+        elif output_format == 'feather':
+            typed_data.to_feather(results_file_path(tsv_file, output_format))
+
+
+def read_results(tsv_file: str, dtype=None) -> pandas.DataFrame:
+    """
+    Read a file written by write_results, preferring the columnar files if they are present and not older than the TSV
+    (and pyarrow is installed). If dtype is str, all columns are returned as strings, like pandas.read_csv(..., dtype=str).
+    """
+    if importlib.util.find_spec('pyarrow') is not None:
+        tsv_mtime = os.path.getmtime(tsv_file) if os.path.isfile(tsv_file) else None
+        for output_format in ['parquet', 'feather']:
+            columnar_file = results_file_path(tsv_file, output_format)
+            if not os.path.isfile(columnar_file) or (tsv_mtime is not None and os.path.getmtime(columnar_file) < tsv_mtime):
+                continue
+            data = pandas.read_parquet(columnar_file) if output_format == 'parquet' else pandas.read_feather(columnar_file)
+            data = from_columnar(data)
+            return data.astype(str) if dtype is str else data
+
+    return pandas.read_csv(tsv_file, sep='\t', na_filter=False, dtype=dtype)
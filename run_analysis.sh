@@ -8,6 +8,9 @@ python protein_modification_auto_fix.py
 python protein_modification_transvar.py
 
 # Check and fix allele descriptions, types and names
-python allele_qc.py
-python allele_auto_fix.py
-python allele_transvar.py
+python allele_qc.py --parsed_parts results/allele_parsed_parts.jsonl
+python allele_auto_fix.py --parsed_parts results/allele_parsed_parts.jsonl
+python allele_transvar.py --parsed_parts results/allele_parsed_parts.jsonl
+
+# Optional: candidate genes for the sequence errors that could not be fixed (e.g. alleles attached to a paralog)
+python gene_reassignment.py
@@ -27,6 +27,7 @@ python allele_auto_fix.py --genome data/sgd/genome.pickle\
 #     --output results/sgd/description_name/allele_description_name_transvar.tsv\
 #     --genome_fasta data/sgd/genome_sequence.fsa\
 #     --transvardb data/sgd/features.gtf.transvardb\
+#     --config data/sgd/config.sgd.json\
 #     --sgd_mode True
 
 # python allele_transvar.py\
@@ -36,6 +37,7 @@ python allele_auto_fix.py --genome data/sgd/genome.pickle\
 #     --output results/sgd/description_semicolon/allele_description_semicolon_transvar.tsv\
 #     --genome_fasta data/sgd/genome_sequence.fsa\
 #     --transvardb data/sgd/features.gtf.transvardb\
+#     --config data/sgd/config.sgd.json\
 #     --sgd_mode True
 
 # Temporary removal of type_fix cases
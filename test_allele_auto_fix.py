@@ -0,0 +1,35 @@
+import unittest
+import os
+import tempfile
+import io
+import pandas
+from contextlib import redirect_stdout
+from allele_auto_fix import main, get_allele_mutations, aggregate_mutations_by_reference
+
+
+class AlleleAutoFixTest(unittest.TestCase):
+
+    def test_get_allele_mutations(self):
+        data_subset = pandas.DataFrame({
+            'systematic_id': ['SPMTR.02', 'SPMTR.02'],
+            'allele_description': ['v123a,VP20AA', 'A5V'],
+            'allele_name': ['x1', 'x2'],
+            'reference': ['PMID:1,PMID:2', 'PMID:1'],
+            'change_description_to': ['V123A,VP20AA', ''],
+            'rules_applied': ['amino_acid_mutation:single_aa|amino_acid_mutation:multiple_aa', 'amino_acid_mutation:single_aa'],
+            'sequence_error': ['|P21', ''],
+        })
+        allele_mutations = get_allele_mutations(data_subset, [[None, None], [None]], r'([A-Z]+)(\d+)([A-Z]+)')
+        self.assertEqual([m[7] for m in allele_mutations if m[3] == 'PMID:1'], ['A5V', 'V20A', 'P21A', 'V123A'])
+        self.assertEqual(allele_mutations[1], ('SPMTR.02', 'V123A,VP20AA', 'x1', 'PMID:1', 'amino_acid_mutation:multiple_aa', 'P21', 'VP20AA', 'V20A'))
+        self.assertEqual(aggregate_mutations_by_reference(allele_mutations), {('SPMTR.02', 'PMID:1'): 'A5V,V20A,P21A,V123A', ('SPMTR.02', 'PMID:2'): 'V20A,P21A,V123A'})
+
+    def test_allele_auto_fix(self):
+        # The expected files are the outputs of the previous implementation based on pandas explode / groupby / merge
+        for parsed_parts_file in [None, 'test_data/allele_auto_fix/allele_parsed_parts.jsonl']:
+            with tempfile.TemporaryDirectory() as output_dir:
+                with redirect_stdout(io.StringIO()):
+                    main('data/genome.pickle', 'data/coordinate_changes_dict.json', 'test_data/allele_auto_fix/allele_results.tsv', output_dir, parsed_parts_file)
+                for f in ['allele_auto_fix.tsv', 'allele_cannot_fix_sequence_errors.tsv', 'allele_cannot_fix_other_errors.tsv']:
+                    with open(os.path.join(output_dir, f)) as ins, open(f'test_data/allele_auto_fix/expected_{f}') as expected:
+                        self.assertEqual(ins.read(), expected.read(), f)
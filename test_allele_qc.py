@@ -1,5 +1,6 @@
 import unittest
 from allele_qc import handle_systematic_id_for_allele_qc
+from genome_functions import build_transcript_index, process_systematic_id
 import pickle
 
 
@@ -20,5 +21,17 @@ class HandleSystematicIdTest(unittest.TestCase):
         row = {'systematic_id': 'SPBC1198.04c', 'allele_name': 'zas1-A1V'}
         self.assertEqual(handle_systematic_id_for_allele_qc(row['systematic_id'], row['allele_name'], genome), 'SPBC1198.04c.1')
 
+    def test_transcript_index(self):
 
+        transcript_index = build_transcript_index(genome)
+        entry = transcript_index['SPBC1198.04c']
+        self.assertEqual(entry.transcripts, ('SPBC1198.04c.1', 'SPBC1198.04c.2'))
+        self.assertEqual(entry.first, 'SPBC1198.04c.1')
+        self.assertEqual(entry.primary_name, 'zas1')
+        self.assertNotIn('SPBC1198.04c.1', transcript_index)
 
+        # Should give the same result with or without the index (genome as a plain dictionary)
+        for when_several_transcripts in ['first', 'longest']:
+            self.assertEqual(process_systematic_id('SPAC22A12.08c', genome, when_several_transcripts), process_systematic_id('SPAC22A12.08c', dict(genome), when_several_transcripts))
+        self.assertEqual(process_systematic_id('SPAC22A12.08c', genome, 'longest'), 'SPAC22A12.08c.1')
+        self.assertRaises(ValueError, process_systematic_id, 'dummy', genome, 'first')
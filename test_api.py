@@ -1,5 +1,6 @@
 from api import app, CheckAlleleDescriptionResponse, CheckModificationResponse, AlleleFix, OldCoordsFix
 from fastapi.testclient import TestClient
+import os
 import unittest
 
 client = TestClient(app)
@@ -29,6 +30,27 @@ class GetGenomeRegionTest(unittest.TestCase):
         response = client.get("/genome_region", params={'systematic_id': 'dummy', 'upstream': 0, 'downstream': 0, 'format': 'fasta'})
         self.assertEqual(response.status_code, 404)
 
+    def test_etag(self):
+        params = {'systematic_id': 'SPAPB1A10.09', 'upstream': 0, 'downstream': 0, 'format': 'fasta'}
+        response = client.get("/genome_region", params=params)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['etag']
+
+        # Not modified
+        response = client.get("/genome_region", params=params, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        # Different query
+        response = client.get("/genome_region", params={**params, 'upstream': 10}, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['etag'], etag)
+
+        # Any version of an existing gene, but not of a gene that does not exist
+        response = client.get("/genome_region", params=params, headers={'If-None-Match': '*'})
+        self.assertEqual(response.status_code, 304)
+        response = client.get("/genome_region", params={**params, 'systematic_id': 'dummy'}, headers={'If-None-Match': '*'})
+        self.assertEqual(response.status_code, 404)
+
 
 # test /check_allele endpoint from api.py
 class CheckAlleleTest(unittest.TestCase):
@@ -200,6 +222,85 @@ class ResidueAtPositionTest(unittest.TestCase):
             self.assertEqual(response.status_code, 200)
             self.assertEqual(response.text, res)
 
+    def test_ranges(self):
+        # Same sequences as above, in a single request
+        response = client.get("/residues_at_positions", params={'systematic_id': 'SPAPB1A10.09', 'positions': '1-10,-12--1,2', 'dna_or_protein': 'dna'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['sequence'] for r in response.json()], ['ATGCAAACAG', 'TCAACCGGTTCA', 'T'])
+
+        response = client.get("/residues_at_positions", params={'systematic_id': 'SPAPB1A10.10c', 'positions': '-16-12', 'dna_or_protein': 'dna'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{'positions': '-16-12', 'sequence': 'GACAGAATATACTTCAATGTCGGCTCAG'}])
+
+        response = client.get("/residues_at_positions", params={'systematic_id': 'SPAPB1A10.09', 'positions': '1,1-3', 'dna_or_protein': 'protein'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['sequence'] for r in response.json()], ['M', 'MQT'])
+
+        response = client.get("/residues_at_positions", params={'systematic_id': 'SPAPB1A10.09', 'positions': '3-1', 'dna_or_protein': 'protein'})
+        self.assertEqual(response.status_code, 422)
+
+        response = client.get("/residues_at_positions", params={'systematic_id': 'SPAPB1A10.09', 'positions': '1-100000', 'dna_or_protein': 'protein'})
+        self.assertEqual(response.status_code, 400)
+
+
+class FindProteinByResiduesTest(unittest.TestCase):
+
+    def test_find_protein(self):
+        # First residues of SPAPB1A10.09
+        response = client.get("/find_protein_by_residues", params={'residues': 'M1,Q2,T3'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn({'systematic_id': 'SPAPB1A10.09', 'revision': '', 'mismatches': []}, response.json())
+
+        response = client.get("/find_protein_by_residues", params={'residues': 'M1,Q2,S3', 'st_equivalent': True, 'max_mismatches': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['mismatches'], [])
+
+        response = client.get("/find_protein_by_residues", params={'residues': 'M1,2'})
+        self.assertEqual(response.status_code, 422)
+
+
+class PrimerGenomeTest(unittest.TestCase):
+
+    def test_primer_genome(self):
+        # First nucleotides of the CDS of SPAPB1A10.09
+        response = client.get("/primer_genome", params={'primer': 'ATGCAAACAG', 'max_mismatch': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('SPAPB1A10.09', [g['systematic_id'] for hit in response.json() for g in hit['genes']])
+
+        response = client.get("/primer_genome", params={'primer': 'ATGNNN', 'max_mismatch': 0})
+        self.assertEqual(response.status_code, 422)
+
+        # Too many mismatches for the length of the primer
+        response = client.get("/primer_genome", params={'primer': 'ATGCAAACAG', 'max_mismatch': 1})
+        self.assertEqual(response.status_code, 422)
+
+
+class MutantProteinSequenceTest(unittest.TestCase):
+
+    def test_mutant_protein_sequence(self):
+        response = client.get("/mutant_protein_sequence", params={'systematic_id': 'SPBC359.03c', 'allele_description': 'A3V,SEA23PPP', 'allele_type': 'amino_acid_mutation', 'allele_name': 'blah'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text[2], 'V')
+        self.assertEqual(response.text[22:25], 'PPP')
+        self.assertTrue(response.text.endswith('*'))
+
+        response = client.get("/mutant_protein_sequence", params={'systematic_id': 'SPBC359.03c', 'allele_description': 'V3A', 'allele_type': 'amino_acid_mutation'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_mutant_protein_sequences(self):
+        alleles = [
+            {'systematic_id': 'SPBC359.03c', 'allele_description': 'A3V', 'allele_type': 'amino_acid_mutation'},
+            {'systematic_id': 'dummy', 'allele_description': 'A3V', 'allele_type': 'amino_acid_mutation'},
+        ]
+        response = client.post("/mutant_protein_sequences", json=alleles)
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual(results[0]['sequence'][2], 'V')
+        self.assertEqual(results[0]['error'], '')
+        self.assertEqual(results[1]['sequence'], '')
+        self.assertNotEqual(results[1]['error'], '')
+
+
 class TransvarEntryPointsTest(unittest.TestCase):
 
     def test_allele_entrypoint(self):
@@ -232,3 +333,30 @@ class TransvarEntryPointsTest(unittest.TestCase):
         response = client.get('/canno', params={'variant_description': 'SPAC3F10.09:c.5A>T'})
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.json()), 1)
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_metrics(self):
+        client.get('/residue_at_position', params={'systematic_id': 'SPBC359.03c', 'position': 3, 'dna_or_protein': 'protein'})
+        response = client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('http_requests_total{method="GET",route="/residue_at_position",status="200"}', response.text)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/residue_at_position"}', response.text)
+        self.assertIn('cache_hits_total{cache="genome"}', response.text)
+
+
+class OrganismTest(unittest.TestCase):
+
+    @unittest.skipUnless(os.path.isfile('data/sgd/genome.pickle'), 'needs the SGD genome data/sgd/genome.pickle')
+    def test_organism(self):
+        response = client.get('/residue_at_position', params={'systematic_id': 'YAL001C', 'position': 1, 'dna_or_protein': 'protein', 'organism': 'sgd'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, 'M')
+
+        # PomBase gene in the SGD genome
+        response = client.get('/residue_at_position', params={'systematic_id': 'SPBC359.03c', 'position': 1, 'dna_or_protein': 'protein', 'organism': 'sgd'})
+        self.assertEqual(response.status_code, 404)
+
+        response = client.get('/residue_at_position', params={'systematic_id': 'SPBC359.03c', 'position': 1, 'dna_or_protein': 'protein', 'organism': 'dummy'})
+        self.assertEqual(response.status_code, 422)
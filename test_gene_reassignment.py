@@ -0,0 +1,38 @@
+import unittest
+import pandas
+from residue_search import ResidueIndex
+from gene_reassignment import mutation_residues, get_allele_targets, get_modification_targets, find_candidate_genes
+
+
+class GeneReassignmentTest(unittest.TestCase):
+
+    def test_mutation_residues(self):
+        self.assertEqual(mutation_residues('V3A'), ['V3'])
+        self.assertEqual(mutation_residues('PLR-140-AAA'), ['P140', 'L141', 'R142'])
+        self.assertEqual(mutation_residues('K35*'), ['K35'])
+        self.assertEqual(mutation_residues('150-600'), [])
+
+    def test_find_candidate_genes(self):
+        allele_results = pandas.DataFrame({
+            'systematic_id': ['gene1', 'gene1', 'gene1'],
+            'allele_description': ['M1A,VK3AA', 'T5A', 'C2A'],
+            'allele_name': ['a1', 'a2', 'a3'],
+            'reference': ['PMID:1', 'PMID:1,PMID:2', 'PMID:1'],
+            'change_description_to': ['', '', ''],
+            'rules_applied': ['amino_acid_mutation:single_aa|amino_acid_mutation:multiple_aa', 'amino_acid_mutation:single_aa', 'amino_acid_mutation:single_aa'],
+            'sequence_error': ['|K4', 'T5', ''],
+        })
+        allele_errors = pandas.DataFrame({'systematic_id': ['gene1', 'gene1'], 'allele_name': ['a1', 'a2']})
+        allele_targets = get_allele_targets(allele_results, allele_errors, r'([A-Z]+)(\d+)([A-Z]+)')
+        self.assertEqual(allele_targets, {('gene1', 'PMID:1'): (['M1', 'V3', 'K4', 'T5'], ['a1', 'a2']), ('gene1', 'PMID:2'): (['T5'], ['a2'])})
+
+        index = ResidueIndex([('gene1', '', 'MCVAS'), ('gene2', '', 'MCVKTL'), ('gene3', '', 'MCVKS'), ('gene3', 'r1', 'MCV')])
+        candidates = find_candidate_genes({key: value[0] for key, value in allele_targets.items()}, index, 3)
+        self.assertEqual(candidates.values.tolist(), [['gene1', 'PMID:1', 'M1,V3,K4,T5', 'gene2', '', '']])
+
+        candidates = find_candidate_genes({key: value[0] for key, value in allele_targets.items()}, index, 3, max_mismatches=1, st_equivalent=True)
+        self.assertEqual(candidates['candidate_systematic_id'].tolist(), ['gene2', 'gene3'])
+
+        modification_errors = pandas.DataFrame({'systematic_id': ['gene1', 'gene1'], 'reference': ['PMID:1', 'PMID:1'], 'sequence_position': ['S5,V3', 'K4']})
+        self.assertEqual(get_modification_targets(modification_errors), {('gene1', 'PMID:1'): ['S5', 'V3', 'K4']})
+        self.assertEqual(find_candidate_genes(get_modification_targets(modification_errors), index, 3)['candidate_systematic_id'].tolist(), ['gene3'])
@@ -1,5 +1,9 @@
+import os
+import tempfile
 import unittest
-from generate_mutant_protein_sequences import transvar_variant_to_substitution_dict, variant_sequence_from_subsitution_dicts
+import pandas
+from Bio import SeqIO
+from generate_mutant_protein_sequences import transvar_variant_to_substitution_dict, variant_sequence_from_subsitution_dicts, write_variant_sequences
 
 
 class GenerateMutantProteinTest(unittest.TestCase):
@@ -99,3 +103,72 @@ class GenerateMutantProteinTest(unittest.TestCase):
         self.assertEqual(transvar_variant_to_substitution_dict(variant, len(sequence)), expected)
         expected_sequence = 'MAV*'
         self.assertEqual(variant_sequence_from_subsitution_dicts(sequence, [expected]), expected_sequence)
+
+    def test_overlapping_substitutions(self):
+
+        sequence = 'MAVLQQQQ*'
+
+        # Substitutions that do not change the length can overlap, the last one is applied
+        substitutions = [{'range': slice(1, 3), 'replace_by': 'CC'}, {'range': slice(2, 3), 'replace_by': 'T'}]
+        self.assertEqual(variant_sequence_from_subsitution_dicts(sequence, substitutions), 'MCTLQQQQ*')
+
+        # Substitutions inside a deletion are ignored
+        substitutions = [{'range': slice(1, 4), 'replace_by': ''}, {'range': slice(2, 3), 'replace_by': 'T'}]
+        self.assertEqual(variant_sequence_from_subsitution_dicts(sequence, substitutions), 'MQQQQ*')
+
+        # Substitutions that change the length cannot overlap
+        substitutions = [{'range': slice(1, 4), 'replace_by': ''}, {'range': slice(3, 5), 'replace_by': 'CCC'}]
+        with self.assertRaises(ValueError):
+            variant_sequence_from_subsitution_dicts(sequence, substitutions)
+
+        # The first stop codon truncates the sequence
+        substitutions = [{'range': slice(5, 9), 'replace_by': '*'}, {'range': slice(3, 9), 'replace_by': '*'}, {'range': slice(6, 7), 'replace_by': 'T'}]
+        self.assertEqual(variant_sequence_from_subsitution_dicts(sequence, substitutions), 'MAV*')
+
+    def test_many_substitutions(self):
+        # There is no limit on the number of substitutions that change the length of the sequence
+        sequence = 'A' * 200 + '*'
+        substitutions = [{'range': slice(i, i + 1), 'replace_by': 'CC'} for i in range(0, 200, 2)]
+        substitutions += [{'range': slice(i, i), 'replace_by': 'T'} for i in range(1, 200, 2)]
+        self.assertEqual(variant_sequence_from_subsitution_dicts(sequence, substitutions), 'CCTA' * 100 + '*')
+
+
+class WriteVariantSequencesTest(unittest.TestCase):
+
+    def test_write_variant_sequences(self):
+        genome = {
+            'gene1': {'CDS': None, 'peptide': 'MAVLQQQQ*'},
+            'gene2': {'CDS': None, 'peptide': 'M' + 'A' * 100 + '*'},
+        }
+        alleles = pandas.DataFrame([
+            ['gene2', 'allele_b', 'A2C', 'amino_acid_mutation', 'II:g.1A>T/c.4G>T/p.A2C'],
+            ['gene1', 'allele_b', 'V3C', 'amino_acid_mutation', 'I:g.7T>G/c.7T>G/p.V3C'],
+            ['gene1', 'allele_c', 'C1T', 'nucleotide_mutation', 'I:g.1C>T/c.1C>T/.'],
+            ['gene2', 'allele_a', 'A3*', 'nonsense_mutation', 'II:g.7G>T/c.7G>T/p.A3*'],
+            ['gene1', 'allele_a', 'A2C,L4*', 'amino_acid_mutation', 'I:g.4G>T/c.4G>T/p.A2C|I:g.10T>A/c.10T>A/p.L4*'],
+        ], columns=['systematic_id', 'allele_name', 'allele_description', 'allele_type', 'transvar_coordinates'])
+
+        expected = [
+            ('gene1|allele_a', 'MCV*'),
+            ('gene1|allele_b', 'MACLQQQQ*'),
+            ('gene2|allele_a', 'MA*'),
+            ('gene2|allele_b', 'MC' + 'A' * 99 + '*'),
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            alleles.to_csv(os.path.join(tmp_dir, 'alleles.tsv'), sep='\t', index=False)
+            for bgzip, processes in [(False, 1), (True, 2)]:
+                output_file = os.path.join(tmp_dir, 'variants.fasta' + ('.gz' if bgzip else ''))
+                write_variant_sequences(genome, os.path.join(tmp_dir, 'alleles.tsv'), output_file, bgzip, processes, chunk_size=2)
+                records = list(SeqIO.parse(output_file, 'fasta') if not bgzip else SeqIO.index(output_file, 'fasta').values())
+                self.assertEqual([(r.id, str(r.seq)) for r in records], expected)
+                self.assertEqual(records[0].description, 'gene1|allele_a amino_acid_mutation|A2C,L4*')
+                with open(output_file + '.fai') as ins:
+                    fai = [line.split('\t') for line in ins]
+                self.assertEqual([(row[0], int(row[1])) for row in fai], [(sequence_id, len(sequence)) for sequence_id, sequence in expected])
+                self.assertEqual(os.path.isfile(output_file + '.gzi'), bgzip)
+
+            # The .fai offsets point to the sequences
+            with open(os.path.join(tmp_dir, 'variants.fasta')) as ins:
+                fasta = ins.read()
+            for (sequence_id, length, offset, line_bases, line_width), (_, sequence) in zip(fai, expected):
+                self.assertEqual(fasta[int(offset):int(offset) + int(length)].replace('\n', '')[:60], sequence[:60])
@@ -0,0 +1,51 @@
+import unittest
+from genome_diff import compare_genomes, split_by_previous_results
+from genome_functions import Genome, build_transcript_index
+from Bio.SeqFeature import SeqFeature, FeatureLocation
+import pandas
+import pickle
+
+
+with open('data/genome.pickle', 'rb') as ins:
+    genome = pickle.load(ins)
+
+
+class GenomeDiffTest(unittest.TestCase):
+
+    def test_compare_genomes(self):
+
+        old_genome = Genome({k: genome[k] for k in ['SPMIT.01', 'SPMIT.02', 'SPMIT.03', 'SPMIT.04']})
+        old_genome['SPMIT.05.1'] = genome['SPMIT.05']
+        old_genome.transcript_index = build_transcript_index(old_genome)
+        self.assertEqual(compare_genomes(old_genome, old_genome)['affected_systematic_ids'], [])
+
+        # Plain dictionary, the transcript index is built on the fly
+        new_genome = {k: old_genome[k] for k in ['SPMIT.01', 'SPMIT.02', 'SPMIT.04']}
+        new_genome['SPMIT.05.2'] = genome['SPMIT.05']
+        new_genome['SPMIT.06'] = genome['SPMIT.06']
+        # Same location, different peptide
+        new_genome['SPMIT.01'] = dict(old_genome['SPMIT.01'])
+        new_genome['SPMIT.01']['peptide'] = 'M*'
+        # Different location
+        new_genome['SPMIT.02'] = dict(old_genome['SPMIT.02'])
+        cds = old_genome['SPMIT.02']['CDS']
+        new_genome['SPMIT.02']['CDS'] = SeqFeature(FeatureLocation(cds.location.start + 3, cds.location.end, cds.location.strand), type='CDS')
+
+        genome_diff = compare_genomes(old_genome, new_genome)
+        self.assertEqual(sorted(genome_diff['added']), ['SPMIT.05.2', 'SPMIT.06'])
+        self.assertEqual(sorted(genome_diff['removed']), ['SPMIT.03', 'SPMIT.05.1'])
+        self.assertEqual(list(genome_diff['location_changed']), ['SPMIT.02'])
+        self.assertEqual(list(genome_diff['location_changed']['SPMIT.02']), ['CDS'])
+        self.assertEqual(genome_diff['peptide_changed'], ['SPMIT.01'])
+        self.assertEqual(genome_diff['dna_changed'], [])
+        self.assertEqual(genome_diff['affected_systematic_ids'], ['SPMIT.01', 'SPMIT.02', 'SPMIT.03', 'SPMIT.05', 'SPMIT.05.1', 'SPMIT.05.2', 'SPMIT.06'])
+
+    def test_split_by_previous_results(self):
+
+        data = pandas.DataFrame({'systematic_id': ['A', 'A', 'B', 'C'], 'allele_description': ['V1A', 'V2A', 'V1A', 'V1A']}, index=[3, 2, 1, 0])
+        previous_results = pandas.DataFrame({'systematic_id': ['A', 'B', 'C'], 'allele_description': ['V1A', 'V1A', 'V1A'], 'result': ['a', 'b', 'c']})
+        data_to_process, reused = split_by_previous_results(data, previous_results, ['systematic_id', 'allele_description'], ['result'], {'B'})
+
+        self.assertEqual(list(data_to_process.index), [2, 1])
+        self.assertEqual(list(reused.index), [3, 0])
+        self.assertEqual(list(reused['result']), ['a', 'c'])
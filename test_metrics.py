@@ -0,0 +1,75 @@
+import functools
+import os
+import unittest
+from metrics import Counter, Histogram, CacheCollector, ProcessMemoryCollector, MetricFamily, merge_process_families, format_family, read_memory_rollup
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_counter(self):
+        counter = Counter('requests_total', 'Number of requests', ('route', 'status'), register=False)
+        counter.inc('/ganno', '200')
+        counter.inc('/ganno', '200')
+        counter.inc('/a"b', '404', amount=3)
+        self.assertEqual(counter.render(), [
+            '# HELP requests_total Number of requests',
+            '# TYPE requests_total counter',
+            'requests_total{route="/a\\"b",status="404"} 3',
+            'requests_total{route="/ganno",status="200"} 2',
+        ])
+
+    def test_histogram(self):
+        histogram = Histogram('duration_seconds', 'Duration', ('route',), buckets=(0.1, 1), register=False)
+        for value in [0.05, 0.1, 0.5, 5]:
+            histogram.observe(value, '/ganno')
+        self.assertEqual(histogram.render(), [
+            '# HELP duration_seconds Duration',
+            '# TYPE duration_seconds histogram',
+            'duration_seconds_bucket{route="/ganno",le="0.1"} 2',
+            'duration_seconds_bucket{route="/ganno",le="1.0"} 3',
+            'duration_seconds_bucket{route="/ganno",le="+Inf"} 4',
+            'duration_seconds_sum{route="/ganno"} 5.65',
+            'duration_seconds_count{route="/ganno"} 4',
+        ])
+
+    def test_collectors(self):
+        @functools.lru_cache
+        def cached_function(x):
+            return x
+
+        cached_function(1)
+        cached_function(1)
+        cached_function(2)
+        lines = CacheCollector({'cached_function': cached_function}, register=False).render()
+        self.assertIn('cache_hits_total{cache="cached_function"} 1', lines)
+        self.assertIn('cache_misses_total{cache="cached_function"} 2', lines)
+        self.assertIn('cache_size{cache="cached_function"} 2', lines)
+
+        lines = ProcessMemoryCollector(register=False).render()
+        self.assertTrue(any(line.startswith('process_max_resident_memory_bytes ') for line in lines))
+
+    def test_merge_process_families(self):
+        def families(requests, memory):
+            return [
+                MetricFamily('requests_total', 'counter', 'Number of requests', [('requests_total', ('route',), ('/ganno',), requests)]),
+                MetricFamily('memory_bytes', 'gauge', 'Memory', [('memory_bytes', (), (), memory)]),
+            ]
+
+        # The gauges of processes that do not exist anymore are skipped
+        dead_pid = 2 ** 22 + 1
+        merged = merge_process_families({os.getpid(): families(2, 100), dead_pid: families(3, 200)})
+        self.assertEqual([line for family in merged for line in format_family(family)], [
+            '# HELP requests_total Number of requests',
+            '# TYPE requests_total counter',
+            'requests_total{route="/ganno"} 5',
+            '# HELP memory_bytes Memory',
+            '# TYPE memory_bytes gauge',
+            f'memory_bytes{{pid="{os.getpid()}"}} 100',
+        ])
+
+    @unittest.skipUnless(os.path.isfile('/proc/self/smaps_rollup'), 'needs /proc/<pid>/smaps_rollup')
+    def test_read_memory_rollup(self):
+        memory = read_memory_rollup()
+        self.assertGreater(memory['Rss'], 0)
+        self.assertGreater(memory['Pss'], 0)
+        self.assertEqual(read_memory_rollup(-1), {})
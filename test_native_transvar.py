@@ -0,0 +1,56 @@
+import unittest
+from native_transvar import get_protein_variant_coordinates, get_nucleotide_variant_coordinates, get_codon_table, NativeAnnotationError
+import pickle
+
+
+with open('data/genome.pickle', 'rb') as ins:
+    genome = pickle.load(ins)
+
+
+class NativeTransvarTest(unittest.TestCase):
+
+    def test_protein_variant_coordinates(self):
+        # Expected values are the output of transvar panno
+        expected = [
+            ('SPMTR.02', 'p.S155K', 'mating_type_region:g.4351_4353delTCTinsAAG/c.463_465delTCTinsAAG/p.S155K'),
+            ('SPMTR.02', 'p.S155', 'mating_type_region:g.4351_4353/c.463_465/p.155S'),
+            ('SPMTR.02', 'p.150_155del', 'mating_type_region:g.4336_4353del18/c.448_465del18/p.L150_S155delLRNWFS'),
+            ('SPMIT.08', 'p.L113*', 'mitochondrial:g.16293T>A/c.338T>A/p.L113*'),
+            ('SPMIT.05', 'p.A37G', 'mitochondrial:g.10284C>G/c.110C>G/p.A37G'),
+            # Negative strand, spliced
+            ('SPBC460.02c', 'p.45_55del', 'chr_II_telomeric_gap:g.9354_9671del318/c.133_165del318/p.A45_F55del11'),
+            ('SPBC460.02c', 'p.50_51del', 'chr_II_telomeric_gap:g.9651_9656delCTTTTG/c.148_153delCAAAAG/p.Q50_K51delQK'),
+        ]
+        for systematic_id, variant, coordinates in expected:
+            self.assertEqual(get_protein_variant_coordinates(variant, genome[systematic_id]), coordinates)
+
+    def test_unsupported_variants(self):
+        # Wrong reference, deletion that transvar shifts, insertion, and position of the stop codon
+        for variant in ['p.S5A', 'p.5_9del', 'p.T5_F6insA', 'p.T5_F6delinsA', f'p.{len(genome["SPBC460.02c"]["peptide"])}']:
+            self.assertRaises(NativeAnnotationError, get_protein_variant_coordinates, variant, genome['SPBC460.02c'])
+
+    def test_nucleotide_variant_coordinates(self):
+        # Expected values are the output of transvar ganno
+        expected = [
+            ('SPMTR.02', 'g.4197G>A', 'mating_type_region:g.4197G>A/c.309G>A/p.M103I'),
+            ('SPMTR.02', 'g.4005_4008delTCCAinsTTGC', 'mating_type_region:g.4006_4008delinsTGC/c.118_120delinsTGC/p.P40C'),
+            ('SPMTR.02', 'g.3961_3964delAGAAinsTTGG', 'mating_type_region:g.3961_3964delinsTTGG/c.73_76delinsTTGG/p.R25_I26delinsLV'),
+            # Deletions shifted to the right, and out of phase
+            ('SPMTR.02', 'g.4032_4034del', 'mating_type_region:g.4033_4035delCGA/c.145_147delCGA/p.R49delR'),
+            ('SPMTR.02', 'g.4133_4135del', 'mating_type_region:g.4133_4135delCTT/c.245_247delCTT/p.A82_L83delinsV'),
+            # Negative strand, spliced
+            ('SPBC460.02c', 'g.9651C>A', 'chr_II_telomeric_gap:g.9651C>A/c.153G>T/p.K51N'),
+            ('SPBC460.02c', 'g.9365G>A', 'chr_II_telomeric_gap:g.9365G>A/c.154C>T/p.L52F'),
+            ('SPBC460.02c', 'g.9200_9208del', 'chr_II_telomeric_gap:g.9201_9209delGTCGAAGTT/c.311_319delACTTCGACA/p.N104_D106delNFD'),
+        ]
+        for systematic_id, variant, coordinates in expected:
+            self.assertEqual(get_nucleotide_variant_coordinates(variant, genome[systematic_id], get_codon_table()), coordinates)
+
+        # TGA is not a stop codon in the mitochondrial table
+        self.assertEqual(get_nucleotide_variant_coordinates('g.10264G>A', genome['SPMIT.05'], get_codon_table()), 'mitochondrial:g.10264G>A/c.90G>A/p.W30*')
+        self.assertEqual(get_nucleotide_variant_coordinates('g.10264G>A', genome['SPMIT.05'], get_codon_table(4)), 'mitochondrial:g.10264G>A/c.90G>A/p.W30W')
+
+    def test_unsupported_nucleotide_variants(self):
+        # Wrong reference, frameshift, deletion next to splice site, intron, insertion
+        for variant in ['g.9300_9301delAAinsCC', 'g.9000_9001del', 'g.9364_9368del', 'g.9500T>A', 'g.9300_9301insA']:
+            self.assertRaises(NativeAnnotationError, get_nucleotide_variant_coordinates, variant, genome['SPBC460.02c'], get_codon_table())
@@ -0,0 +1,39 @@
+import unittest
+import numpy
+from allele_fixes import primer_mismatches, best_primer_placements, primer_mutagenesis
+
+
+def as_array(seq):
+    return numpy.frombuffer(seq.encode(), dtype=numpy.uint8)
+
+
+class PrimerMutagenesisTest(unittest.TestCase):
+
+    def test_primer_mismatches(self):
+        distances, = primer_mismatches(as_array('ACGTACGA'), [as_array('ACGA')])
+        self.assertEqual(distances.tolist(), [1, 3, 4, 4, 0])
+        self.assertEqual(primer_mismatches(as_array('AC'), [as_array('ACG')])[0].tolist(), [])
+
+    def test_best_primer_placements(self):
+        # The reverse complement of the primer (CGTC) aligns with one mismatch at positions 1 and 5, the last one is returned
+        self.assertEqual(best_primer_placements('ACGTACGTA', 'GACG', 1), [(True, 5, 1), (False, 3, 1)])
+        self.assertEqual(best_primer_placements('ACGTACGTA', 'GACG', 0), [])
+        self.assertEqual(best_primer_placements('ACGTACGTA', 'ACGT', 0), [(True, 4, 0), (False, 4, 0)])
+
+    def test_report(self):
+        main_seq = 'ATGAAACCCGGGTAA'
+        report = primer_mutagenesis(main_seq, 'AAAGCCGGG', 1, True)
+        self.assertEqual(report, '\n'.join([
+            '> with the forward primer and 1 mistmatches',
+            'mutations observed at DNA level: C7G,',
+            'original_sequence:  ATGAAACCCGGGTAA',
+            '                          |        ',
+            'mutated_sequence:   ATGAAAGCCGGGTAA',
+            '',
+            'mutations observed at peptide level:P3A,',
+            'original_sequence: MKPG*',
+            '                     |  ',
+            'mutated_sequence:  MKAG*',
+            ''
+        ]))
+        self.assertTrue(primer_mutagenesis(main_seq, 'TTTTTTTTT', 2, True).startswith('Nothing found'))
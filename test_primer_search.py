@@ -0,0 +1,60 @@
+import unittest
+import os
+import tempfile
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from Bio.SeqFeature import SeqFeature, FeatureLocation, CompoundLocation
+from primer_search import build_primer_index, find_primer_in_genome, PrimerIndex, get_genome_contigs
+
+
+def make_genome():
+    # Gene on the + strand with an intron, gene on the - strand without introns
+    contig = SeqRecord(Seq('CCCCC' + 'ATGAAACCCGGGTTT' + 'GTAAGTTTTTTTTTTAG' + 'GATGAATAA' + 'CCCCCCCC' + 'TTAGCAGCAGCAGCACAT' + 'CCCCC'), id='I')
+    cds1 = SeqFeature(CompoundLocation([FeatureLocation(5, 20, 1), FeatureLocation(37, 46, 1)]), type='CDS')
+    cds2 = SeqFeature(FeatureLocation(54, 72, -1), type='CDS')
+    genome = {
+        'gene1': {'contig': contig, 'CDS': cds1},
+        'gene2': {'contig': contig, 'CDS': cds2},
+    }
+    for gene in genome.values():
+        gene['peptide'] = gene['CDS'].extract(contig).seq.translate()
+    return genome
+
+
+class PrimerSearchTest(unittest.TestCase):
+
+    def test_index(self):
+        genome = make_genome()
+        self.assertEqual(list(get_genome_contigs(genome)), ['I', 'gene1:CDS'])
+        index = build_primer_index(genome, 4)
+        seq = str(genome['gene1']['contig'].seq)
+        # Forward and reverse complement, exact and with mismatches (also found in the spliced CDS of gene1, at 78)
+        self.assertEqual(index.search(seq[5:20], 0), [(5, 1, 0), (78, 1, 0)])
+        self.assertEqual(index.search(str(Seq(seq[5:20]).reverse_complement()), 0), [(5, -1, 0), (78, -1, 0)])
+        self.assertEqual(index.search('ATGAAAGCCGGGTTT', 1), [(5, 1, 1), (78, 1, 1)])
+        # Placements at the end of the contig (not indexed as k-mers)
+        self.assertEqual(index.search(seq[-6:], 0), [(len(seq) - 6, 1, 0)])
+
+    def test_find_primer_in_genome(self):
+        genome = make_genome()
+        index = build_primer_index(genome, 4)
+        # P3A in gene1
+        hits = find_primer_in_genome('ATGAAAGCCGGGTTT', 1, index, genome)
+        self.assertEqual(hits, [('I', 6, 20, 1, 1, [('gene1', 1, 'C7G', 'P3A')])])
+        # Across the exon border of gene1, with the reverse complement (the gene coordinates include the intron)
+        hits = find_primer_in_genome(str(Seq('GGGTTTGATGAC').reverse_complement()), 1, index, genome)
+        self.assertEqual(hits, [('I', 15, 43, -1, 1, [('gene1', -1, 'A38C', 'E7D')])])
+        # gene2 is on the - strand
+        hits = find_primer_in_genome('ATGTTCTG', 1, index, genome)
+        self.assertEqual(hits, [('I', 65, 72, -1, 1, [('gene2', 1, 'G5T', 'C2F')])])
+        # Mutation upstream of gene2
+        hits = find_primer_in_genome('GGGGAATGTGC', 1, index, genome)
+        self.assertEqual(hits, [('I', 67, 77, -1, 1, [('gene2', 1, 'G(-1)A', '')])])
+
+    def test_save_load(self):
+        index = build_primer_index(make_genome(), 4)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index.save(os.path.join(tmp_dir, 'index.npz'))
+            loaded = PrimerIndex.load(os.path.join(tmp_dir, 'index.npz'))
+        self.assertEqual(loaded.contig_ids, index.contig_ids)
+        self.assertEqual(loaded.search('ATGAAAGCCGGGTTT', 1), index.search('ATGAAAGCCGGGTTT', 1))
@@ -1,5 +1,8 @@
-from common_autofix_functions import format_auto_fix
+from common_autofix_functions import format_auto_fix, apply_fixes_by_gene, apply_old_coords_fix, apply_multi_shift_fix, apply_histone_fix, get_preferred_fix, fix_columns
 import unittest
+import pickle
+import json
+import pandas
 from protein_modification_qc import check_func
 
 
@@ -95,3 +98,29 @@ class ProteinModificationFormattingTest(unittest.TestCase):
         example_dict['auto_fix_to'] = 'S1,??'
         fixes, comment = format_auto_fix(example_dict, 'sequence_position', 'change_sequence_position_to')
         self.assertEqual(fixes, '??')
+
+    def test_apply_fixes_by_gene(self):
+        with open('data/genome.pickle', 'rb') as ins:
+            genome = pickle.load(ins)
+        with open('data/coordinate_changes_dict.json') as ins:
+            coordinate_changes_dict = json.load(ins)
+
+        data = pandas.DataFrame({
+            'systematic_id': ['SPMTR.02', 'SPMIT.01', 'SPMTR.02', 'dummy'],
+            'sequence_position': ['K3,R4,V5,A6', 'L100,*120', 'M1', 'A1']
+        }, index=[5, 3, 9, 1])
+
+        # Same result as applying the fixes row by row
+        expected = data.copy()
+        extra_cols = expected.apply(apply_old_coords_fix, axis=1, result_type='expand', args=[coordinate_changes_dict, 'sequence_position'])
+        expected['old_coords_fix'], expected['old_coords_revision'], expected['old_coords_location'] = extra_cols[0], extra_cols[1], extra_cols[2]
+        expected['multi_shift_fix'] = expected.apply(apply_multi_shift_fix, axis=1, args=[genome, 'sequence_position'])
+        expected['histone_fix'] = expected.apply(apply_histone_fix, axis=1, args=[genome, 'sequence_position'])
+        extra_cols = expected.apply(get_preferred_fix, axis=1, result_type='expand')
+        expected['auto_fix_to'], expected['auto_fix_comment'] = extra_cols[0], extra_cols[1]
+
+        for processes in [1, 2]:
+            fixes = apply_fixes_by_gene(data, genome, coordinate_changes_dict, 'sequence_position', processes)
+            pandas.testing.assert_frame_equal(fixes, expected[fix_columns])
+        self.assertEqual(fixes.loc[5, 'auto_fix_to'], 'K2,R3,V4,A5')
+        self.assertEqual(fixes.loc[3, 'auto_fix_to'], 'L204,?')
@@ -0,0 +1,43 @@
+import unittest
+import pickle
+import json
+from residue_search import ResidueIndex, parse_residues, build_residue_index, find_protein_by_residues
+
+
+class ResidueSearchTest(unittest.TestCase):
+
+    def test_parse_residues(self):
+        self.assertEqual(parse_residues('T12,S3,s3, Y1'), [('Y', 0), ('S', 2), ('T', 11)])
+        self.assertRaises(ValueError, parse_residues, 'S3,3')
+        self.assertRaises(ValueError, parse_residues, 'S0')
+
+    def test_search(self):
+        index = ResidueIndex([('gene1', '', 'MSTK'), ('gene2', '', 'MTSKA'), ('gene2', 'r1', 'MSS'), ('gene3', '', '')])
+        self.assertEqual(find_protein_by_residues('S2,T3', index), [('gene1', '', [])])
+        self.assertEqual(find_protein_by_residues('S2,T3', index, st_equivalent=True), [('gene1', '', []), ('gene2', '', []), ('gene2', 'r1', [])])
+        # Positions outside of the peptide are mismatches
+        self.assertEqual(find_protein_by_residues('S2,A5', index, max_mismatches=1), [('gene1', '', ['A5']), ('gene2', '', ['S2']), ('gene2', 'r1', ['A5'])])
+        self.assertEqual(len(find_protein_by_residues('S2,A5', index, max_mismatches=2)), 4)
+
+    def test_genome(self):
+        # Compare with checking all peptides one by one
+        with open('data/genome.pickle', 'rb') as ins:
+            genome = pickle.load(ins)
+        with open('data/coordinate_changes_dict.json') as ins:
+            coordinate_changes_dict = json.load(ins)
+        index = build_residue_index(genome, coordinate_changes_dict)
+
+        for systematic_id in list(coordinate_changes_dict)[:20]:
+            if systematic_id not in genome or 'peptide' not in genome[systematic_id]:
+                continue
+            peptide = genome[systematic_id]['peptide']
+            residues = ','.join(f'{peptide[i]}{i + 1}' for i in range(1, len(peptide), max(len(peptide) // 6, 1)))
+            for max_mismatches in [0, 2]:
+                expected = list()
+                for sid, revision, pep in zip(index.systematic_ids, index.revisions, [str(genome[s]['peptide']) for s in genome if 'peptide' in genome[s]] + [r['old_alignment'].replace('-', '') for s in coordinate_changes_dict for r in coordinate_changes_dict[s]]):
+                    mismatches = [r for r in residues.split(',') if len(pep) < int(r[1:]) or pep[int(r[1:]) - 1] != r[0]]
+                    if len(mismatches) <= max_mismatches:
+                        expected.append((sid, revision))
+                matches = find_protein_by_residues(residues, index, max_mismatches=max_mismatches)
+                self.assertIn((systematic_id, ''), [m[:2] for m in matches])
+                self.assertEqual(sorted(m[:2] for m in matches), sorted(expected))
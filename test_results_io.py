@@ -0,0 +1,53 @@
+import unittest
+import importlib.util
+import os
+import tempfile
+import pandas
+from results_io import to_columnar, from_columnar, write_results, read_results, results_file_path, check_output_formats
+
+pyarrow_installed = importlib.util.find_spec('pyarrow') is not None
+
+
+class ResultsIOTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = pandas.DataFrame({
+            'systematic_id': ['SPMTR.02', 'SPMTR.02', 'SPBC460.02c'],
+            'allele_parts': ['K67A', 'K67A|PL116AA', ''],
+            'needs_fixing': [False, True, True],
+            'sequence_error': ['', '|l117', ''],
+            'solution_index': ['', 0, 1],
+            'unique_id': [1, 2, 3]
+        })
+
+    def test_columnar_conversion(self):
+        typed_data = to_columnar(self.data)
+        self.assertEqual(typed_data['allele_parts'].tolist(), [['K67A'], ['K67A', 'PL116AA'], []])
+        self.assertEqual(typed_data['sequence_error'].tolist(), [[], ['', 'l117'], []])
+        self.assertEqual(typed_data['needs_fixing'].dtype, bool)
+
+        # Same as writing and reading the TSV
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tsv_file = os.path.join(tmp_dir, 'results.tsv')
+            write_results(self.data, tsv_file)
+            pandas.testing.assert_frame_equal(from_columnar(typed_data), pandas.read_csv(tsv_file, sep='\t', na_filter=False))
+            pandas.testing.assert_frame_equal(read_results(tsv_file, dtype=str), pandas.read_csv(tsv_file, sep='\t', na_filter=False, dtype=str))
+
+    def test_output_formats(self):
+        self.assertEqual(results_file_path('results/allele_results.tsv', 'parquet'), 'results/allele_results.parquet')
+        self.assertEqual(results_file_path('results/allele_results.tsv', 'tsv'), 'results/allele_results.tsv')
+        self.assertRaises(ValueError, check_output_formats, ['csv'])
+        if not pyarrow_installed:
+            self.assertRaises(ImportError, check_output_formats, ['tsv', 'parquet'])
+
+    @unittest.skipUnless(pyarrow_installed, 'pyarrow not installed')
+    def test_columnar_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tsv_file = os.path.join(tmp_dir, 'results.tsv')
+            write_results(self.data, tsv_file, ['tsv', 'parquet', 'feather'])
+            expected = pandas.read_csv(tsv_file, sep='\t', na_filter=False)
+            self.assertEqual(pandas.read_parquet(results_file_path(tsv_file, 'parquet'))['allele_parts'].apply(list).tolist(), [['K67A'], ['K67A', 'PL116AA'], []])
+            pandas.testing.assert_frame_equal(read_results(tsv_file), expected)
+            # Only the columnar file
+            os.remove(tsv_file)
+            pandas.testing.assert_frame_equal(read_results(tsv_file), expected)
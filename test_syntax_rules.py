@@ -1,11 +1,14 @@
-from models import SyntaxRule, AllowedTypes, find_rule
+from models import SyntaxRule, AllowedTypes, find_rule, parse_grammar, CompiledSyntaxRule
 from grammar import aminoacid_grammar_old, allowed_types_dict, composed_types_dict, nucleotide_grammar_old,\
     aminoacid_grammar, transition_old2new_aminoacid_grammar, transition_old2new_nucleotide_grammar, nucleotide_grammar,\
     transition_new2old_aminoacid_grammar, transition_new2old_nucleotide_grammar
 
-from refinement_functions import check_allele_description
+from refinement_functions import check_allele_description, check_and_parse_allele_description, get_parsed_capture_groups, split_multiple_aa_groups,\
+    write_parsed_parts, read_parsed_parts, parsed_parts_key
 import unittest
 import pickle
+import tempfile
+import os
 from ctd_support import ctd_check_sequence, ctd_convert_to_normal_variant
 
 
@@ -28,6 +31,40 @@ class SyntaxRulesTest(unittest.TestCase):
         self.assertEqual(syntax_rule.type, 'nucleotide_mutation')
         self.assertEqual(syntax_rule.rule_name, 'multiple_nt')
 
+    def test_compiled_syntax_rules(self):
+        syntax_rules = [SyntaxRule.parse_obj(r) for r in aminoacid_grammar]
+        compiled_rules = parse_grammar(aminoacid_grammar)
+        self.assertEqual(len(syntax_rules), len(compiled_rules))
+
+        for syntax_rule, compiled_rule in zip(syntax_rules, compiled_rules):
+            self.assertIsInstance(compiled_rule, CompiledSyntaxRule)
+            self.assertEqual(compiled_rule.type, syntax_rule.type)
+            self.assertEqual(compiled_rule.rule_name, syntax_rule.rule_name)
+            self.assertEqual(compiled_rule.pattern.pattern, syntax_rule.regex)
+
+        compiled_rule = find_rule(compiled_rules, 'amino_acid_mutation', 'multiple_aa')
+        self.assertEqual(compiled_rule.get_groups('AP123VL', None), ('AP', '123', 'VL'))
+        self.assertRaises(ValueError, compiled_rule.get_groups, 'A123A', None)
+
+        # The compiled rules cannot be modified
+        with self.assertRaises(AttributeError):
+            compiled_rule.regex = 'blah'
+
+        # Invalid rules are rejected when the grammar is loaded
+        with self.assertRaises(ValueError):
+            parse_grammar([{'type': 'dummy', 'rule_name': 'dummy'}])
+
+    def test_allowed_types(self):
+        # Composed types and the types they are made of give the same result, in any combination
+        self.assertEqual(allowed_types[frozenset({'amino_acid_mutation', 'partial_amino_acid_deletion'})], 'amino_acid_deletion_and_mutation')
+        self.assertEqual(allowed_types[frozenset({'amino_acid_deletion_and_mutation'})], 'amino_acid_deletion_and_mutation')
+        self.assertEqual(allowed_types[frozenset({'amino_acid_deletion_and_mutation', 'amino_acid_mutation'})], 'amino_acid_deletion_and_mutation')
+        self.assertEqual(allowed_types[['amino_acid_mutation', 'amino_acid_mutation']], 'amino_acid_mutation')
+        self.assertRaises(KeyError, allowed_types.__getitem__, frozenset({'amino_acid_mutation', 'nucleotide_mutation'}))
+
+        rules_applied = ['amino_acid_mutation:single_aa|partial_amino_acid_deletion:multiple_aa', 'nonsense_mutation:stop_codon_star', 'amino_acid_mutation:single_aa|amino_acid_mutation:multiple_aa']
+        self.assertEqual(allowed_types.classify_rules_applied(rules_applied), ['amino_acid_deletion_and_mutation', 'partial_amino_acid_deletion', 'amino_acid_mutation'])
+
     def test_class_methods_amino_acids(self):
         syntax_rules = [SyntaxRule.parse_obj(r) for r in aminoacid_grammar]
 
@@ -226,6 +263,35 @@ class SyntaxRulesTest(unittest.TestCase):
                         print(red + f'> error in file {f} line {line_nb + 2}:' + line.strip() + no_color)
                         raise
 
+    def test_parsed_parts(self):
+        syntax_rules = parse_grammar(aminoacid_grammar)
+        row = {'systematic_id': 'SPMTR.02', 'allele_name': 'dummy', 'allele_description': 'k67a pl116aa', 'allele_type': 'amino_acid_mutation'}
+        output, parts = check_and_parse_allele_description(row['allele_description'], syntax_rules, row['allele_type'], allowed_types, genome['SPMTR.02'])
+        self.assertEqual(output, check_allele_description(row['allele_description'], syntax_rules, row['allele_type'], allowed_types, genome['SPMTR.02']))
+        self.assertEqual([p['part'] for p in parts], output['allele_parts'].split('|'))
+        self.assertEqual([p['rule'] for p in parts], output['rules_applied'].split('|'))
+        self.assertEqual([p['formatted'] for p in parts], output['change_description_to'].split(','))
+        self.assertEqual(parts[1]['groups'], ['pl', '116', 'aa'])
+        self.assertEqual(parts[1]['span'], [5, 12])
+
+        # No parts if there is a pattern error
+        self.assertEqual(check_and_parse_allele_description('k67a XX', syntax_rules, row['allele_type'], allowed_types, genome['SPMTR.02'])[1], [])
+
+        # Round trip through the file
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            parsed_parts_file = os.path.join(tmp_dir, 'parsed_parts.jsonl')
+            write_parsed_parts(parsed_parts_file, {parsed_parts_key(row): parts})
+            parsed_parts = read_parsed_parts(parsed_parts_file)
+
+        row = row | output
+        capture_groups = get_parsed_capture_groups(row, parsed_parts)
+        self.assertEqual(capture_groups, [('k', '67', 'a'), ('pl', '116', 'aa')])
+        self.assertEqual(split_multiple_aa_groups(capture_groups[1]), ['P116A', 'L117A'])
+
+        # Fall back to the regex if the parts don't match those in the row
+        self.assertEqual(get_parsed_capture_groups(row | {'rules_applied': 'amino_acid_mutation:single_aa|amino_acid_mutation:single_aa'}, parsed_parts), [None, None])
+        self.assertEqual(get_parsed_capture_groups(row | {'allele_name': 'other'}, parsed_parts), [None, None])
+
 
 class CtdSupportTest(unittest.TestCase):
 
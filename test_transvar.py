@@ -1,5 +1,8 @@
-from transvar_functions import get_transvar_str_annotation, parse_transvar_string, get_anno_db
+from transvar_functions import get_transvar_str_annotation, run_transvar_annotation, parse_transvar_string, get_anno_db, SingleFlightCache
 import unittest
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from transvar.err import SequenceRetrievalError, InvalidInputError
 
 db = get_anno_db('data/pombe_genome.gtf.transvardb', 'data/pombe_genome.fa')
@@ -86,4 +89,60 @@ class TransvarTest(unittest.TestCase):
         variant_list = parse_transvar_string(get_transvar_str_annotation('panno', 'SPBC1198.04c:p.N3A', db))
         self.assertEqual(len(variant_list), 2)
 
-
+    def test_concurrent_annotations(self):
+        # Annotations from several threads (e.g. concurrent API requests) should not mix their output. We call
+        # run_transvar_annotation directly, since get_transvar_str_annotation would return the cached results
+        variants = [('ganno', 'II:g.178497T>A'), ('panno', 'SPBC1198.04c:p.N3A'), ('canno', 'SPAC3F10.09:c.5A>T')] * 4
+        expected = [run_transvar_annotation(variant_type, description, db) for variant_type, description in variants]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            result = list(executor.map(lambda v: run_transvar_annotation(v[0], v[1], db), variants))
+        self.assertEqual(result, expected)
+
+
+class SingleFlightCacheTest(unittest.TestCase):
+
+    def test_concurrent_requests(self):
+        cache = SingleFlightCache(ttl=60, maxsize=10)
+        calls = list()
+
+        def slow_function(key):
+            calls.append(key)
+            time.sleep(0.2)
+            return key * 2
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            result = list(executor.map(lambda key: cache.get(key, lambda: slow_function(key)), [1, 2, 1, 1, 2, 1, 2, 1]))
+        self.assertEqual(result, [2, 4, 2, 2, 4, 2, 4, 2])
+        self.assertEqual(sorted(calls), [1, 2])
+
+        # Cached
+        self.assertEqual(cache.get(1, lambda: slow_function(1)), 2)
+        self.assertEqual(len(calls), 2)
+
+    def test_expiry_and_errors(self):
+        cache = SingleFlightCache(ttl=0.1, maxsize=2)
+        self.assertEqual(cache.get('a', lambda: 1), 1)
+        self.assertEqual(cache.get('a', lambda: 2), 1)
+        time.sleep(0.2)
+        self.assertEqual(cache.get('a', lambda: 2), 2)
+
+        # Only maxsize keys are kept
+        cache.get('b', lambda: 1)
+        cache.get('c', lambda: 1)
+        self.assertEqual(list(cache.results), ['b', 'c'])
+
+        # Errors are raised in all the threads waiting, but not cached
+        started = threading.Event()
+
+        def failing_function():
+            started.set()
+            time.sleep(0.2)
+            raise ValueError('error')
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(cache.get, 'd', failing_function)
+            started.wait()
+            second = executor.submit(cache.get, 'd', lambda: 'not called')
+            self.assertRaises(ValueError, first.result)
+            self.assertRaises(ValueError, second.result)
+        self.assertEqual(cache.get('d', lambda: 1), 1)
@@ -1,10 +1,23 @@
 from transvar_main_script import parser_add_annotation, parser_add_mutation, parser_add_general
 from transvar.anno import read_config, main_one, AnnoDB, print_header
+from transvar import faidx
 import argparse
+import os
 from functools import partial
 import io
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from contextlib import redirect_stdout, redirect_stderr
+from typing import NamedTuple
 from pydantic import BaseModel
+from metrics import Histogram
+
+# Transvar writes its output to sys.stdout, which is replaced for the whole process while it runs, and the AnnoDB
+# reads from shared file handles and a global reference genome, so only one annotation runs at a time (see get_transvar_str_annotation)
+transvar_lock = threading.Lock()
 
 
 class TransvarAnnotation(BaseModel):
@@ -36,6 +49,103 @@ def parse_transvar_string(transvar_str: str) -> list[TransvarAnnotation]:
     return result
 
 
+class ThreadOutputStream(io.StringIO):
+    """
+    Captures what the thread that creates it writes, and passes what other threads write (e.g. other requests in the
+    API) to the fallback stream, so that it does not end up in the captured output.
+    """
+
+    def __init__(self, fallback):
+        super().__init__()
+        self.thread_id = threading.get_ident()
+        self.fallback = fallback
+
+    def write(self, s):
+        if threading.get_ident() != self.thread_id:
+            return self.fallback.write(s)
+        return super().write(s)
+
+
+class SingleFlightCacheInfo(NamedTuple):
+    hits: int
+    # Requests that waited for the result of an identical request that was running
+    coalesced: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class SingleFlightCache:
+    """
+    Cache of the results of a function by key, for ttl seconds and at most maxsize keys. If the result of a key is being
+    computed when it is requested from another thread, the other thread waits for it instead of computing it again.
+    Errors are passed to the threads waiting for the result, but not cached.
+    """
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        # key -> (expiry time, result), in order of use
+        self.results: OrderedDict = OrderedDict()
+        self.in_flight: dict[object, Future] = dict()
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+    def get(self, key, func):
+        """The result of func() for key, from the cache if possible."""
+        with self.lock:
+            if key in self.results:
+                expiry, result = self.results[key]
+                if expiry > time.monotonic():
+                    self.results.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self.results[key]
+            future = self.in_flight.get(key)
+            if future is None:
+                future = self.in_flight[key] = Future()
+                owner = True
+                self.misses += 1
+            else:
+                owner = False
+                self.coalesced += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            with self.lock:
+                del self.in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            del self.in_flight[key]
+            self.results[key] = (time.monotonic() + self.ttl, result)
+            while len(self.results) > self.maxsize:
+                self.results.popitem(last=False)
+        future.set_result(result)
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+
+    def cache_info(self) -> SingleFlightCacheInfo:
+        with self.lock:
+            return SingleFlightCacheInfo(self.hits, self.coalesced, self.misses, self.maxsize, len(self.results))
+
+
+# Results of get_transvar_str_annotation by (variant_type, variant_description, db)
+transvar_annotation_cache = SingleFlightCache(ttl=60, maxsize=10000)
+
+transvar_duration = Histogram('transvar_annotation_duration_seconds', 'Duration of the transvar annotations that were not cached, including the wait for other annotations', ('variant_type',))
+
+
 class TransvarCustomString(str):
     """Hacky class to circunvent https://github.com/zwdzwd/transvar/issues/59
     """
@@ -58,14 +168,54 @@ def get_anno_db(transvar_db_file, genome_sequence_file) -> AnnoDB:
     parser_add_annotation(annotation_parser)
     annotation_args = annotation_parser.parse_args(['--ensembl', transvar_db_file, '--reference', genome_sequence_file])
     config = read_config()
-    return AnnoDB(annotation_args, config)
+    # Transvar reads the sequences from a global reference genome, which AnnoDB replaces with the one of the new database,
+    # so we keep the one of each database to use it when annotating (see run_transvar_annotation), and restore the
+    # previous one, while no annotation is running
+    with transvar_lock:
+        previous_reference = getattr(faidx, 'refgenome', None)
+        try:
+            db = AnnoDB(annotation_args, config)
+            db.reference = faidx.refgenome
+        finally:
+            faidx.refgenome = previous_reference
+    db.process_id = os.getpid()
+    return db
+
+
+def reopen_anno_db_files(db: AnnoDB):
+    """
+    Reopen the files that the transvar databases of db read by seeking. Needed in processes forked after loading db
+    (see api_server.py), otherwise they share the file offsets with the parent and the other forked processes. Done
+    by run_transvar_annotation when db was loaded by another process.
+    """
+    for transvar_db in db.dbs:
+        if getattr(transvar_db, 'dbfh', None) is not None:
+            transvar_db.dbfh.close()
+            transvar_db.dbfh = open(transvar_db.dbfn, 'rt')
+    db.process_id = os.getpid()
 
 
 def get_transvar_str_annotation(variant_type: str, variant_description: str, db: AnnoDB) -> str:
+    """
+    Transvar output for the variant, identical requests made at the same time from several threads (e.g. the same query
+    sent to the API from several places) are computed once, and the result is cached for a short time (see transvar_annotation_cache).
+    """
 
     if variant_type not in ['ganno', 'canno', 'panno']:
         raise ValueError("variant_type must be one of 'ganno', 'canno', 'panno'")
 
+    def timed_annotation():
+        start = time.perf_counter()
+        try:
+            return run_transvar_annotation(variant_type, variant_description, db)
+        finally:
+            transvar_duration.observe(time.perf_counter() - start, variant_type)
+
+    return transvar_annotation_cache.get((variant_type, variant_description, db), timed_annotation)
+
+
+def run_transvar_annotation(variant_type: str, variant_description: str, db: AnnoDB) -> str:
+
     parser = argparse.ArgumentParser(description=__doc__)
     subparsers = parser.add_subparsers()
     p = subparsers.add_parser('ganno', help='annotate gDNA element')
@@ -93,13 +243,17 @@ def get_transvar_str_annotation(variant_type: str, variant_description: str, db:
     args.suspend = True
     args.i = TransvarCustomString(args.i)
 
-    output_stream = io.StringIO()
-    error_stream = io.StringIO()
-    with redirect_stderr(error_stream):
-        with redirect_stdout(output_stream):
-            if (not args.vcf) and (not args.noheader):
-                print(print_header(args))
-            args.func(args)
+    with transvar_lock:
+        if db.process_id != os.getpid():
+            reopen_anno_db_files(db)
+        faidx.refgenome = db.reference
+        output_stream = ThreadOutputStream(sys.stdout)
+        error_stream = ThreadOutputStream(sys.stderr)
+        with redirect_stderr(error_stream):
+            with redirect_stdout(output_stream):
+                if (not args.vcf) and (not args.noheader):
+                    print(print_header(args))
+                args.func(args)
 
     output_str = output_stream.getvalue()
     output_stream.close()
@@ -23,6 +23,7 @@ import glob
 import pandas
 import numpy as np
 import warnings
+from results_io import read_results
 
 # Column names are not consistent across files
 column_names = [
@@ -42,7 +43,7 @@ modification_sub_path = 'trunk/external_data/modification_files'
 
 modification_folder = os.path.join(svn_folder, modification_sub_path)
 
-fixes = pandas.read_csv('results/protein_modification_auto_fix.tsv', sep='\t', na_filter=False)
+fixes = read_results('results/protein_modification_auto_fix.tsv')
 fixed_references = set(fixes.reference)
 
 # This is an extra control, to make sure we are not replacing by empty strings (no solution found),